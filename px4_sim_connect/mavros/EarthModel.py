@@ -81,6 +81,9 @@ import numpy as np
 #
 # 使用最终确定的转换参数，对所有待转换点进行坐标转换，得到在目标坐标系下的坐标。
 
+## @brief ecef2lla_bowring默认迭代次数，由earth_model_bench.py的精度测试确定（1mm容差下1次即满足）
+BOWRING_ITERS = 1
+
 class EarthModel():
     
     ## @brief EarthModel类的构造函数
@@ -287,8 +290,6 @@ class EarthModel():
         y2 = y ** 2 
         z2 = z ** 2 
     
-        self.wgs84_a = 6378137   # earth radius in meters
-        self.wgs84_b = 6356752.3142    # earth semiminor in meters 
         e = math.sqrt (1-(self.wgs84_b/self.wgs84_a)**2) 
         b2 = self.wgs84_b*self.wgs84_b 
         e2 = e ** 2 
@@ -312,19 +313,46 @@ class EarthModel():
         
         lat = math.atan( (z + ep*ep*zo)/r ) 
     
-        temp = math.atan(y/x) 
-        if x >=0 :    
-            long = temp 
-        elif (x < 0) & (y >= 0):
-            long = math.pi + temp 
-        else :
-            long = temp - math.pi 
+        long = math.atan2(y, x) 
     
         lat0 = lat/(math.pi/180) 
         lon0 = long/(math.pi/180) 
         h0 = height 
     
         return lat0, lon0, h0
+
+    ## @brief ECEF坐标系转LLA坐标系（Bowring迭代法，固定迭代次数）
+    #
+    #  以参数纬度β为中间量迭代求解，每次迭代只需一次atan2和少量乘法，没有开方和开立方：
+    #
+    #  \f{align*}{ & p = \sqrt{X^{2}+Y^{2}},\quad e'^{2} = (a^{2}-b^{2})/b^{2} \\& \beta_{0} = \arctan\frac{aZ}{bp} \\& \phi = \arctan\frac{Z + e'^{2} b \sin^{3}\beta}{p - e^{2} a \cos^{3}\beta},\quad \beta = \arctan\frac{(1-f)\sin\phi}{\cos\phi} \\& h = p\cos\phi + Z\sin\phi - a\sqrt{1-e^{2}\sin^{2}\phi} \f}
+    #
+    #  地表附近（高度在±100km内）迭代1次的误差在亚毫米级，2次已到双精度极限。
+    #  精度和速度对比见 earth_model_bench.py。
+    #  @param x
+    #  @param y
+    #  @param z
+    #  @param iters 迭代次数，默认BOWRING_ITERS
+    #  @return lat0
+    #  @return lon0
+    #  @return h0
+    def ecef2lla_bowring(self, x, y, z, iters=None):
+        if iters is None:
+            iters = BOWRING_ITERS
+        a = self.wgs84_a
+        b = self.wgs84_b
+        e2 = self.pow_e_2
+        ep2 = (a * a - b * b) / (b * b)
+        p = math.sqrt(x * x + y * y)
+        beta = math.atan2(a * z, b * p)
+        for _ in range(iters):
+            sb = math.sin(beta)
+            cb = math.cos(beta)
+            lat = math.atan2(z + ep2 * b * sb * sb * sb, p - e2 * a * cb * cb * cb)
+            beta = math.atan2((1 - self.wgs84_f) * math.sin(lat), math.cos(lat))
+        s = math.sin(lat)
+        h = p * math.cos(lat) + z * s - a * math.sqrt(1 - e2 * s * s)
+        return math.degrees(lat), math.degrees(math.atan2(y, x)), h
     
     ## @brief LLA到ENU之间的坐标系转换通过先转换为ECEF实现。
     #  
@@ -392,6 +420,226 @@ class EarthModel():
         h_ref=lla0[2]
         return self.enu2lla(xEast, yNorth, zUp, lat_ref, lon_ref, h_ref)
 
+    ## @brief 批量接口的输入整理：转为 (N,3) 的 float64 数组
+    #
+    #  单个点 (3,) 视为 (1,3)，空输入得到 (0,3)；其他形状（如 (N,2)、(3,N)）抛出 ValueError。
+    def _as_n3(self, arr):
+        a = np.asarray(arr, dtype=np.float64)
+        if a.ndim == 1 and a.size in (0, 3):
+            return a.reshape(-1, 3)
+        if a.ndim != 2 or a.shape[1] != 3:
+            raise ValueError(f"expected an (N,3) array, got shape {a.shape}")
+        return a
+
+    ## @brief 计算站心坐标系原点的ECEF坐标和ECEF→ENU旋转矩阵S（见ecef2enu中的公式）
+    #
+    #  批量接口对每次调用只计算一次原点相关的三角函数和曲率半径。
+    #  @param lla0 原点(lat0,lon0,h0)，经纬度单位为度
+    #  @return ecef0 原点ECEF坐标，形状(3,)
+    #  @return S ECEF→ENU旋转矩阵，形状(3,3)
+    def _ref_frame(self, lla0):
+        lat0, lon0, h0 = float(lla0[0]), float(lla0[1]), float(lla0[2])
+        ecef0 = np.array(self.lla2ecef(lat0, lon0, h0))
+        sin_lambda = math.sin(math.radians(lat0))
+        cos_lambda = math.cos(math.radians(lat0))
+        sin_phi = math.sin(math.radians(lon0))
+        cos_phi = math.cos(math.radians(lon0))
+        S = np.array([
+            [-sin_phi, cos_phi, 0.0],
+            [-sin_lambda * cos_phi, -sin_lambda * sin_phi, cos_lambda],
+            [cos_lambda * cos_phi, cos_lambda * sin_phi, sin_lambda],
+        ])
+        return ecef0, S
+
+    ## @brief 批量版lla2ecef
+    #  @param lla (N,3)数组，每行为(lat,lon,h)，经纬度单位为度
+    #  @return (N,3)数组，每行为ECEF坐标(x,y,z)
+    def lla2ecef_batch(self, lla):
+        lla = self._as_n3(lla)
+        lamb = np.radians(lla[:, 0])
+        phi = np.radians(lla[:, 1])
+        h = lla[:, 2]
+        sin_lambda = np.sin(lamb)
+        cos_lambda = np.cos(lamb)
+        N = self.wgs84_a / np.sqrt(1 - self.pow_e_2 * sin_lambda * sin_lambda)
+        out = np.empty_like(lla)
+        out[:, 0] = (h + N) * cos_lambda * np.cos(phi)
+        out[:, 1] = (h + N) * cos_lambda * np.sin(phi)
+        out[:, 2] = (h + (1 - self.pow_e_2) * N) * sin_lambda
+        return out
+
+    ## @brief 批量版ecef2enu
+    #  @param ecef (N,3)数组，每行为ECEF坐标(x,y,z)
+    #  @param lla0 站心原点(lat0,lon0,h0)
+    #  @return (N,3)数组，每行为(xEast,yNorth,zUp)
+    def ecef2enu_batch(self, ecef, lla0):
+        ecef0, S = self._ref_frame(lla0)
+        return (self._as_n3(ecef) - ecef0) @ S.T
+
+    ## @brief 批量版enu2ecef
+    #  @param enu (N,3)数组，每行为(xEast,yNorth,zUp)
+    #  @param lla0 站心原点(lat0,lon0,h0)
+    #  @return (N,3)数组，每行为ECEF坐标(x,y,z)
+    def enu2ecef_batch(self, enu, lla0):
+        ecef0, S = self._ref_frame(lla0)
+        return self._as_n3(enu) @ S + ecef0
+
+    ## @brief 批量版ecef2lla
+    #  @param ecef (N,3)数组，每行为ECEF坐标(x,y,z)
+    #  @param method "ferrari"：与ecef2lla相同的闭式解；"bowring"：与ecef2lla_bowring相同的固定次数迭代
+    #  @param iters bowring方法的迭代次数，默认BOWRING_ITERS
+    #  @return (N,3)数组，每行为(lat,lon,h)，经纬度单位为度
+    def ecef2lla_batch(self, ecef, method="ferrari", iters=None):
+        ecef = self._as_n3(ecef)
+        if method == "bowring":
+            return self._ecef2lla_bowring_batch(ecef, BOWRING_ITERS if iters is None else iters)
+        if method != "ferrari":
+            raise ValueError(f"unknown ecef2lla method: {method}")
+        x = ecef[:, 0]
+        y = ecef[:, 1]
+        z = ecef[:, 2]
+        a = self.wgs84_a
+        b = self.wgs84_b
+        b2 = b * b
+        e2 = 1 - (b / a) ** 2
+        ep2 = e2 * (a / b) ** 2
+        z2 = z * z
+        r2 = x * x + y * y
+        r = np.sqrt(r2)
+        F = 54 * b2 * z2
+        G = r2 + (1 - e2) * z2 - e2 * (a * a - b2)
+        c = (e2 * e2 * F * r2) / (G * G * G)
+        s = np.cbrt(1 + c + np.sqrt(c * c + 2 * c))
+        P = F / (3 * (s + 1 / s + 1) ** 2 * G * G)
+        Q = np.sqrt(1 + 2 * e2 * e2 * P)
+        ro = -(P * e2 * r) / (1 + Q) + np.sqrt((a * a / 2) * (1 + 1 / Q) - (P * (1 - e2) * z2) / (Q * (1 + Q)) - P * r2 / 2)
+        tmp = (r - e2 * ro) ** 2
+        U = np.sqrt(tmp + z2)
+        V = np.sqrt(tmp + (1 - e2) * z2)
+        zo = (b2 * z) / (a * V)
+        out = np.empty_like(ecef)
+        out[:, 0] = np.degrees(np.arctan((z + ep2 * zo) / r))
+        out[:, 1] = np.degrees(np.arctan2(y, x))
+        out[:, 2] = U * (1 - b2 / (a * V))
+        return out
+
+    def _ecef2lla_bowring_batch(self, ecef, iters):
+        x = ecef[:, 0]
+        y = ecef[:, 1]
+        z = ecef[:, 2]
+        a = self.wgs84_a
+        b = self.wgs84_b
+        e2 = self.pow_e_2
+        ep2 = (a * a - b * b) / (b * b)
+        p = np.hypot(x, y)
+        beta = np.arctan2(a * z, b * p)
+        for _ in range(iters):
+            sb = np.sin(beta)
+            cb = np.cos(beta)
+            lat = np.arctan2(z + ep2 * b * sb * sb * sb, p - e2 * a * cb * cb * cb)
+            beta = np.arctan2((1 - self.wgs84_f) * np.sin(lat), np.cos(lat))
+        s = np.sin(lat)
+        out = np.empty_like(ecef)
+        out[:, 0] = np.degrees(lat)
+        out[:, 1] = np.degrees(np.arctan2(y, x))
+        out[:, 2] = p * np.cos(lat) + z * s - a * np.sqrt(1 - e2 * s * s)
+        return out
+
+    ## @brief 批量版lla2enu
+    #  @param lla (N,3)数组，每行为(lat,lon,h)
+    #  @param lla0 站心原点(lat0,lon0,h0)
+    #  @return (N,3)数组，每行为(xEast,yNorth,zUp)
+    def lla2enu_batch(self, lla, lla0):
+        return self.ecef2enu_batch(self.lla2ecef_batch(lla), lla0)
+
+    ## @brief 批量版enu2lla
+    #  @param enu (N,3)数组，每行为(xEast,yNorth,zUp)
+    #  @param lla0 站心原点(lat0,lon0,h0)
+    #  @return (N,3)数组，每行为(lat,lon,h)
+    def enu2lla_batch(self, enu, lla0):
+        return self.ecef2lla_batch(self.enu2ecef_batch(enu, lla0))
+
+    ## @brief 批量版lla2ned
+    #  @param lla (N,3)数组，每行为(lat,lon,h)
+    #  @param lla0 站心原点(lat0,lon0,h0)
+    #  @return (N,3)数组，每行为(yNorth,xEast,-zUp)
+    def lla2ned_batch(self, lla, lla0):
+        enu = self.lla2enu_batch(lla, lla0)
+        return np.column_stack((enu[:, 1], enu[:, 0], -enu[:, 2]))
+
+    ## @brief 批量版ned2lla
+    #  @param ned (N,3)数组，每行为(north,east,down)
+    #  @param lla0 站心原点(lat0,lon0,h0)
+    #  @return (N,3)数组，每行为(lat,lon,h)
+    def ned2lla_batch(self, ned, lla0):
+        ned = self._as_n3(ned)
+        enu = np.column_stack((ned[:, 1], ned[:, 0], -ned[:, 2]))
+        return self.enu2lla_batch(enu, lla0)
+
+## @brief 预计算的站心（NED）坐标系
+#
+#  构造时一次性算出原点的ECEF坐标和ECEF→NED旋转矩阵，之后每次转换只需一次lla2ecef和一次矩阵乘法，
+#  不再重复计算原点的曲率半径和三角函数。原点改变时重新构造一个LocalFrame即可。
+class LocalFrame:
+    ## @brief 构造函数
+    #  @param lla0 原点(lat0,lon0,h0)，经纬度单位为度
+    #  @param model EarthModel实例，默认新建
+    def __init__(self, lla0, model=None):
+        ## @var LocalFrame.model
+        #  使用的地球模型
+        self.model = model if model is not None else EarthModel()
+        ## @var LocalFrame.lla0
+        #  原点(lat0,lon0,h0)
+        self.lla0 = [float(lla0[0]), float(lla0[1]), float(lla0[2])]
+        ecef0, S = self.model._ref_frame(self.lla0)
+        ## @var LocalFrame.ecef0
+        #  原点的ECEF坐标，形状(3,)
+        self.ecef0 = ecef0
+        ## @var LocalFrame.R
+        #  ECEF→NED旋转矩阵，行依次为北、东、地方向
+        self.R = np.array([S[1], S[0], -S[2]])
+        # 单点转换用纯Python浮点运算，比小数组的numpy调用更快
+        self._x0, self._y0, self._z0 = ecef0.tolist()
+        self._r = self.R.tolist()
+
+    ## @brief LLA转NED，结果与EarthModel.lla2ned一致
+    #  @param lla (lat,lon,h)
+    #  @return [north,east,down]
+    def lla2ned(self, lla):
+        x, y, z = self.model.lla2ecef(lla[0], lla[1], lla[2])
+        xd = x - self._x0
+        yd = y - self._y0
+        zd = z - self._z0
+        r = self._r
+        return [
+            r[0][0] * xd + r[0][1] * yd + r[0][2] * zd,
+            r[1][0] * xd + r[1][1] * yd + r[1][2] * zd,
+            r[2][0] * xd + r[2][1] * yd + r[2][2] * zd,
+        ]
+
+    ## @brief NED转LLA，结果与EarthModel.ned2lla一致
+    #  @param ned (north,east,down)
+    #  @return (lat,lon,h)
+    def ned2lla(self, ned):
+        n, e, d = ned[0], ned[1], ned[2]
+        r = self._r
+        x = self._x0 + r[0][0] * n + r[1][0] * e + r[2][0] * d
+        y = self._y0 + r[0][1] * n + r[1][1] * e + r[2][1] * d
+        z = self._z0 + r[0][2] * n + r[1][2] * e + r[2][2] * d
+        return self.model.ecef2lla(x, y, z)
+
+    ## @brief 批量LLA转NED
+    #  @param lla (N,3)数组，每行为(lat,lon,h)
+    #  @return (N,3)数组，每行为(north,east,down)
+    def lla2ned_batch(self, lla):
+        return (self.model.lla2ecef_batch(lla) - self.ecef0) @ self.R.T
+
+    ## @brief 批量NED转LLA
+    #  @param ned (N,3)数组，每行为(north,east,down)
+    #  @return (N,3)数组，每行为(lat,lon,h)
+    def ned2lla_batch(self, ned):
+        return self.model.ecef2lla_batch(self.model._as_n3(ned) @ self.R + self.ecef0)
+
 class Coordinate:
     """
     参考MAV_FRAME
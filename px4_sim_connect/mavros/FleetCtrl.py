@@ -0,0 +1,201 @@
+import time
+import math
+import threading
+import numpy as np
+import TickScheduler
+import PX4MavCtrlV4ROS as PX4MavCtrl
+
+## @file
+#  @brief 多机集群控制：多个PX4MavCtrler共用一个ROS节点、一个执行器和一个Offboard发布线程
+#  @anchor FleetCtrl接口库文件
+#
+#  单机的PX4MavCtrler各自创建ROS节点、执行器spin线程（ROS2）和Offboard发布线程，N架飞机就有2N个Python线程争抢GIL。
+#  FleetController只创建一个节点和一个spin线程，所有飞机的订阅和发布都挂在这个节点上（话题名仍按各机的mavros命名空间区分）；
+#  由一个发布线程按TickScheduler节拍依次检查每架飞机，有新设定点或到保活时刻才发布（PX4MavCtrler.pollOffboard）。
+#  各机的位姿、速度回调同时写入共用的FleetState数组，一次即可取到全部飞机的状态。
+
+
+## @brief 集群共用的状态存储，每架飞机一行
+class FleetState:
+    ## @brief 构造函数
+    # @param copterIDs 飞机ID列表，行号与列表顺序一致
+    def __init__(self, copterIDs):
+        n = len(copterIDs)
+        ## @var FleetState.ids
+        # 飞机ID列表
+        self.ids = list(copterIDs)
+        ## @var FleetState.row
+        # 飞机ID到行号的映射
+        self.row = {cid: i for i, cid in enumerate(self.ids)}
+        ## @var FleetState.pos
+        # (N,3) NED位置
+        self.pos = np.zeros((n, 3))
+        ## @var FleetState.att
+        # (N,3) 欧拉角（弧度）
+        self.att = np.zeros((n, 3))
+        ## @var FleetState.vel
+        # (N,3) NED速度
+        self.vel = np.zeros((n, 3))
+        ## @var FleetState.rate
+        # (N,3) 角速率
+        self.rate = np.zeros((n, 3))
+        ## @var FleetState.recvTime
+        # (N,2) 最近一次位姿、速度消息的接收时刻（time.monotonic()），未收到时为-inf
+        self.recvTime = np.full((n, 2), -math.inf)
+        ## @var FleetState.seq
+        # (N,2) 位姿、速度消息计数
+        self.seq = np.zeros((n, 2), dtype=np.int64)
+
+    ## @brief 写入位姿快照（PX4MavCtrler的位姿回调调用）
+    def putPose(self, copterID, state):
+        i = self.row[copterID]
+        self.pos[i] = state.posNED
+        self.att[i] = state.angEular
+        self.recvTime[i, 0] = state.recvTime
+        self.seq[i, 0] = state.seq
+
+    ## @brief 写入速度快照（PX4MavCtrler的速度回调调用）
+    def putVel(self, copterID, state):
+        i = self.row[copterID]
+        self.vel[i] = state.velNED
+        self.rate[i] = state.angRate
+        self.recvTime[i, 1] = state.recvTime
+        self.seq[i, 1] = state.seq
+
+    ## @brief 各机位姿距今的时间（秒）
+    def age(self, now=None):
+        return (time.monotonic() if now is None else now) - self.recvTime[:, 0]
+
+    ## @brief 全部状态的拷贝
+    # @return 字典：ids, pos, att, vel, rate, recvTime, seq
+    def snapshot(self):
+        return {
+            "ids": list(self.ids), "pos": self.pos.copy(), "att": self.att.copy(), "vel": self.vel.copy(),
+            "rate": self.rate.copy(), "recvTime": self.recvTime.copy(), "seq": self.seq.copy(),
+        }
+
+
+## @brief 多机集群控制器
+class FleetController:
+    ## @brief 构造函数
+    # @param copterIDs 飞机ID列表
+    # @param hz 统一发布线程的节拍频率
+    # @param ip 与PX4MavCtrler相同
+    # @param Com 与PX4MavCtrler相同
+    # @param offboardHz 各机设定点保活频率
+    def __init__(self, copterIDs, hz=50.0, ip="127.0.0.1", Com="udp", offboardHz=PX4MavCtrl.OFFBOARD_HZ):
+        self.hz = hz
+        ## @var FleetController.state
+        # 共用的状态存储
+        self.state = FleetState(copterIDs)
+        self.ros_node = None
+        self.executor = None
+        self.t1 = None
+        if PX4MavCtrl.is_use_ros1:
+            try:
+                PX4MavCtrl.rospy.init_node("RflyRosFleet")
+            except:
+                print("Already init.")
+        else:
+            try:
+                PX4MavCtrl.rclpy.init()
+            except:
+                if PX4MavCtrl.rclpy.ok():
+                    print("Already init.")
+                else:
+                    print("init fail")
+            self.ros_node = PX4MavCtrl.Node("RflyRosFleet")
+            self.executor = PX4MavCtrl.rclpy.executors.MultiThreadedExecutor()
+            self.executor.add_node(self.ros_node)
+            self.t1 = threading.Thread(target=self.executor.spin, args=())
+            self.t1.start()
+        ## @var FleetController.mavs
+        # 飞机ID到PX4MavCtrler的映射
+        self.mavs = {}
+        for cid in copterIDs:
+            mav = PX4MavCtrl.PX4MavCtrler(cid, ip, Com, offboardHz=offboardHz,
+                                          rosNode=self.ros_node, stateStore=self.state)
+            mav.hasInit = True # 节点已由集群初始化
+            self.mavs[cid] = mav
+        ## @var FleetController.sched
+        # 统一发布线程的节拍调度器
+        self.sched = TickScheduler.TickScheduler(1.0 / hz)
+        ## @var FleetController.work
+        # 每拍发布全部飞机设定点的耗时直方图
+        self.work = TickScheduler.TickHistogram()
+        self.running = False
+        self.t2 = None
+
+    def __getitem__(self, copterID):
+        return self.mavs[copterID]
+
+    def __iter__(self):
+        return iter(self.mavs.values())
+
+    def __len__(self):
+        return len(self.mavs)
+
+    ## @brief 启动统一发布线程（initOffboard会自动调用）
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.t2 = threading.Thread(target=self._loop, args=())
+        self.t2.start()
+
+    def _loop(self):
+        clock = TickScheduler.clock
+        mavs = list(self.mavs.values())
+        for _ in self.sched.run():
+            if not self.running:
+                break
+            t0 = clock()
+            now = time.monotonic()
+            for mav in mavs:
+                if mav.isInOffboard:
+                    mav.pollOffboard(now)
+            self.work.record(clock() - t0)
+        print("Fleet offboard stopped.")
+
+    ## @brief 全部飞机进入Offboard并解锁
+    def initOffboard(self):
+        for mav in self:
+            mav.prepareOffboard()
+        self.start()
+        # 等待offboard消息发一阵，让PX4认为通信健康
+        time.sleep(1)
+        for mav in self:
+            mav.offboard_state = mav.offboard()
+        time.sleep(0.2)
+        for mav in self:
+            mav.arm_state = mav.arm()
+
+    ## @brief 全部飞机降落
+    def land(self):
+        for mav in self:
+            mav.land()
+
+    ## @brief 停止发布线程和执行器
+    def endOffboard(self):
+        self.running = False
+        for mav in self:
+            mav.isInOffboard = False
+        if self.t2 is not None:
+            self.t2.join()
+        if self.t1 is not None:
+            try:
+                PX4MavCtrl.rclpy.shutdown()
+            except:
+                print("Already shutdown")
+            self.t1.join()
+
+    ## @brief 统一发布线程的节拍统计和各机设定点发布统计
+    def formatReport(self):
+        w = self.work.summary()
+        lines = [
+            f"fleet {len(self)} vehicles @ {self.hz:g} Hz: {self.sched.format_report()} | "
+            f"publish work mean={w['mean_ms']:.3f} p99={w['p99_ms']:.3f} max={w['max_ms']:.3f} ms"
+        ]
+        for cid, mav in self.mavs.items():
+            lines.append(f"  [{cid}] {mav.formatOffboardReport()}")
+        return "\n".join(lines)
@@ -0,0 +1,561 @@
+import os
+import sys
+import json
+import time
+import queue
+import struct
+import threading
+import numpy as np
+import Trajectory
+
+## @file
+#  @brief 飞行日志（FC_*）的流式写入与读取模块
+#  @anchor FlyLog接口库文件
+#
+#  支持两种追加写格式，写入都由后台线程完成，控制循环只需把记录放进有界队列，
+#  不会被磁盘 I/O 阻塞，内存占用也不随飞行时长增长：
+#  - .jsonl：JSON Lines，每行一条记录；
+#  - .fcb：定长 schema 的列式二进制格式，分析脚本通过 numpy.memmap 读取，
+#    打开时只解析文件头和块索引，列数据按需映射。
+#
+#  .fcb 文件布局（小端，所有数据 8 字节对齐）：
+#  - 文件头：FCB_HEADER + ncols 个 FCB_COLUMN 列描述 + meta(JSON) + 对齐填充；
+#  - 若干数据块：FCB_CHUNK 块头(nrows) + 按列连续存放的数据（每列 nrows*width 个 8 字节值）；
+#  - 块索引：nchunks 个 (offset, nrows)，以及 FCB_TRAILER。
+#  文件未正常关闭（没有块索引）时，读取端顺序扫描块头，并忽略最后一个不完整的块。
+#
+#  元数据中带有轨迹参数（meta["trajectory"]，即 Trajectory.spec）时，记录中可以省略 target，
+#  读取端（load_log / load_arrays）按 k 重新生成。.jsonl 的元数据写在首行 {"_meta": {...}}。
+
+## @brief .fcb 定长 schema：(字段名, 类型, 宽度)
+FCB_SCHEMA = [
+    ("k", "i8", 1),
+    ("dt", "f8", 1),
+    ("t", "f8", 1),
+    ("target", "f8", 4),
+    ("pos", "f8", 3),
+    ("att_deg", "f8", 3),
+    ("ts", "f8", 1),
+]
+FCB_MAGIC = b"FCLOG\0\0\0"
+FCB_VERSION = 1
+FCB_HEADER = struct.Struct("<8sHHI")  # magic, version, ncols, meta_len
+FCB_COLUMN = struct.Struct("<16s2sH")  # name, dtype, width
+FCB_CHUNK = struct.Struct("<4sIQ")  # b"CHNK", 保留, nrows
+FCB_INDEX = struct.Struct("<QQ")  # offset, nrows
+FCB_TRAILER = struct.Struct("<QQ8s")  # index_offset, nchunks, magic
+FCB_TRAILER_MAGIC = b"FCIDX\0\0\0"
+## @brief 整数列缺失值
+FCB_INT_NAN = np.iinfo(np.int64).min
+
+## @brief 后台线程退出标志
+_STOP = object()
+
+
+## @brief 修复崩溃后日志尾部的半行数据
+#
+#  进程被杀或掉电时，最后一批写入可能只落盘一部分（半行或填充的 0 字节）。
+#  该函数截掉最后一个换行符之后的残余数据，并丢弃无法解析的最后一行。
+#  @param path JSON Lines 日志路径
+#  @return 被截掉的字节数
+def recover_tail(path):
+    if not os.path.exists(path):
+        return 0
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0
+    with open(path, "rb+") as f:
+        back = min(size, 1 << 16)
+        f.seek(size - back)
+        tail = f.read(back)
+        end = len(tail.rstrip(b"\0"))
+        cut = tail.rfind(b"\n", 0, end) + 1
+        if cut == 0 and back < size:
+            # 最后 64KB 内没有换行，不做猜测
+            return 0
+        # 校验最后一个完整行
+        prev = tail.rfind(b"\n", 0, max(cut - 1, 0)) + 1
+        line = tail[prev:cut].strip()
+        if line and (prev > 0 or back == size):
+            try:
+                json.loads(line.decode("utf-8"))
+            except ValueError:
+                cut = prev
+        new_size = size - back + cut
+        if new_size != size:
+            f.truncate(new_size)
+    return size - new_size
+
+
+## @brief 读取 JSON Lines 日志，忽略损坏的行
+#  @param path 日志路径
+#  @return 记录列表
+def load_jsonl(path):
+    data = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if "_meta" not in rec:
+                data.append(rec)
+    return data
+
+
+## @brief 读取日志元数据
+#  @param path 日志路径
+#  @return .fcb 为文件头中的 meta，.jsonl 为首行的 _meta，旧的整文件 JSON 日志没有元数据，返回 {}
+def read_meta(path):
+    if path.endswith(".fcb"):
+        return FCBReader(path).meta
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                first = json.loads(f.readline())
+            except ValueError:
+                return {}
+        if isinstance(first, dict) and isinstance(first.get("_meta"), dict):
+            return first["_meta"]
+    return {}
+
+
+## @brief 按元数据中的轨迹参数为缺少 target 的记录重新生成 target
+#  @param recs 记录列表（原地修改）
+#  @param meta 日志元数据
+#  @return recs
+def fill_target(recs, meta):
+    spec = meta.get("trajectory")
+    if not spec:
+        return recs
+    need = [rec for rec in recs if "target" not in rec and "k" in rec]
+    if need:
+        targets = Trajectory.from_spec(spec).target([rec["k"] for rec in need]).tolist()
+        for rec, tgt in zip(need, targets):
+            rec["target"] = tgt
+    return recs
+
+
+## @brief 按扩展名读取日志：.jsonl 为流式日志，.fcb 为列式日志，其余按旧的整文件 JSON 读取
+#  @param path 日志路径
+#  @return 记录列表，省略的 target 按元数据中的轨迹参数补齐
+def load_log(path):
+    if path.endswith(".jsonl"):
+        return fill_target(load_jsonl(path), read_meta(path))
+    if path.endswith(".fcb"):
+        r = FCBReader(path)
+        return fill_target(r.to_records(), r.meta)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+## @brief 把记录中的字段展平为浮点列表（兼容 pos 的 [(x, y, z)] 嵌套写法）
+def _flat(v):
+    if not isinstance(v, (list, tuple)):
+        return [v]
+    out = []
+    for x in v:
+        out.extend(_flat(x))
+    return out
+
+
+def _align8(n):
+    return (n + 7) & ~7
+
+
+## @brief 把一条记录写入各列缓冲区的第 i 行，缺失值填 NaN（整数列填 FCB_INT_NAN）
+def _fill_row(bufs, columns, i, rec):
+    for name, dtype, width in columns:
+        buf = bufs[name]
+        v = rec.get(name)
+        if v is None:
+            buf[i] = FCB_INT_NAN if dtype == "i8" else np.nan
+        elif width == 1:
+            buf[i, 0] = v
+        else:
+            v = _flat(v)[:width]
+            buf[i, :len(v)] = v
+            buf[i, len(v):] = np.nan
+
+
+## @brief 读取日志为按列的 numpy 数组，与 FCBReader 的列布局一致
+#
+#  .fcb 直接返回映射的列；JSON / JSON Lines 日志逐条展平后构造数组。
+#  @param path 日志路径
+#  @return {字段名: 数组}，宽度为 1 的列为一维数组
+def load_arrays(path):
+    if path.endswith(".fcb"):
+        r = FCBReader(path)
+        cols = {name: r[name] for name, _, _ in r.columns}
+        spec = r.meta.get("trajectory")
+        if "target" not in cols and spec and "k" in cols:
+            cols["target"] = Trajectory.from_spec(spec).target(cols["k"])
+        return cols
+    recs = load_log(path)
+    bufs = {name: np.empty((len(recs), width), dtype=dtype) for name, dtype, width in FCB_SCHEMA}
+    for i, rec in enumerate(recs):
+        _fill_row(bufs, FCB_SCHEMA, i, rec)
+    return {name: (bufs[name][:, 0] if width == 1 else bufs[name]) for name, _, width in FCB_SCHEMA}
+
+
+## @brief 列式二进制日志写入器（.fcb）
+#
+#  每列在内存中预分配一个块的缓冲区，写满 chunk_rows 行或调用 sync() 时整块落盘。
+#  与 StreamLogWriter 配合时，sync() 由后台线程按 fsync 间隔调用。
+class FCBWriter:
+    ## @brief 构造函数
+    # @param path 日志路径（.fcb），已存在时覆盖
+    # @param chunk_rows 单块最大行数
+    # @param meta 写入文件头的元数据（dict）
+    # @param columns 写入的列名，默认 schema 中全部列
+    def __init__(self, path, chunk_rows=4096, meta=None, columns=None):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.columns = [c for c in FCB_SCHEMA if columns is None or c[0] in columns]
+        self._bufs = {
+            name: np.empty((chunk_rows, width), dtype=dtype)
+            for name, dtype, width in self.columns
+        }
+        self._n = 0
+        self._index = []
+        self._f = open(path, "wb")
+        meta_bytes = json.dumps(meta or {}, ensure_ascii=False).encode("utf-8")
+        head = [FCB_HEADER.pack(FCB_MAGIC, FCB_VERSION, len(self.columns), len(meta_bytes))]
+        for name, dtype, width in self.columns:
+            head.append(FCB_COLUMN.pack(name.encode("ascii"), dtype.encode("ascii"), width))
+        head.append(meta_bytes)
+        head = b"".join(head)
+        self._f.write(head + b"\0" * (_align8(len(head)) - len(head)))
+
+    ## @brief 追加一条记录（dict），缺失字段填 NaN
+    def append(self, rec):
+        _fill_row(self._bufs, self.columns, self._n, rec)
+        self._n += 1
+        if self._n >= self.chunk_rows:
+            self._write_chunk()
+
+    ## @brief 批量追加记录
+    def write_batch(self, recs):
+        for rec in recs:
+            self.append(rec)
+
+    def _write_chunk(self):
+        n = self._n
+        if n == 0:
+            return
+        self._index.append((self._f.tell(), n))
+        parts = [FCB_CHUNK.pack(b"CHNK", 0, n)]
+        for name, _dtype, _width in self.columns:
+            parts.append(self._bufs[name][:n].tobytes())
+        self._f.write(b"".join(parts))
+        self._n = 0
+
+    ## @brief 将未满的块落盘并 fsync
+    def sync(self):
+        self._write_chunk()
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    ## @brief 写入剩余数据和块索引并关闭文件
+    def close(self):
+        self._write_chunk()
+        index_offset = self._f.tell()
+        self._f.write(b"".join(FCB_INDEX.pack(off, n) for off, n in self._index))
+        self._f.write(FCB_TRAILER.pack(index_offset, len(self._index), FCB_TRAILER_MAGIC))
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+
+
+## @brief 基于 numpy.memmap 的列式日志读取器（.fcb）
+#
+#  打开时只解析文件头和块索引；reader["pos"] 返回 (N, 3) 的列数组，
+#  单块文件直接返回映射视图，多块文件按需拼接。
+class FCBReader:
+    ## @brief 构造函数
+    # @param path 日志路径（.fcb）
+    def __init__(self, path):
+        self.path = path
+        self._mm = np.memmap(path, dtype=np.uint8, mode="r")
+        mm = self._mm
+        magic, version, ncols, meta_len = FCB_HEADER.unpack_from(mm, 0)
+        if magic != FCB_MAGIC:
+            raise ValueError(f"not a FC binary log: {path}")
+        if version != FCB_VERSION:
+            raise ValueError(f"unsupported FC binary log version {version}: {path}")
+        off = FCB_HEADER.size
+        ## @var FCBReader.columns
+        # 文件中的列：[(字段名, 类型, 宽度)]
+        self.columns = []
+        for _ in range(ncols):
+            name, dtype, width = FCB_COLUMN.unpack_from(mm, off)
+            self.columns.append((name.rstrip(b"\0").decode("ascii"), dtype.decode("ascii"), width))
+            off += FCB_COLUMN.size
+        ## @var FCBReader.meta
+        # 文件头中的元数据
+        self.meta = json.loads(bytes(mm[off:off + meta_len]).decode("utf-8"))
+        self._data_start = _align8(off + meta_len)
+        self._row_bytes = 8 * sum(width for _, _, width in self.columns)
+        ## @var FCBReader.chunks
+        # 块索引：[(offset, nrows)]
+        self.chunks = self._read_index()
+        self._cache = {}
+
+    def _read_index(self):
+        mm = self._mm
+        size = len(mm)
+        if size >= self._data_start + FCB_TRAILER.size:
+            index_offset, nchunks, magic = FCB_TRAILER.unpack_from(mm, size - FCB_TRAILER.size)
+            if magic == FCB_TRAILER_MAGIC and index_offset + nchunks * FCB_INDEX.size == size - FCB_TRAILER.size:
+                return [FCB_INDEX.unpack_from(mm, index_offset + i * FCB_INDEX.size) for i in range(nchunks)]
+        # 没有块索引（未正常关闭）：顺序扫描块头，丢弃不完整的最后一块
+        chunks = []
+        off = self._data_start
+        while off + FCB_CHUNK.size <= size:
+            tag, _reserved, n = FCB_CHUNK.unpack_from(mm, off)
+            end = off + FCB_CHUNK.size + n * self._row_bytes
+            if tag != b"CHNK" or end > size:
+                break
+            chunks.append((off, n))
+            off = end
+        return chunks
+
+    def __len__(self):
+        return sum(n for _, n in self.chunks)
+
+    def __contains__(self, name):
+        return any(c[0] == name for c in self.columns)
+
+    ## @brief 返回某一块中各列的映射视图
+    # @param i 块序号
+    # @return {字段名: (nrows, width) 数组}
+    def chunk(self, i):
+        off, n = self.chunks[i]
+        off += FCB_CHUNK.size
+        out = {}
+        for name, dtype, width in self.columns:
+            out[name] = np.ndarray((n, width), dtype=dtype, buffer=self._mm, offset=off)
+            off += n * width * 8
+        return out
+
+    ## @brief 读取整列，宽度为 1 的列返回一维数组
+    def __getitem__(self, name):
+        if name in self._cache:
+            return self._cache[name]
+        width = None
+        for c in self.columns:
+            if c[0] == name:
+                dtype, width = c[1], c[2]
+        if width is None:
+            raise KeyError(name)
+        parts = [self.chunk(i)[name] for i in range(len(self.chunks))]
+        if not parts:
+            col = np.empty((0, width), dtype=dtype)
+        elif len(parts) == 1:
+            col = parts[0]
+        else:
+            col = np.concatenate(parts)
+        if width == 1:
+            col = col[:, 0]
+        self._cache[name] = col
+        return col
+
+    ## @brief 还原为与 JSON 日志相同结构的记录列表，缺失值（NaN）对应的字段省略
+    def to_records(self):
+        cols = {name: self[name].tolist() for name, _, _ in self.columns}
+        recs = []
+        for i in range(len(self)):
+            rec = {}
+            for name, dtype, width in self.columns:
+                v = cols[name][i]
+                if width == 1:
+                    if dtype == "i8" and v == FCB_INT_NAN:
+                        continue
+                    if dtype == "f8" and v != v:
+                        continue
+                    rec[name] = v
+                else:
+                    if all(x != x for x in v):
+                        continue
+                    rec[name] = [v] if name == "pos" else v
+            recs.append(rec)
+        return recs
+
+
+## @brief 将旧的 JSON / JSON Lines 日志无损转换为 .fcb
+#  @param src 源日志路径
+#  @param dst 目标路径，默认把扩展名替换为 .fcb
+#  @return 目标路径
+def convert_to_fcb(src, dst=None):
+    if dst is None:
+        dst = os.path.splitext(src)[0] + ".fcb"
+    w = FCBWriter(dst, meta={"source": os.path.basename(src)})
+    w.write_batch(load_log(src))
+    w.close()
+    return dst
+
+
+class _JsonlSink:
+    def __init__(self, path, meta=None):
+        recover_tail(path)
+        self._f = open(path, "ab")
+        if meta and self._f.tell() == 0:
+            self.write_batch([{"_meta": meta}])
+
+    def write_batch(self, recs):
+        lines = [json.dumps(rec, ensure_ascii=False).encode("utf-8") + b"\n" for rec in recs]
+        self._f.write(b"".join(lines))
+        self._f.flush()
+
+    def sync(self):
+        os.fsync(self._f.fileno())
+
+    def close(self):
+        self.sync()
+        self._f.close()
+
+
+## @brief 追加写的流式日志写入器
+#
+#  按扩展名选择格式：.fcb 写列式二进制日志，其余写 JSON Lines。
+#  append() 只做一次非阻塞入队；序列化、写文件和 fsync 都在后台线程完成。
+#  队列满时丢弃新记录并计数（dropped），保证控制循环的节拍不受影响。
+#  写文件出错（磁盘满、I/O 错误）时记下异常（error），之后的记录全部丢弃并计数，后台线程继续取队列直到 close()，不会卡住调用方。
+#  fsync 按时间批处理，崩溃最多丢失 fsync_every_s 秒的数据，残缺尾部由 recover_tail 修复。
+class StreamLogWriter:
+    ## @brief 构造函数
+    # @param path 日志路径；.jsonl 已存在时先修复尾部再追加，.fcb 总是新建
+    # @param queue_size 队列容量（条）
+    # @param fsync_every_s fsync 间隔（秒）
+    # @param batch_size 后台线程单次写入的最大记录数
+    # @param meta 元数据：.fcb 写入文件头，.jsonl 新建文件时写在首行
+    # @param columns .fcb 写入的列名，默认 schema 中全部列
+    def __init__(self, path, queue_size=4096, fsync_every_s=1.0, batch_size=256, meta=None, columns=None):
+        self.path = path
+        self.fsync_every_s = fsync_every_s
+        self.batch_size = batch_size
+        ## @var StreamLogWriter.written
+        # 已写入文件的记录数
+        self.written = 0
+        ## @var StreamLogWriter.dropped
+        # 未写入文件而丢弃的记录数（队列满、已关闭或写文件出错）
+        self.dropped = 0
+        ## @var StreamLogWriter.error
+        # 后台线程写文件时遇到的第一个异常，None 表示正常
+        self.error = None
+        self.closed = False
+        self._sink_closed = False
+        self._queue = queue.Queue(maxsize=queue_size)
+        if path.endswith(".fcb"):
+            self._sink = FCBWriter(path, meta=meta, columns=columns)
+        else:
+            self._sink = _JsonlSink(path, meta)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    ## @brief 追加一条记录（非阻塞）
+    # @param rec 记录（dict），入队后调用方不应再修改它
+    # @return 是否入队成功；已关闭或写文件出错后总是 False
+    def append(self, rec):
+        if self.closed or self.error is not None:
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait(rec)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    ## @brief 写入剩余记录、fsync 并关闭文件
+    # @param timeout 等待后台线程的最长时间（秒）；超时后后台线程仍会写完已收到的记录并自行关闭文件
+    # @return True 表示全部记录已写入且文件已关闭；False 表示有记录丢失（dropped、error）或超时时后台线程还没写完
+    def close(self, timeout=None):
+        if not self.closed:
+            self.closed = True
+            if self._thread.is_alive():
+                try:
+                    self._queue.put(_STOP, timeout=timeout)
+                except queue.Full:
+                    self._force_stop()
+                self._thread.join(timeout)
+            elif self.error is None:
+                self.error = RuntimeError("writer thread exited unexpectedly")
+        if not self._thread.is_alive():
+            # 后台线程异常退出时队列中剩下的记录不会再写入
+            while True:
+                try:
+                    if self._queue.get_nowait() is not _STOP:
+                        self.dropped += 1
+                except queue.Empty:
+                    break
+            self._close_sink()
+        return not self._thread.is_alive() and self.error is None and self.dropped == 0
+
+    def _force_stop(self):
+        # 后台线程跟不上时丢弃最旧的记录腾出位置，保证它一定能收到 _STOP；
+        # closed 之后 append 不再入队，只有后台线程在取，循环很快结束
+        while True:
+            try:
+                self._queue.put_nowait(_STOP)
+                return
+            except queue.Full:
+                pass
+            try:
+                self._queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+
+    def _close_sink(self):
+        if self._sink_closed:
+            return
+        self._sink_closed = True
+        try:
+            self._sink.close()
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+                print(f"[FlyLog] close failed: {self.path}: {e!r}")
+
+    def _run(self):
+        last_sync = time.monotonic()
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is _STOP:
+                stop = True
+                batch.pop()
+            if batch and self.error is not None:
+                self.dropped += len(batch)
+                continue
+            pending = len(batch)
+            try:
+                if batch:
+                    self._sink.write_batch(batch)
+                    self.written += pending
+                    pending = 0
+                now = time.monotonic()
+                if not stop and now - last_sync >= self.fsync_every_s:
+                    self._sink.sync()
+                    last_sync = now
+            except Exception as e:
+                # 出错后不再写文件，继续取队列直到 _STOP，close() 不会因队列满而阻塞
+                self.error = e
+                self.dropped += pending
+                print(f"[FlyLog] write failed, logging stopped: {self.path}: {e!r}")
+        self._close_sink()
+
+
+if __name__ == "__main__":
+    # 用法：python FlyLog.py FC_xxx.json [FC_yyy.jsonl ...]，在原目录生成同名 .fcb
+    for src in sys.argv[1:]:
+        print(f"{src} -> {convert_to_fcb(src)}")
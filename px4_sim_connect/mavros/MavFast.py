@@ -0,0 +1,324 @@
+import struct
+
+## @file
+#  @brief 高频MAVLink消息的快速打包：预编译的struct布局、定长缓冲区复用、查表CRC，不经过pymavlink的消息对象
+#  @anchor MavFast接口库文件
+#
+#  MAVLink v2帧：magic(0xFD), len, incompat_flags, compat_flags, seq, sysid, compid, msgid(3字节), payload, checksum(2字节)。
+#  负载按字段宽度从大到小排列（与pymavlink的unpacker格式相同），末尾的0字节截掉不发；
+#  checksum为CRC-16/MCRF4XX（X.25），覆盖magic之后的头、截断后的负载和该消息类型的CRC_EXTRA。
+#  MsgPacker每种消息一个，负载直接pack_into到预先分配的缓冲区，mavros的Mavlink消息所需的payload64
+#  用预编译的"<NQ"按8字节一组取出，整帧用于直连UDP/串口发送。
+#  MavParser是对应的接收端：从UDP数据报或串口字节流中切出v1/v2帧，只对关心的消息类型校验CRC并解包，其余整帧跳过。
+#  与pymavlink一样，装有fastcrc时用它计算CRC，否则查表。直接运行本文件可与pymavlink逐字节比对并比较耗时。
+
+try:
+    import fastcrc
+    _mcrf4xx = fastcrc.crc16.mcrf4xx
+except Exception:
+    _mcrf4xx = None
+
+## @brief MAVLink v2帧起始字节
+MAGIC_V2 = 0xFD
+## @brief MAVLink v1帧起始字节
+MAGIC_V1 = 0xFE
+## @brief v2帧头：magic, len, incompat_flags, compat_flags, seq, sysid, compid, msgid低16位, msgid高8位
+HEADER = struct.Struct("<BBBBBBBHB")
+CHECKSUM = struct.Struct("<H")
+## @brief v2帧incompat_flags中表示带签名的位，签名附在checksum之后，共13字节
+IFLAG_SIGNED = 0x01
+SIGNATURE_LEN = 13
+
+## @brief HIL_ACTUATOR_CONTROLS 消息ID
+HIL_ACTUATOR_CONTROLS_ID = 93
+## @brief HIL_ACTUATOR_CONTROLS 的CRC_EXTRA
+HIL_ACTUATOR_CONTROLS_CRC = 47
+## @brief HIL_ACTUATOR_CONTROLS 负载布局：time_usec, flags, controls[16], mode
+HIL_ACTUATOR_CONTROLS = "<QQ16fB"
+
+## @brief SET_POSITION_TARGET_LOCAL_NED 消息ID
+SET_POSITION_TARGET_LOCAL_NED_ID = 84
+## @brief SET_POSITION_TARGET_LOCAL_NED 的CRC_EXTRA
+SET_POSITION_TARGET_LOCAL_NED_CRC = 143
+## @brief SET_POSITION_TARGET_LOCAL_NED 负载布局：time_boot_ms, x, y, z, vx, vy, vz, afx, afy, afz, yaw, yaw_rate,
+#  type_mask, target_system, target_component, coordinate_frame
+SET_POSITION_TARGET_LOCAL_NED = "<IfffffffffffHBBB"
+
+# 接收端常用消息：ID -> (CRC_EXTRA, 负载布局)，布局中的字段顺序与pymavlink的unpacker相同
+## @brief HEARTBEAT：custom_mode, type, autopilot, base_mode, system_status, mavlink_version
+HEARTBEAT = (0, 50, "<IBBBBB")
+## @brief LOCAL_POSITION_NED：time_boot_ms, x, y, z, vx, vy, vz
+LOCAL_POSITION_NED = (32, 185, "<Iffffff")
+## @brief ATTITUDE_QUATERNION：time_boot_ms, q1~q4(w,x,y,z), rollspeed, pitchspeed, yawspeed, repr_offset_q[4]
+ATTITUDE_QUATERNION = (31, 246, "<Ifffffff4f")
+## @brief GLOBAL_POSITION_INT：time_boot_ms, lat, lon, alt(mm), relative_alt(mm), vx, vy, vz(cm/s), hdg(cdeg)
+GLOBAL_POSITION_INT = (33, 104, "<IiiiihhhH")
+## @brief COMMAND_LONG：param1~param7, command, target_system, target_component, confirmation
+COMMAND_LONG = (76, 152, "<7fHBBB")
+
+
+def _crcTable():
+    table = []
+    for i in range(256):
+        tmp = (i ^ (i << 4)) & 0xFF
+        table.append(((tmp << 8) ^ (tmp << 3) ^ (tmp >> 4)) & 0xFFFF)
+    return tuple(table)
+
+
+_CRC_TABLE = _crcTable()
+
+
+## @brief CRC-16/MCRF4XX（MAVLink的X.25校验）
+# @param buf 字节序列
+# @param crc 初值，用于分段累加
+# @return 16位校验值
+def x25crc(buf, crc=0xFFFF):
+    if _mcrf4xx is not None:
+        return _mcrf4xx(bytes(buf), crc)
+    table = _CRC_TABLE
+    for b in buf:
+        crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+    return crc
+
+
+## @brief 单一消息类型的MAVLink v2打包器，缓冲区在构造时分配，之后每次打包复用
+class MsgPacker:
+    ## @brief 构造函数
+    # @param msgid 消息ID
+    # @param crcExtra 消息类型的CRC_EXTRA
+    # @param fmt 负载的struct格式（按线上顺序，小端）
+    # @param sysid 本端系统ID，默认与PX4MavCtrler.mav0相同
+    # @param compid 本端组件ID
+    def __init__(self, msgid, crcExtra, fmt, sysid=255, compid=1):
+        self.msgid = msgid
+        self.crcExtra = crcExtra
+        self.sysid = sysid
+        self.compid = compid
+        self._payload = struct.Struct(fmt)
+        size = self._payload.size
+        words = (size + 7) // 8
+        self._p = bytearray(words * 8) # 负载，补0到8字节的整数倍
+        self._frame = bytearray(HEADER.size + size + CHECKSUM.size)
+        self._words = [struct.Struct("<%dQ" % k) for k in range(words + 1)]
+        ## @var MsgPacker.seq
+        # 下一帧的序号（0~255循环）
+        self.seq = 0
+        ## @var MsgPacker.len
+        # 最近一帧截断后的负载长度
+        self.len = 0
+        ## @var MsgPacker.lastSeq
+        # 最近一帧的序号
+        self.lastSeq = 0
+        ## @var MsgPacker.crc
+        # 最近一帧的校验值
+        self.crc = 0
+
+    ## @brief 打包一帧
+    # @param values 负载各字段，顺序与fmt一致
+    # @return 截断后的负载长度
+    def pack(self, *values):
+        p = self._p
+        self._payload.pack_into(p, 0, *values)
+        n = self._payload.size
+        while n > 1 and p[n - 1] == 0:
+            n -= 1
+        frame = self._frame
+        seq = self.seq
+        HEADER.pack_into(frame, 0, MAGIC_V2, n, 0, 0, seq, self.sysid, self.compid,
+                         self.msgid & 0xFFFF, self.msgid >> 16)
+        frame[HEADER.size:HEADER.size + n] = p[:n]
+        crc = x25crc(memoryview(frame)[1:HEADER.size + n])
+        crc = (crc >> 8) ^ _CRC_TABLE[(crc ^ self.crcExtra) & 0xFF]
+        CHECKSUM.pack_into(frame, HEADER.size + n, crc)
+        self.len = n
+        self.lastSeq = seq
+        self.crc = crc
+        self.seq = (seq + 1) & 0xFF
+        return n
+
+    ## @brief 最近一帧负载的payload64表示（mavros_msgs/Mavlink），补0后每8字节一个uint64
+    def payload64(self):
+        return self._words[(self.len + 7) // 8].unpack_from(self._p, 0)
+
+    ## @brief 最近一帧的完整字节，可直接写入UDP/串口
+    def frame(self):
+        return bytes(self._frame[:HEADER.size + self.len + CHECKSUM.size])
+
+
+## @brief HIL_ACTUATOR_CONTROLS打包器（RflySim经它把数据转给rfly_ctrl系列uORB消息）
+class HilActuatorControls(MsgPacker):
+    def __init__(self, sysid=255, compid=1):
+        MsgPacker.__init__(self, HIL_ACTUATOR_CONTROLS_ID, HIL_ACTUATOR_CONTROLS_CRC, HIL_ACTUATOR_CONTROLS,
+                           sysid, compid)
+
+    ## @brief 打包一帧，参数顺序与pymavlink的hil_actuator_controls_encode相同
+    # @param time_usec 时间戳
+    # @param controls 16个控制量
+    # @param mode 模式字段（RflySim用来选择rfly_ctrl/rfly_ctrl1/rfly_ctrl2）
+    # @param flags 标志位
+    # @return 截断后的负载长度
+    def pack(self, time_usec, controls, mode, flags):
+        return MsgPacker.pack(self, time_usec, flags, *controls, mode)
+
+
+## @brief SET_POSITION_TARGET_LOCAL_NED打包器（直连后端的Offboard设定点）
+class SetPositionTargetLocalNed(MsgPacker):
+    def __init__(self, sysid=255, compid=1):
+        MsgPacker.__init__(self, SET_POSITION_TARGET_LOCAL_NED_ID, SET_POSITION_TARGET_LOCAL_NED_CRC,
+                           SET_POSITION_TARGET_LOCAL_NED, sysid, compid)
+
+    ## @brief 打包一帧，参数顺序与pymavlink的set_position_target_local_ned_encode相同
+    # @return 截断后的负载长度
+    def pack(self, time_boot_ms, target_system, target_component, coordinate_frame, type_mask,
+             x, y, z, vx, vy, vz, afx, afy, afz, yaw, yaw_rate):
+        return MsgPacker.pack(self, time_boot_ms, x, y, z, vx, vy, vz, afx, afy, afz, yaw, yaw_rate,
+                              type_mask, target_system, target_component, coordinate_frame)
+
+
+## @brief 只解码指定消息类型的MAVLink v1/v2解析器，可逐个喂入UDP数据报或串口读到的任意长度字节
+class MavParser:
+    ## @brief 构造函数
+    # @param messages 要解码的消息，元素为(msgid, crcExtra, fmt)，如LOCAL_POSITION_NED
+    def __init__(self, messages):
+        self._want = {msgid: (crcExtra, struct.Struct(fmt)) for msgid, crcExtra, fmt in messages}
+        self._buf = bytearray()
+        ## @var MavParser.frames
+        # 解码成功的帧数
+        self.frames = 0
+        ## @var MavParser.skipped
+        # 不关心而跳过的帧数
+        self.skipped = 0
+        ## @var MavParser.crcErrors
+        # 校验失败（丢弃起始字节后重新同步）的次数
+        self.crcErrors = 0
+
+    ## @brief 喂入收到的字节
+    # @param data 字节序列，可以包含多帧，也可以只是半帧（剩余部分留到下次）
+    # @return 列表，元素为(msgid, sysid, compid, 字段元组)
+    def feed(self, data):
+        buf = self._buf
+        buf += data
+        out = []
+        pos = 0
+        end = len(buf)
+        want = self._want
+        while pos < end:
+            magic = buf[pos]
+            if magic == MAGIC_V2:
+                if end - pos < HEADER.size:
+                    break
+                n = buf[pos + 1]
+                size = HEADER.size + n + CHECKSUM.size
+                if buf[pos + 2] & IFLAG_SIGNED:
+                    size += SIGNATURE_LEN
+                msgid = buf[pos + 7] | buf[pos + 8] << 8 | buf[pos + 9] << 16
+                head = HEADER.size
+                sysid, compid = buf[pos + 5], buf[pos + 6]
+            elif magic == MAGIC_V1:
+                if end - pos < 6:
+                    break
+                n = buf[pos + 1]
+                size = 6 + n + CHECKSUM.size
+                msgid = buf[pos + 5]
+                head = 6
+                sysid, compid = buf[pos + 3], buf[pos + 4]
+            else:
+                pos += 1
+                continue
+            if end - pos < size:
+                break
+            spec = want.get(msgid)
+            if spec is None:
+                self.skipped += 1
+                pos += size
+                continue
+            crcExtra, layout = spec
+            crc = x25crc(memoryview(buf)[pos + 1:pos + head + n])
+            crc = (crc >> 8) ^ _CRC_TABLE[(crc ^ crcExtra) & 0xFF]
+            if crc != CHECKSUM.unpack_from(buf, pos + head + n)[0]:
+                self.crcErrors += 1
+                pos += 1
+                continue
+            payload = bytes(buf[pos + head:pos + head + n])
+            if n < layout.size:
+                payload += bytes(layout.size - n) # v2截掉的末尾0字节
+            out.append((msgid, sysid, compid, layout.unpack_from(payload, 0)))
+            self.frames += 1
+            pos += size
+        del buf[:pos]
+        return out
+
+
+if __name__ == "__main__":
+    # 与pymavlink逐字节比对，并比较每帧耗时
+    import time
+    import random
+    from pymavlink.dialects.v20 import common as mavlink2
+
+    class _Null:
+        def write(self, buf):
+            pass
+
+    mav = mavlink2.MAVLink(_Null(), 255, 1)
+    fast = HilActuatorControls()
+    rng = random.Random(0)
+    cases = [[0.0] * 16, [1.0] + [0.0] * 15, [0.0] * 15 + [1.0]]
+    cases += [[rng.uniform(-1, 1) for _ in range(rng.randint(1, 16))] + [0.0] * 16 for _ in range(2000)]
+    for k, c in enumerate(cases):
+        c = c[:16]
+        t = rng.randrange(1 << 40)
+        mode = rng.choice((1, 101, 201))
+        mav.seq = fast.seq
+        ref = mav.hil_actuator_controls_encode(t, c, mode, 1).pack(mav)
+        fast.pack(t, c, mode, 1)
+        assert fast.frame() == ref, (k, fast.frame().hex(), ref.hex())
+        payload = ref[10:-2] + bytes(-(len(ref) - 12) % 8)
+        assert fast.payload64() == struct.unpack("<%dQ" % (len(payload) // 8), payload), k
+    print(f"{len(cases)} frames identical to pymavlink (crc: {'fastcrc' if _mcrf4xx else 'table'})")
+
+    sp = SetPositionTargetLocalNed()
+    mav.seq = sp.seq
+    ref = mav.set_position_target_local_ned_encode(123, 1, 1, 1, 0b110111111000, 1.0, -2.0, 3.0,
+                                                   0, 0, 0, 0, 0, 0, 0.5, 0).pack(mav)
+    sp.pack(123, 1, 1, 1, 0b110111111000, 1.0, -2.0, 3.0, 0, 0, 0, 0, 0, 0, 0.5, 0)
+    assert sp.frame() == ref
+
+    # 解析：pymavlink编码的v2/v1混合字节流，任意切分后喂入，只解码关心的两种消息
+    parser = MavParser([LOCAL_POSITION_NED, ATTITUDE_QUATERNION])
+    mav1 = mavlink2.MAVLink(_Null(), 1, 1)
+    stream = bytearray()
+    expect = []
+    for k in range(500):
+        if k % 3 == 0:
+            stream += mav1.local_position_ned_encode(k, k * 0.5, -k * 0.25, -1.0, 0.5, 0.0, 0.0).pack(mav1)
+            expect.append((32, k))
+        elif k % 3 == 1:
+            stream += mav1.attitude_quaternion_encode(k, 1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0).pack(mav1)
+            expect.append((31, k))
+        else:
+            stream += mav1.heartbeat_encode(2, 12, 0, 0, 0).pack(mav1, force_mavlink1=True)
+    stream[5:7] = b"\xff\xff" # 一帧损坏
+    got = []
+    i = 0
+    while i < len(stream):
+        step = rng.randint(1, 300)
+        got += [(m, v[0]) for m, _, _, v in parser.feed(stream[i:i + step])]
+        i += step
+    assert got == expect[1:], (len(got), len(expect))
+    print(f"parser: {parser.frames} frames decoded, {parser.skipped} skipped, {parser.crcErrors} crc errors")
+
+    n = 20000
+    c = [0.5] * 16
+    t0 = time.perf_counter()
+    for i in range(n):
+        msg = mav.hil_actuator_controls_encode(i, c, 1, 1)
+        msg.pack(mav)
+        p = bytearray(msg.get_payload())
+        p += bytes(-len(p) % 8)
+        struct.unpack("<%dQ" % (len(p) // 8), p)
+    t1 = time.perf_counter()
+    for i in range(n):
+        fast.pack(i, c, 1, 1)
+        fast.payload64()
+    t2 = time.perf_counter()
+    print(f"pymavlink {(t1 - t0) / n * 1e6:.1f} us/frame, MavFast {(t2 - t1) / n * 1e6:.1f} us/frame")
@@ -0,0 +1,142 @@
+import numpy as np
+import TickScheduler
+
+## @file
+#  @brief 声明式任务阶段引擎
+#  @anchor MissionEngine接口库文件
+#
+#  任务由若干阶段（Phase）顺序组成，每个阶段有持续时间和一张预先计算好的设定点表。
+#  所有阶段共用同一个TickScheduler和同一个节拍循环：每拍按拍号取表中一行发出（表用完后不再发送，
+#  由飞控保持最后一个设定点），然后只读取一次状态，依次调用注册的钩子（遥测、日志等）。
+#  设定点表中的坐标相对任务原点，发送时再加上原点。
+#  每个阶段的单拍耗时（发送设定点+全部钩子）记录在直方图中，可用于比较各阶段的开销。
+
+
+## @brief 预计算的设定点表，每行为相对任务原点的(n, e, d, yaw)，可附加速度、加速度前馈列(vn, ve, vd, an, ae, ad)
+class SetpointTable:
+    ## @brief 构造函数
+    # @param sp (N,4)或(N,10)数组，或可转换为该形状的序列
+    def __init__(self, sp):
+        self.sp = np.atleast_2d(np.asarray(sp, dtype=float))
+        self.rows = self.sp.tolist()
+
+    def __len__(self):
+        return len(self.rows)
+
+    ## @brief 在节拍时刻上对轨迹函数采样生成设定点表
+    # @param fn 轨迹函数，输入时间数组t，返回可广播到t形状的(n, e, d, yaw)
+    # @param dt 节拍周期（秒）
+    # @param duration 持续时间（秒）
+    # @return SetpointTable
+    @classmethod
+    def sample(cls, fn, dt, duration):
+        t = np.arange(int(round(duration / dt))) * dt
+        return cls(np.column_stack(np.broadcast_arrays(*fn(t))))
+
+    ## @brief 由预计算的轨迹（Trajectory）生成设定点表
+    # @param traj Trajectory
+    # @param feedforward 为True时附加速度、加速度前馈列
+    @classmethod
+    def from_trajectory(cls, traj, feedforward=False):
+        cols = [traj.pos, traj.yaw]
+        if feedforward:
+            cols += [traj.vel, traj.acc]
+        return cls(np.column_stack(cols))
+
+    ## @brief 只有一行的定点表：阶段开始时发送一次，之后由飞控保持
+    @classmethod
+    def hold(cls, n, e, d, yaw=0.0):
+        return cls([[n, e, d, yaw]])
+
+
+## @brief 任务阶段
+class Phase:
+    ## @brief 构造函数
+    # @param name 阶段名称
+    # @param duration 持续时间（秒）
+    # @param table 设定点表，None表示该阶段不发送设定点
+    # @param on_enter 进入阶段时的回调，参数为该Phase
+    # @param on_exit 离开阶段时的回调，参数为该Phase
+    # @param log 钩子据此判断是否记录该阶段
+    def __init__(self, name, duration, table=None, on_enter=None, on_exit=None, log=False):
+        self.name = name
+        self.duration = duration
+        self.table = table
+        self.on_enter = on_enter
+        self.on_exit = on_exit
+        self.log = log
+
+
+## @brief 按阶段顺序执行任务
+class Mission:
+    ## @brief 构造函数
+    # @param sched 共用的TickScheduler
+    # @param send 设定点发送函数send(n, e, d, yaw, *feedforward)，位置为绝对坐标，其余参数为表中该行的剩余列
+    # @param read_state 每拍调用一次，返回本拍使用的状态（例如PX4MavCtrler.poseState）
+    # @param origin 任务原点(n, e, d)
+    def __init__(self, sched, send, read_state, origin=(0.0, 0.0, 0.0)):
+        self.sched = sched
+        self.send = send
+        self.read_state = read_state
+        self.origin = tuple(origin)
+        ## @var Mission.phases
+        # 阶段列表
+        self.phases = []
+        ## @var Mission.hooks
+        # 每拍调用的钩子hook(phase, k, target, state)，target为当前设定点行（相对原点），无设定点时为None
+        self.hooks = []
+        ## @var Mission.work
+        # 各阶段的单拍耗时直方图
+        self.work = {}
+
+    ## @brief 追加一个阶段
+    # @return 该Phase
+    def add(self, phase):
+        self.phases.append(phase)
+        return phase
+
+    ## @brief 注册每拍钩子，可作装饰器使用
+    def hook(self, fn):
+        self.hooks.append(fn)
+        return fn
+
+    ## @brief 依次执行全部阶段
+    def run(self):
+        for phase in self.phases:
+            self.run_phase(phase)
+
+    ## @brief 执行单个阶段
+    # @param phase 要执行的Phase
+    def run_phase(self, phase):
+        work = self.work.setdefault(phase.name, TickScheduler.TickHistogram())
+        rows = phase.table.rows if phase.table is not None else []
+        n_rows = len(rows)
+        on, oe, od = self.origin
+        clock = TickScheduler.clock
+        send = self.send
+        read_state = self.read_state
+        hooks = self.hooks
+        target = None
+        if phase.on_enter is not None:
+            phase.on_enter(phase)
+        for k in self.sched.run(phase.duration):
+            t_start = clock()
+            if k < n_rows:
+                target = rows[k]
+                send(target[0] + on, target[1] + oe, target[2] + od, *target[3:])
+            state = read_state()
+            for hook in hooks:
+                hook(phase, k, target, state)
+            work.record(clock() - t_start)
+        if phase.on_exit is not None:
+            phase.on_exit(phase)
+
+    ## @brief 各阶段单拍耗时的文本报告
+    def format_report(self):
+        lines = []
+        for name, h in self.work.items():
+            s = h.summary()
+            lines.append(
+                f"{name:<10} ticks={s['n']} work mean={s['mean_ms']:.3f} p99={s['p99_ms']:.3f} max={s['max_ms']:.3f} ms"
+            )
+        return "\n".join(lines)
@@ -17,8 +17,12 @@ import threading
 import struct
 import sys
 import math
-import numpy as np
 import EarthModel
+import StateRing
+import VehicleState
+from VehicleState import STATE_RING_LEN, OFFBOARD_HZ, OFFBOARD_MAX_HZ, StateSnapshot, PoseState, VelState
+import TickScheduler
+import MavFast
 
 # from mavros import mavlink as mavlink0
 from pymavlink.dialects.v20 import common as mavlink2
@@ -91,10 +95,20 @@ class fifo(object):
         return self.buf.pop(0)
 
 
+## @brief 把ROS消息头中的时间戳转为秒
+#  @param stamp ROS1的rospy.Time（secs/nsecs）或ROS2的builtin_interfaces/Time（sec/nanosec）
+#  @return 浮点秒数
+def stamp2sec(stamp):
+    nanosec = getattr(stamp, "nanosec", None)
+    if nanosec is not None:
+        return stamp.sec + nanosec * 1e-9
+    return stamp.secs + stamp.nsecs * 1e-9
+
+
 ##  @brief 无人机通信实例。
 #
 #   此类通过UDP、COM方式与无人机模拟器进行通信，控制模拟器的操作。
-class PX4MavCtrler:
+class PX4MavCtrler(VehicleState.OffboardReport, VehicleState.CtrlHelpers):
     """
     ID: 表示飞机的CopterID号。按平台规则，port=20100+CopterID*2-2。
     ip: 数据向外发送的IP地址。默认是发往本机的127.0.0.1的IP；在分布式仿真时，也可以指定192.168打头的局域网电脑IP；也可以使用255.255.255.255的广播地址（会干扰网络其他电脑）
@@ -121,8 +135,13 @@ class PX4MavCtrler:
     # @param CopterID 初始化时设置的无人机ID，默认为：1。
     # @param ip ip地址，默认为：127.0.0.1。
     # @param port IP端口，默认为：0。
+    # @param offboardHz Offboard设定点保活频率，默认为OFFBOARD_HZ。
+    # @param offboardMaxHz Offboard设定点最高发布频率，默认为OFFBOARD_MAX_HZ。
+    # @param rosNode 共用的ROS2节点，默认为None即自建节点和执行器线程；多机时由FleetCtrl传入同一个节点。
+    # @param stateStore 共用的状态存储，默认为None；非None时每条位姿/速度消息还会调用其putPose/putVel(CopterID, 快照)。
 
-    def __init__(self, CopterID=1, ip="127.0.0.1", Com="udp", port=0):
+    def __init__(self, CopterID=1, ip="127.0.0.1", Com="udp", port=0,
+                 offboardHz=OFFBOARD_HZ, offboardMaxHz=OFFBOARD_MAX_HZ, rosNode=None, stateStore=None):
         ##  @var PX4MavCtrler.isCom
         # UDP模式解析
         self.isCom = False
@@ -192,7 +211,8 @@ class PX4MavCtrler:
         ## @var PX4MavCtrler.command
         # 指令
         ## @var PX4MavCtrler.offCmd
-        # mavros_msgs包中的目标位置信息。
+        # mavros_msgs包中的目标位置信息，即当前正在发布的设定点。
+        # 设定点采用双缓冲：Send*函数每次构造一条完整的新消息，再整体替换offCmd，发布线程不会读到只改了一半的设定点。
         ## @var PX4MavCtrler.isInOffboard
         # 是否进入Offboard模式的标志位。
         self.imu = None
@@ -210,6 +230,32 @@ class PX4MavCtrler:
         self.offCmd = PositionTarget()
         self.offCmd.header.frame_id = "world"
         self.isInOffboard = False
+        ## @var PX4MavCtrler.offboardHz
+        # 设定点保活频率
+        ## @var PX4MavCtrler.offboardMaxHz
+        # 设定点最高发布频率
+        ## @var PX4MavCtrler.offPubInterval
+        # 相邻两次发布的间隔直方图
+        ## @var PX4MavCtrler.offPubLatency
+        # 设定点从Send*替换到首次发布的时延直方图
+        ## @var PX4MavCtrler.offStats
+        # 发布计数：cmds为Send*调用次数，published为发布总次数，onChange/keepalive为其中因新设定点/保活而发布的次数，
+        # coalesced为还没发布就被下一个设定点替换的次数
+        self.offboardHz = offboardHz
+        self.offboardMaxHz = offboardMaxHz
+        self.offPubInterval = TickScheduler.TickHistogram(bin_s=100e-6, max_s=1.0)
+        self.offPubLatency = TickScheduler.TickHistogram()
+        self.offStats = {"cmds": 0, "published": 0, "onChange": 0, "keepalive": 0, "coalesced": 0}
+        self._offSlot = (self.offCmd, 0, time.monotonic())
+        self._offEvent = threading.Event()
+        self._offLastSeq = -1
+        self._offLastPub = None
+        ## @var PX4MavCtrler.stateStore
+        # 共用的状态存储（见构造函数）
+        self.stateStore = stateStore
+        ## @var PX4MavCtrler.t2
+        # Offboard发布线程，由FleetCtrl统一发布时为None
+        self.t2 = None
 
         ## @var PX4MavCtrler.uavAngEular
         # 无人机欧拉角状态量
@@ -227,12 +273,43 @@ class PX4MavCtrler:
         # 真实全球GPS位置
         ## @var PX4MavCtrler.geo
         # 地理坐标转换的模块
+        ## @var PX4MavCtrler.gpsFrame
+        # 以trueGpsUeCenter为原点预计算的NED坐标系，只在setGPSOriLLA时重建
         ## @var PX4MavCtrler.count
         # 软件在环仿真计数
         ## @var PX4MavCtrler.countHil
         # 硬件在环仿真计数
         ## @var PX4MavCtrler.hasInit
         # 初始化是否完成标志位
+        ## @var PX4MavCtrler.poseState
+        # 最新的位置姿态快照（PoseState），每条消息整体替换
+        ## @var PX4MavCtrler.velState
+        # 最新的速度快照（VelState），每条消息整体替换
+        self.poseState = PoseState(0, 0.0, -math.inf, (0, 0, 0), (0, 0, 0), (0, 0, 0, 0))
+        self.velState = VelState(0, 0.0, -math.inf, (0, 0, 0), (0, 0, 0))
+        # 每个订阅话题一个环形缓冲区，以回调收到消息的time.monotonic()为时间轴，stamp列为消息头时间戳
+        ## @var PX4MavCtrler.poseRing
+        # 位置姿态的全速率记录（NED位置、欧拉角、四元数）
+        ## @var PX4MavCtrler.velRing
+        # 速度的全速率记录（NED速度、角速率）
+        ## @var PX4MavCtrler.imuRing
+        # IMU的全速率记录（mavros机体系下的加速度和角速度原始值）
+        ## @var PX4MavCtrler.gpsRing
+        # GPS的全速率记录（经纬高及其在gpsFrame下的NED坐标）
+        self.poseRing = StateRing.StateRing(
+            ("stamp", "n", "e", "d", "roll", "pitch", "yaw", "qw", "qx", "qy", "qz"),
+            STATE_RING_LEN,
+            angles=("roll", "pitch", "yaw"),
+        )
+        self.velRing = StateRing.StateRing(
+            ("stamp", "vn", "ve", "vd", "p", "q", "r"), STATE_RING_LEN
+        )
+        self.imuRing = StateRing.StateRing(
+            ("stamp", "ax", "ay", "az", "gx", "gy", "gz"), STATE_RING_LEN
+        )
+        self.gpsRing = StateRing.StateRing(
+            ("stamp", "lat", "lon", "alt", "n", "e", "d"), STATE_RING_LEN
+        )
         self.uavAngEular = [0, 0, 0]
         self.uavAngRate = [0, 0, 0]
         self.uavPosNED = [0, 0, 0]
@@ -245,6 +322,7 @@ class PX4MavCtrler:
         ]  # Estimated global position from PX4 that transferred to UE4 map
         self.trueGpsUeCenter = [40.1540302, 116.2593683, 50]
         self.geo = EarthModel.EarthModel()
+        self.gpsFrame = EarthModel.LocalFrame(self.trueGpsUeCenter, self.geo)
         self.count = 0
         self.countHil = 0
         self.hasInit = False
@@ -335,25 +413,31 @@ class PX4MavCtrler:
 
         else:
 
-            try:
-                rclpy.init()
-            except:
-                if rclpy.ok():
-                    print("Already init.")
-                else:
-                    print("init fail")
             ## @var PX4MavCtrler.ros_node
             # 创建ROS节点
             ## @var PX4MavCtrler.executor
             # 创建一个多线程执行器
             ## @var PX4MavCtrler.t1
             # 创建一个线程并开始执行
-            self.ros_node = Node("RflyRos" + str(self.CopterID))
-            self.executor = rclpy.executors.MultiThreadedExecutor()
-            self.executor.add_node(self.ros_node)
-
-            self.t1 = threading.Thread(target=self.executor.spin, args=())
-            self.t1.start()
+            if rosNode is None:
+                try:
+                    rclpy.init()
+                except:
+                    if rclpy.ok():
+                        print("Already init.")
+                    else:
+                        print("init fail")
+                self.ros_node = Node("RflyRos" + str(self.CopterID))
+                self.executor = rclpy.executors.MultiThreadedExecutor()
+                self.executor.add_node(self.ros_node)
+
+                self.t1 = threading.Thread(target=self.executor.spin, args=())
+                self.t1.start()
+            else:
+                # 共用节点，执行器和spin线程由创建节点的一方负责
+                self.ros_node = rosNode
+                self.executor = None
+                self.t1 = None
 
             # rclpy.executors.MultiThreadedExecutor().add_node(self.ros_node)
             # Configure QoS profile for publishing and subscribing
@@ -427,6 +511,13 @@ class PX4MavCtrler:
         # 发送任意mavlink消息
         self.f = fifo
         self.mav0 = mavlink2.MAVLink(self.f, 255, 1)
+        ## @var PX4MavCtrler.hilPacker
+        # hil_actuator_controls的快速打包器，系统/组件ID与mav0相同
+        self.hilPacker = MavFast.HilActuatorControls(255, 1)
+        ## @var PX4MavCtrler.hilRosMsg
+        # ROS2下SendHILCtrlMsg复用的Mavlink消息（rclpy在publish中同步序列化）；
+        # ROS1带队列的Publisher在后台线程序列化，每次仍新建消息
+        self.hilRosMsg = None if is_use_ros1 else self._newHilRosMsg()
 
     ## @brief ROS守护进程spin函数,保持节点运行
     # @param  无
@@ -447,9 +538,8 @@ class PX4MavCtrler:
     def convert_to_payload64(self, payload_bytes):
         payload_bytes = bytearray(payload_bytes)
         payload_len = len(payload_bytes)
-        payload_octets = payload_len / 8
+        payload_octets = (payload_len + 7) // 8
         if payload_len % 8 > 0:
-            payload_octets += 1
             payload_bytes += b"\0" * (8 - payload_len % 8)
 
         return struct.unpack("<%dQ" % payload_octets, payload_bytes)
@@ -492,6 +582,7 @@ class PX4MavCtrler:
     def setGPSOriLLA(self, LonLatAlt=[40.1540302, 116.2593683, 50]):
         # lla -> 纬度，经度，高度
         self.trueGpsUeCenter = LonLatAlt
+        self.gpsFrame = EarthModel.LocalFrame(LonLatAlt, self.geo)
 
     ## @brief 给PX4发送解锁指令。
     # @param isArm 解锁标志位。
@@ -504,29 +595,6 @@ class PX4MavCtrler:
             req.value = isArm
             return self.armService.call_async(req)
 
-    ## @brief 将输入数据填充或截断到指定的长度。
-    # @param data 需要填充或截断的数据，可以是列表或NumPy数组。
-    # @param inLen 目标长度，即填充或截断后的长度。
-    # @param fill 填充值，当数据长度小于目标长度时，会用这个值来填充数据。默认值为0。
-    # @return 返回填充或截断后的数据
-    def fillList(self, data, inLen, fill=0):
-        if isinstance(data, np.ndarray):
-            data = data.tolist()
-
-        if isinstance(data, list) and len(data) == inLen:
-            return data
-        else:
-            if isinstance(data, list):
-                datLen = len(data)
-                if datLen < inLen:
-                    data = data + [fill] * (inLen - datLen)
-
-                if datLen > inLen:
-                    data = data[0:inLen]
-            else:
-                data = [data] + [fill] * (inLen - 1)
-        return data
-
     ## @brief 仿真初始化，启动无人机仿真循环
     def InitMavLoop(self):
         if self.isCom:
@@ -666,6 +734,18 @@ class PX4MavCtrler:
 
     ## @brief 初始化Offboard模式
     def initOffboard(self):
+        self.prepareOffboard()
+
+        self.t2 = threading.Thread(target=self.OffboardLoop, args=())
+        self.t2.start()
+        # 等待offboard消息发一阵，让PX4认为通信健康
+
+        time.sleep(1)
+
+        self.engageOffboard()
+
+    ## @brief Offboard准备：发出零速设定点并设置失联保护参数，之后需要有线程持续发布设定点
+    def prepareOffboard(self):
 
         if is_use_ros1 and not self.hasInit:
             self.hasInit = True
@@ -688,12 +768,8 @@ class PX4MavCtrler:
         self.sendMavSetParam("NAV_DLL_ACT", 0, "INT")
         self.sendMavSetParam("COM_RCL_EXCEPT", 4, "INT")
 
-        self.t2 = threading.Thread(target=self.OffboardLoop, args=())
-        self.t2.start()
-        # 等待offboard消息发一阵，让PX4认为通信健康
-
-        time.sleep(1)
-
+    ## @brief 切换到Offboard模式并解锁，调用前设定点应已持续发布约1秒
+    def engageOffboard(self):
         # 发送命令，且换Offboard模式
         self.offboard_state = self.offboard()
 
@@ -702,15 +778,12 @@ class PX4MavCtrler:
         self.arm_state = self.arm()
 
     ## @brief 启动Offboard模式循环
+    #
+    #  新设定点到达时立即发布（相邻两次发布至少间隔1/offboardMaxHz，期间到达的多个设定点只发布最新一个），
+    #  超过1/offboardHz没有新设定点时重发最近一次设定点作为保活。
     def OffboardLoop(self):
-
-        # ROS1和ROS2创建rate的方式不同
-        if is_use_ros1:
-            rate = rospy.Rate(30)
-        else:
-            rate = self.ros_node.create_rate(30)
-            # self.timer = self.ros_node.create_timer(1/30.0, self.offboardSend) # 30Hz频率定时器
-            # rclpy.spin(self.ros_node) # 开启定时器
+        keepalive = 1.0 / self.offboardHz
+        minGap = 1.0 / self.offboardMaxHz if self.offboardMaxHz > 0 else 0.0
 
         while True:
             if not self.isInOffboard:
@@ -721,28 +794,75 @@ class PX4MavCtrler:
                 isRosOK = not rospy.is_shutdown()
             else:
                 isRosOK = rclpy.ok()
-
-            if isRosOK:
-                if is_use_ros1:
-                    self.offCmd.header.stamp = rospy.Time.now()
-                    self.offCmd.header.seq = self.count  # ROS2 没有header.seq字段
-                    self.count = self.count + 1
-                else:
-                    self.offCmd.header.stamp = self.ros_node.get_clock().now().to_msg()
-                    # rclpy.spin_once(self.ros_node)
-
-                self.vel_raw_pub.publish(self.offCmd)
-                # self.SendHILCtrlMsg()
-                rate.sleep()
-            else:
+            if not isRosOK:
                 break
+
+            lastPub = self._offLastPub
+            if lastPub is not None:
+                self._offEvent.wait(max(0.0, lastPub + keepalive - time.monotonic()))
+                # 限制最高发布频率：距上次发布不足minGap时等到minGap再取最新的设定点
+                gap = lastPub + minGap - time.monotonic()
+                if gap > 0:
+                    time.sleep(gap)
+            self.publishOffboard()
         print("Offboard Stoped.")
 
+    ## @brief 发布当前设定点并记录统计，由OffboardLoop或FleetCtrl的统一发布线程调用
+    def publishOffboard(self):
+        self._offEvent.clear()
+        cmd, seq, t_set = self._offSlot
+
+        if is_use_ros1:
+            cmd.header.stamp = rospy.Time.now()
+            cmd.header.seq = self.count  # ROS2 没有header.seq字段
+            self.count = self.count + 1
+        else:
+            cmd.header.stamp = self.ros_node.get_clock().now().to_msg()
+
+        self.vel_raw_pub.publish(cmd)
+        # self.SendHILCtrlMsg()
+
+        now = time.monotonic()
+        if self._offLastPub is not None:
+            self.offPubInterval.record(now - self._offLastPub)
+        self._offLastPub = now
+        self.offStats["published"] += 1
+        if seq != self._offLastSeq:
+            self.offStats["onChange"] += 1
+            self.offPubLatency.record(now - t_set)
+            self._offLastSeq = seq
+        else:
+            self.offStats["keepalive"] += 1
+
+    ## @brief 有新设定点或到了保活时刻时发布，供统一发布线程每拍调用
+    #  @param now 当前time.monotonic()
+    #  @return 是否发布
+    def pollOffboard(self, now):
+        if self._offSlot[1] == self._offLastSeq and self._offLastPub is not None \
+                and now - self._offLastPub < 1.0 / self.offboardHz:
+            return False
+        self.publishOffboard()
+        return True
+
+    ## @brief 替换当前设定点并唤醒发布线程
+    #  @param cmd 新构造的完整PositionTarget，替换后不应再修改
+    def _swapOffCmd(self, cmd):
+        cmd.header.frame_id = "world"
+        seq = self._offSlot[1] + 1
+        if self.isInOffboard and self._offEvent.is_set():
+            self.offStats["coalesced"] += 1
+        self.offCmd = cmd
+        self._offSlot = (cmd, seq, time.monotonic())
+        self.offStats["cmds"] += 1
+        self._offEvent.set()
+
     ## @brief 结束Offboard模式
     def endOffboard(self):
         self.isInOffboard = False
-        self.t2.join()
-        if not is_use_ros1:
+        self._offEvent.set()
+        if self.t2 is not None:
+            self.t2.join()
+        if not is_use_ros1 and self.t1 is not None:
             self.t1.join()
             try:
                 rclpy.shutdown()
@@ -758,48 +878,20 @@ class PX4MavCtrler:
         self.child.terminate()
         print("Please close all Terminal windows to close")
 
-    ## @brief 根据提供的布尔列表 EnList 计算一个类型掩码（type mask）。
-    #  @param EnList 布尔列表
-    #  @return 返回计算后的类型掩码
-    def calcTypeMask(self, EnList):
-        enPos = EnList[0]
-        enVel = EnList[1]
-        enAcc = EnList[2]
-        enForce = EnList[3]
-        enYaw = EnList[4]
-        EnYawrate = EnList[5]
-        y = int(0)
-        if not enPos:
-            y = y | 7
-
-        if not enVel:
-            y = y | (7 << 3)
-
-        if not enAcc:
-            y = y | (7 << 6)
-
-        if not enForce:
-            y = y | (1 << 9)
-
-        if not enYaw:
-            y = y | (1 << 10)
-
-        if not EnYawrate:
-            y = y | (1 << 11)
-        return y
-
     ## @brief 发送北东地坐标系下的速度指令。
     #  @param vx X轴速度
     #  @param vy Y轴速度
     #  @param vz Z轴速度
     #  @param yawrate 偏航角速率
     def SendVelNED(self, vx=math.nan, vy=math.nan, vz=math.nan, yawrate=math.nan):
-        self.offCmd.coordinate_frame = self.offCmd.FRAME_LOCAL_NED
-        self.offCmd.type_mask = self.calcTypeMask([0, 1, 0, 0, 0, 1])
-        self.offCmd.velocity.x = float(vx)
-        self.offCmd.velocity.y = float(-vy)
-        self.offCmd.velocity.z = float(-vz)
-        self.offCmd.yaw_rate = float(-yawrate)
+        cmd = PositionTarget()
+        cmd.coordinate_frame = cmd.FRAME_LOCAL_NED
+        cmd.type_mask = self.calcTypeMask([0, 1, 0, 0, 0, 1])
+        cmd.velocity.x = float(vx)
+        cmd.velocity.y = float(-vy)
+        cmd.velocity.z = float(-vz)
+        cmd.yaw_rate = float(-yawrate)
+        self._swapOffCmd(cmd)
 
     ## @brief 发送机体坐标系下的速度指令。
     #  @param vx X轴速度
@@ -807,12 +899,14 @@ class PX4MavCtrler:
     #  @param vz Z轴速度
     #  @param yawrate 偏航角速率
     def SendVelFRD(self, vx=math.nan, vy=math.nan, vz=math.nan, yawrate=math.nan):
-        self.offCmd.coordinate_frame = self.offCmd.FRAME_BODY_NED
-        self.offCmd.type_mask = self.calcTypeMask([0, 1, 0, 0, 0, 1])
-        self.offCmd.velocity.x = float(vx)
-        self.offCmd.velocity.y = float(-vy)
-        self.offCmd.velocity.z = float(-vz)
-        self.offCmd.yaw_rate = float(-yawrate)
+        cmd = PositionTarget()
+        cmd.coordinate_frame = cmd.FRAME_BODY_NED
+        cmd.type_mask = self.calcTypeMask([0, 1, 0, 0, 0, 1])
+        cmd.velocity.x = float(vx)
+        cmd.velocity.y = float(-vy)
+        cmd.velocity.z = float(-vz)
+        cmd.yaw_rate = float(-yawrate)
+        self._swapOffCmd(cmd)
 
     ## @brief 发送北东地坐标系下的位置指令。
     #  @param x X轴位置
@@ -820,15 +914,17 @@ class PX4MavCtrler:
     #  @param z Z轴位置
     #  @param yaw 偏航角角度
     def SendPosNED(self, x=math.nan, y=math.nan, z=math.nan, yaw=math.nan):
-        self.offCmd.coordinate_frame = self.offCmd.FRAME_LOCAL_NED
-        self.offCmd.type_mask = self.calcTypeMask([1, 0, 0, 0, 1, 0])
-        self.offCmd.position.x = float(x)
-        self.offCmd.position.y = float(-y)
-        self.offCmd.position.z = float(-z)
+        cmd = PositionTarget()
+        cmd.coordinate_frame = cmd.FRAME_LOCAL_NED
+        cmd.type_mask = self.calcTypeMask([1, 0, 0, 0, 1, 0])
+        cmd.position.x = float(x)
+        cmd.position.y = float(-y)
+        cmd.position.z = float(-z)
         if not math.isnan(yaw):
-            self.offCmd.yaw = float(-yaw + math.pi / 2)
+            cmd.yaw = float(-yaw + math.pi / 2)
         else:
-            self.offCmd.yaw = float(yaw)
+            cmd.yaw = float(yaw)
+        self._swapOffCmd(cmd)
 
     ## @brief 发送北东地坐标系下的位置、速度指令，位置和速度共同控制接口，如果某个通道不想控制，设置为nan即可。
     #  @param PosE X、Y、Z轴位置指令
@@ -851,49 +947,110 @@ class PX4MavCtrler:
         vy = VelE[1]
         vz = VelE[2]
 
-        self.offCmd.coordinate_frame = self.offCmd.FRAME_LOCAL_NED
+        cmd = PositionTarget()
+        cmd.coordinate_frame = cmd.FRAME_LOCAL_NED
 
         # 启用位置和速度共同控制
-        self.offCmd.type_mask = self.calcTypeMask([1, 1, 0, 0, 1, 1])
-        self.offCmd.position.x = float(x)
-        self.offCmd.position.y = float(-y)
-        self.offCmd.position.z = float(-z)
-        self.offCmd.velocity.x = float(vx)
-        self.offCmd.velocity.y = float(-vy)
-        self.offCmd.velocity.z = float(-vz)
-        self.offCmd.yaw_rate = float(-yawrate)
+        cmd.type_mask = self.calcTypeMask([1, 1, 0, 0, 1, 1])
+        cmd.position.x = float(x)
+        cmd.position.y = float(-y)
+        cmd.position.z = float(-z)
+        cmd.velocity.x = float(vx)
+        cmd.velocity.y = float(-vy)
+        cmd.velocity.z = float(-vz)
+        cmd.yaw_rate = float(-yawrate)
         if not math.isnan(yaw):
-            self.offCmd.yaw = float(-yaw + math.pi / 2)
+            cmd.yaw = float(-yaw + math.pi / 2)
         else:
-            self.offCmd.yaw = float(math.nan)  # 设为nan表示不控制
+            cmd.yaw = float(math.nan)  # 设为nan表示不控制
+        self._swapOffCmd(cmd)
+
+    ## @brief 发送北东地坐标系下的位置、速度、加速度指令，速度和加速度作为位置控制的前馈，某个通道不想控制时设置为nan即可。
+    #  坐标轴约定与SendPosVelNED相同。
+    #  @param PosE X、Y、Z轴位置指令
+    #  @param VelE X、Y、Z轴速度指令
+    #  @param AccE X、Y、Z轴加速度指令
+    #  @param yaw 偏航角角度
+    #  @param yawrate 偏航角速率
+    def SendPosVelAccNED(
+        self,
+        PosE=[math.nan] * 3,
+        VelE=[math.nan] * 3,
+        AccE=[math.nan] * 3,
+        yaw=math.nan,
+        yawrate=math.nan,
+    ):
+        PosE = self.fillList(PosE, 3, math.nan)
+        VelE = self.fillList(VelE, 3, math.nan)
+        AccE = self.fillList(AccE, 3, math.nan)
+
+        cmd = PositionTarget()
+        cmd.coordinate_frame = cmd.FRAME_LOCAL_NED
+
+        # 启用位置、速度、加速度共同控制
+        cmd.type_mask = self.calcTypeMask([1, 1, 1, 0, 1, 1])
+        cmd.position.x = float(PosE[0])
+        cmd.position.y = float(-PosE[1])
+        cmd.position.z = float(-PosE[2])
+        cmd.velocity.x = float(VelE[0])
+        cmd.velocity.y = float(-VelE[1])
+        cmd.velocity.z = float(-VelE[2])
+        cmd.acceleration_or_force.x = float(AccE[0])
+        cmd.acceleration_or_force.y = float(-AccE[1])
+        cmd.acceleration_or_force.z = float(-AccE[2])
+        cmd.yaw_rate = float(-yawrate)
+        if not math.isnan(yaw):
+            cmd.yaw = float(-yaw + math.pi / 2)
+        else:
+            cmd.yaw = float(math.nan)  # 设为nan表示不控制
+        self._swapOffCmd(cmd)
 
     ## @brief 处理ROS中订阅的本地位置话题的消息，更新无人机的位置和姿态信息
+    #
+    #  先构造完整的PoseState再整体发布；uavPosNED等旧接口同样整体替换为新列表，不再逐元素改写。
     #  @param msg 从ROS中接收到的消息对象
     def local_pose_callback(self, msg):
+        recvTime = time.monotonic()
         self.local_pose = msg
-        ang = self.q2Euler(self.local_pose.pose.orientation)
-        q = self.local_pose.pose.orientation
-        self.uavAngQuatern = [q.w, q.x, q.y, q.z]
-        self.uavAngEular[0] = ang[1]
-        self.uavAngEular[1] = ang[0]
-        self.uavAngEular[2] = self.yawSat(-ang[2] + math.pi / 2)
-
-        self.uavPosNED[0] = self.local_pose.pose.position.y
-        self.uavPosNED[1] = self.local_pose.pose.position.x
-        self.uavPosNED[2] = -self.local_pose.pose.position.z
+        q = msg.pose.orientation
+        p = msg.pose.position
+        ang = self.q2Euler(q)
+        state = PoseState(
+            self.poseState.seq + 1,
+            stamp2sec(msg.header.stamp),
+            recvTime,
+            (p.y, p.x, -p.z),
+            (ang[1], ang[0], self.yawSat(-ang[2] + math.pi / 2)),
+            (q.w, q.x, q.y, q.z),
+        )
+        self.poseState = state
+        self.poseRing.append(recvTime, (state.stamp,) + state.posNED + state.angEular + state.angQuatern)
+        self.uavAngQuatern = list(state.angQuatern)
+        self.uavAngEular = list(state.angEular)
+        self.uavPosNED = list(state.posNED)
+        if self.stateStore is not None:
+            self.stateStore.putPose(self.CopterID, state)
 
     ## @brief 处理ROS中订阅的本地速度话题的消息，更新无人机的速度和角速率信息
     #  @param msg 从ROS中接收到的消息对象
     def local_vel_callback(self, msg):
+        recvTime = time.monotonic()
         self.local_vel = msg
-
-        self.uavVelNED[0] = self.local_vel.twist.linear.y
-        self.uavVelNED[1] = self.local_vel.twist.linear.x
-        self.uavVelNED[2] = -self.local_vel.twist.linear.z
-
-        self.uavAngRate[0] = self.local_vel.twist.angular.y
-        self.uavAngRate[1] = self.local_vel.twist.angular.x
-        self.uavAngRate[2] = -self.local_vel.twist.angular.z
+        v = msg.twist.linear
+        w = msg.twist.angular
+        state = VelState(
+            self.velState.seq + 1,
+            stamp2sec(msg.header.stamp),
+            recvTime,
+            (v.y, v.x, -v.z),
+            (w.y, w.x, -w.z),
+        )
+        self.velState = state
+        self.velRing.append(recvTime, (state.stamp,) + state.velNED + state.angRate)
+        self.uavVelNED = list(state.velNED)
+        self.uavAngRate = list(state.angRate)
+        if self.stateStore is not None:
+            self.stateStore.putVel(self.CopterID, state)
 
     ## @brief 处理ROS中订阅的MAVROS状态主题的消息，更新无人机的飞行模式信息。
     #  @param msg 从ROS中接收到的消息对象
@@ -904,7 +1061,13 @@ class PX4MavCtrler:
     #  @param msg 从ROS中接收到的消息对象
     def imu_callback(self, msg):
         global global_imu, current_heading
+        recvTime = time.monotonic()
         self.imu = msg
+        a = msg.linear_acceleration
+        w = msg.angular_velocity
+        self.imuRing.append(
+            recvTime, (stamp2sec(msg.header.stamp), a.x, a.y, a.z, w.x, w.y, w.z)
+        )
 
         self.current_heading = self.q2yaw(self.imu.orientation)
         self.received_imu = True
@@ -912,25 +1075,11 @@ class PX4MavCtrler:
     ## @brief 处理ROS中订阅的GPS话题的消息，更新无人机的GPS数据
     #  @param msg 从ROS中接收到的消息对象
     def gps_callback(self, msg):
+        recvTime = time.monotonic()
         self.gps = msg
         LLA = [msg.latitude, msg.longitude, msg.altitude]
-        self.uavGlobalPos = self.geo.lla2ned(LLA, self.trueGpsUeCenter)
-
-    ## @brief 从输入的四元数（q）来计算偏航角
-    #  @param q 四元数
-    def q2yaw(self, q):
-        q0, q1, q2, q3 = q.w, q.x, q.y, q.z
-        math.atan2(2 * (q0 * q3 + q1 * q2), 1 - 2 * (q2 * q2 + q3 * q3))
-
-    ## @brief 从输入的四元数（q）来计算欧拉角
-    #  @param q 四元数
-    #  @return 返回计算后的姿态角。
-    def q2Euler(self, q):
-        w, x, y, z = q.w, q.x, q.y, q.z
-        roll = math.atan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))
-        pitch = math.asin(2 * (w * y - z * x))
-        yaw = math.atan2(2 * (w * z + x * y), 1 - 2 * (z * z + y * y))
-        return [roll, pitch, yaw]
+        self.uavGlobalPos = self.gpsFrame.lla2ned(LLA)
+        self.gpsRing.append(recvTime, [stamp2sec(msg.header.stamp)] + LLA + self.uavGlobalPos)
 
     # send MAVLink command to Pixhawk to Arm/Disarm the drone
     ## @brief 通过MAVLink发送解锁指令给PX4
@@ -992,17 +1141,6 @@ class PX4MavCtrler:
             print("Vechile LAND failed")
             return False
 
-    ## @brief 对偏航角进行饱和处理，此函数接收一个偏航角值，并确保其在 -π/2 到 π/2 弧度（或等效的 -90 到 90 度）的范围内。如果输入的偏航角超出这个范围，函数会相应地调整它，使其不超过阈值。
-    # @param yaw 输入的偏航角，以弧度为单位
-    # @return 返回饱和后的偏航角值
-    def yawSat(self, yaw):
-        yawOut = yaw
-        if yaw > math.pi / 2:
-            yawOut = yaw - math.pi / 2
-        if yaw < -math.pi / 2:
-            yawOut = yaw + math.pi / 2
-        return yawOut
-
     ## @brief 发送MAVLink设置参数请求，用于通过MAVLink协议设置无人机的参数。根据参数类型，它可以设置整型或实型参数。
     # @param param_id_str 参数的名称字符串标识符
     # @param param_value 参数的值，可以是整型或实型
@@ -1111,27 +1249,26 @@ class PX4MavCtrler:
         time_boot_ms = int(time.time() * 1000)
         controls = self.fillList(ctrls, 16, float(0))
 
-        # 打包一个mavlink的包
-        msg = self.mav0.hil_actuator_controls_encode(
-            time_boot_ms, controls, int(mode), int(flag)
-        )
-        msg.pack(self.mav0)
+        # 打包一个mavlink的包：负载直接打包进预分配的缓冲区，payload64和checksum由hilPacker给出，
+        # 不再经过hil_actuator_controls_encode/convert_to_rosmsg
+        packer = self.hilPacker
+        packer.pack(time_boot_ms, controls, int(mode), int(flag))
 
         if is_use_ros1:
             # 包头数据填充
-            head = Header(stamp=rospy.get_rostime())
-            head.seq = self.countHil  # ROS2 没有header.seq字段
+            rosmsg = self._newHilRosMsg()
+            rosmsg.header.stamp = rospy.get_rostime()
+            rosmsg.header.seq = self.countHil  # ROS2 没有header.seq字段
             self.countHil = self.countHil + 1
-
-            # 将mavlinkbuf包转为ros包
-            rosmsg = self.convert_to_rosmsg(msg, head)
         else:
-            # 包头数据填充
-            stamp = self.ros_node.get_clock().now().to_msg()
-            head = Header(stamp=stamp)
+            rosmsg = self.hilRosMsg
+            rosmsg.header.stamp = self.ros_node.get_clock().now().to_msg()
 
-            # 将mavlinkbuf包转为ros包
-            rosmsg = self.convert_to_rosmsg(msg, head)
+        # 将mavlinkbuf包转为ros包，seq与计算checksum时用的一致
+        rosmsg.len = packer.len
+        rosmsg.seq = packer.lastSeq
+        rosmsg.checksum = packer.crc
+        rosmsg.payload64 = packer.payload64()
 
         # 注意，上面代码的核心是创建一个Mavlink消息，并转换为ros_mavlink消息，在Python中比较复杂
         # 在C语言中很简单，利用\opt\ros\[noetic或foxy]\include\mavros_msgs\mavlink_convert.h中的
@@ -1139,4 +1276,19 @@ class PX4MavCtrler:
         # RflySim平台需要借用hil_actuator_controls来将数据传到rfly_ctrl、rfly_ctrl1和rfly_ctrl2中
 
         # 通过mavros的接口，将一条mavlink的buf包消息，传给飞控
-        self.mav_raw_pub.publish(rosmsg)
\ No newline at end of file
+        self.mav_raw_pub.publish(rosmsg)
+
+    ## @brief 新建hil_actuator_controls用的Mavlink消息，填好不随帧变化的字段
+    def _newHilRosMsg(self):
+        packer = self.hilPacker
+        return Mavlink(
+            header=Header(),
+            framing_status=Mavlink.FRAMING_OK,
+            magic=Mavlink.MAVLINK_V20,
+            incompat_flags=0,
+            compat_flags=0,
+            sysid=packer.sysid,
+            compid=packer.compid,
+            msgid=packer.msgid,
+            signature=[],
+        )
@@ -0,0 +1,704 @@
+import time
+import math
+import socket
+import struct
+import argparse
+import threading
+import traceback
+import collections
+import EarthModel
+import StateRing
+import TickScheduler
+import MavFast
+import VehicleState
+from VehicleState import STATE_RING_LEN, OFFBOARD_HZ, OFFBOARD_MAX_HZ, PoseState, VelState
+
+## @file
+#  @brief 不经过mavros、直接以MAVLink（UDP或串口）与PX4通信的控制接口，公开接口与PX4MavCtrlV4ROS.PX4MavCtrler相同
+#  @anchor PX4MavDirect接口库文件
+#
+#  PX4MavCtrler的每个设定点都要经过ROS序列化、mavros进程转发两跳才到达CopterSim；本后端直接收发MAVLink：
+#  - UDP模式按CopterSim的端口规则，port=20100+2*(CopterID-1)，本机绑定port+1接收，发往ip:port；串口模式读写串口（需pyserial）。
+#  - 接收线程以超时方式阻塞在socket/串口上，只解码LOCAL_POSITION_NED、ATTITUDE_QUATERNION、GLOBAL_POSITION_INT和HEARTBEAT，
+#    其余消息整帧跳过（MavFast.MavParser）。
+#  - 设定点直接打包为SET_POSITION_TARGET_LOCAL_NED发出（MavFast.SetPositionTargetLocalNed），发布策略与PX4MavCtrler相同：
+#    新设定点立即发布（不超过offboardMaxHz），空闲时按offboardHz保活。
+#  - 每秒发一次HEARTBEAT（与mavros相同，类型为机载控制器）。
+#
+#  为了让上层代码（mavros_plot8等）换后端时行为不变，坐标换算完全复刻“PX4MavCtrler + mavros”的组合：
+#  Send*先按PX4MavCtrler的写法得到mavros的ENU设定点，再按mavros的ENU→NED规则换算后发出；
+#  收到的状态先按mavros的规则换成ENU消息，再按PX4MavCtrler回调中的写法得到uavPosNED、uavAngEular等。
+#  因此SendPosNED(x, y, z, yaw)实际发给PX4的NED目标是(-y, x, z)、偏航yaw，与经mavros时一致。
+#  与mavros的差异：消息时间戳stamp为飞控启动时间（time_boot_ms，mavros会做时间同步），
+#  GPS高度为GLOBAL_POSITION_INT的海拔高度（mavros换算为椭球高），不发布IMU（imuRing为空）。
+#  直接运行本文件：--fake 启动一个模拟PX4的本地MAVLink端点；--selftest 用该端点自检一次起飞、定点和降落流程。
+
+## @brief 等待数据时socket/串口的超时（秒），也是接收线程检查退出和发送心跳的最长间隔
+RECV_TIMEOUT_S = 0.1
+## @brief 心跳间隔（秒）
+HEARTBEAT_S = 1.0
+
+MAV_FRAME_LOCAL_NED = 1
+MAV_FRAME_BODY_NED = 8
+MAV_CMD_DO_SET_MODE = 176
+MAV_CMD_COMPONENT_ARM_DISARM = 400
+MAV_MODE_FLAG_CUSTOM_MODE_ENABLED = 1
+MAV_MODE_FLAG_SAFETY_ARMED = 128
+MAV_PARAM_TYPE_INT32 = 6
+MAV_PARAM_TYPE_REAL32 = 9
+
+## @brief PX4的主模式/子模式与mavros模式名的对应
+PX4_MODES = {
+    (1, 0): "MANUAL", (2, 0): "ALTCTL", (3, 0): "POSCTL", (5, 0): "ACRO", (6, 0): "OFFBOARD",
+    (7, 0): "STABILIZED", (8, 0): "RATTITUDE", (4, 1): "AUTO.READY", (4, 2): "AUTO.TAKEOFF",
+    (4, 3): "AUTO.LOITER", (4, 4): "AUTO.MISSION", (4, 5): "AUTO.RTL", (4, 6): "AUTO.LAND",
+    (4, 8): "AUTO.FOLLOW_TARGET", (4, 9): "AUTO.PRECLAND",
+}
+PX4_MAIN_MODE_AUTO = 4
+PX4_MAIN_MODE_OFFBOARD = 6
+PX4_SUB_MODE_AUTO_LAND = 6
+
+# 直连后端自己发出的其余消息（参数设置、长命令、心跳）
+_COMMAND_LONG = MavFast.COMMAND_LONG
+_PARAM_SET = (23, 168, "<fBB16sB")
+_HEARTBEAT = MavFast.HEARTBEAT
+
+## @brief 四元数(w, x, y, z)，可直接传给q2Euler
+Quat = collections.namedtuple("Quat", "w x y z")
+
+
+def _qmul(a, b):
+    return Quat(
+        a.w * b.w - a.x * b.x - a.y * b.y - a.z * b.z,
+        a.w * b.x + a.x * b.w + a.y * b.z - a.z * b.y,
+        a.w * b.y - a.x * b.z + a.y * b.w + a.z * b.x,
+        a.w * b.z + a.x * b.y - a.y * b.x + a.z * b.w,
+    )
+
+
+def _qrpy(roll, pitch, yaw):
+    # 与mavros ftf::quaternion_from_rpy相同：Rz(yaw)*Ry(pitch)*Rx(roll)
+    qx = Quat(math.cos(roll / 2), math.sin(roll / 2), 0.0, 0.0)
+    qy = Quat(math.cos(pitch / 2), 0.0, math.sin(pitch / 2), 0.0)
+    qz = Quat(math.cos(yaw / 2), 0.0, 0.0, math.sin(yaw / 2))
+    return _qmul(_qmul(qz, qy), qx)
+
+
+## @brief mavros的NED↔ENU静态旋转
+NED_ENU_Q = _qrpy(math.pi, 0.0, math.pi / 2)
+## @brief mavros的aircraft(FRD)↔base_link(FLU)静态旋转
+AIRCRAFT_BASELINK_Q = _qrpy(math.pi, 0.0, 0.0)
+
+
+## @brief 按mavros setpoint_raw/local的规则把ENU（或base_link）设定点换算为MAVLink的NED（或FRD）
+# @return (x, y, z, vx, vy, vz, afx, afy, afz, yaw, yaw_rate)
+def mavrosLocalToNed(frame, pos, vel, acc, yaw, yawRate):
+    if frame == MAV_FRAME_BODY_NED:
+        # base_link→aircraft：(x, -y, -z)，偏航取反
+        conv = lambda v: (v[0], -v[1], -v[2])
+        yawNed = -yaw
+    else:
+        # ENU→NED：(y, x, -z)，偏航 pi/2 - yaw 并回绕到[-pi, pi]
+        conv = lambda v: (v[1], v[0], -v[2])
+        yawNed = math.atan2(math.sin(math.pi / 2 - yaw), math.cos(math.pi / 2 - yaw))
+    return conv(pos) + conv(vel) + conv(acc) + (yawNed, -yawRate)
+
+
+## @brief 直连MAVLink的无人机通信实例
+class PX4MavDirect(VehicleState.OffboardReport, VehicleState.CtrlHelpers):
+    ## @brief 构造函数，参数含义与PX4MavCtrler相同；构造后立即开始接收
+    # @param CopterID 无人机ID，默认为：1。
+    # @param ip CopterSim所在电脑的IP，默认为：127.0.0.1。
+    # @param Com "udp"或串口名（如"/dev/ttyUSB0"、"COM3"，可写成"COM3:921600"）
+    # @param port UDP模式下大于0时强制使用该端口；串口模式下为波特率，0表示57600
+    # @param offboardHz Offboard设定点保活频率
+    # @param offboardMaxHz Offboard设定点最高发布频率
+    # @param stateStore 共用的状态存储，默认为None；非None时每条位姿/速度消息还会调用其putPose/putVel(CopterID, 快照)。
+    def __init__(self, CopterID=1, ip="127.0.0.1", Com="udp", port=0,
+                 offboardHz=OFFBOARD_HZ, offboardMaxHz=OFFBOARD_MAX_HZ, stateStore=None):
+        self.ip = ip
+        self.Com = Com
+        self.CopterID = CopterID
+        self.port = 20100 + self.CopterID * 2 - 2
+        self.isCom = Com[0:3].lower() == "com" or Com[0:3] == "/de"
+        self.baud = 57600
+        self.ComName = Com
+        if self.isCom:
+            strlist = Com.split(":")
+            if port > 0:
+                self.baud = int(port)
+            if len(strlist) >= 2 and strlist[1].isdigit():
+                self.baud = int(strlist[1])
+            self.ComName = strlist[0]
+        elif CopterID > 10000:
+            # 兼容旧版协议，如果ID是20100等端口输入，则自动计算CopterID
+            self.port = CopterID
+            self.CopterID = int((CopterID - 20100) / 2) + 1
+        elif port > 0:
+            self.port = port
+        ## @var PX4MavDirect.tgtSys
+        # 飞控的系统ID，UDP模式默认等于CopterID，收到飞控心跳后以心跳为准
+        self.tgtSys = self.CopterID
+        self.tgtComp = 1
+
+        self.mavros_state = None
+        self.armed = False
+        self.arm_state = False
+        self.offboard_state = False
+        self.isInOffboard = False
+        self.stateStore = stateStore
+        self.offboardHz = offboardHz
+        self.offboardMaxHz = offboardMaxHz
+        self.offPubInterval = TickScheduler.TickHistogram(bin_s=100e-6, max_s=1.0)
+        self.offPubLatency = TickScheduler.TickHistogram()
+        self.offStats = {"cmds": 0, "published": 0, "onChange": 0, "keepalive": 0, "coalesced": 0}
+        ## @var PX4MavDirect.offCmd
+        # 当前设定点：(coordinate_frame, type_mask, x, y, z, vx, vy, vz, afx, afy, afz, yaw, yaw_rate)，已换算为MAVLink坐标，
+        # 整体替换，发布线程不会读到只改了一半的设定点
+        self.offCmd = (MAV_FRAME_LOCAL_NED, self.calcTypeMask([0, 1, 0, 0, 0, 1])) + (0.0,) * 11
+        self._offSlot = (self.offCmd, 0, time.monotonic())
+        self._offEvent = threading.Event()
+        self._offLastSeq = -1
+        self._offLastPub = None
+        self.t2 = None
+
+        self.poseState = PoseState(0, 0.0, -math.inf, (0, 0, 0), (0, 0, 0), (0, 0, 0, 0))
+        self.velState = VelState(0, 0.0, -math.inf, (0, 0, 0), (0, 0, 0))
+        self.poseRing = StateRing.StateRing(
+            ("stamp", "n", "e", "d", "roll", "pitch", "yaw", "qw", "qx", "qy", "qz"),
+            STATE_RING_LEN,
+            angles=("roll", "pitch", "yaw"),
+        )
+        self.velRing = StateRing.StateRing(("stamp", "vn", "ve", "vd", "p", "q", "r"), STATE_RING_LEN)
+        self.imuRing = StateRing.StateRing(("stamp", "ax", "ay", "az", "gx", "gy", "gz"), STATE_RING_LEN)
+        self.gpsRing = StateRing.StateRing(("stamp", "lat", "lon", "alt", "n", "e", "d"), STATE_RING_LEN)
+        self.uavAngEular = [0, 0, 0]
+        self.uavAngRate = [0, 0, 0]
+        self.uavPosNED = [0, 0, 0]
+        self.uavVelNED = [0, 0, 0]
+        self.uavAngQuatern = [0, 0, 0, 0]
+        self.uavGlobalPos = [0, 0, 0]
+        self.trueGpsUeCenter = [40.1540302, 116.2593683, 50]
+        self.geo = EarthModel.EarthModel()
+        self.gpsFrame = EarthModel.LocalFrame(self.trueGpsUeCenter, self.geo)
+        self.gps = None
+        self._attEnu = Quat(1.0, 0.0, 0.0, 0.0)
+        self._rateEnu = (0.0, 0.0, 0.0)
+        self._t0 = time.monotonic()
+
+        ## @var PX4MavDirect.parser
+        # 接收解析器，frames/skipped/crcErrors为解析统计
+        self.parser = MavFast.MavParser([MavFast.HEARTBEAT, MavFast.LOCAL_POSITION_NED,
+                                         MavFast.ATTITUDE_QUATERNION, MavFast.GLOBAL_POSITION_INT])
+        self.spPacker = MavFast.SetPositionTargetLocalNed(255, 1)
+        self.hilPacker = MavFast.HilActuatorControls(255, 1)
+        self._cmdPacker = MavFast.MsgPacker(*_COMMAND_LONG)
+        self._paramPacker = MavFast.MsgPacker(*_PARAM_SET)
+        self._hbPacker = MavFast.MsgPacker(*_HEARTBEAT)
+        self._txSeq = 0
+        self._txLock = threading.Lock()
+        self._handlers = {
+            MavFast.HEARTBEAT[0]: self._onHeartbeat,
+            MavFast.LOCAL_POSITION_NED[0]: self._onLocalPosition,
+            MavFast.ATTITUDE_QUATERNION[0]: self._onAttitude,
+            MavFast.GLOBAL_POSITION_INT[0]: self._onGlobalPosition,
+        }
+        self._gotHeartbeat = threading.Event()
+        ## @var PX4MavDirect.handlerErrors
+        # 处理收到的消息时出错的次数（第1次及之后每100次打印异常）
+        self.handlerErrors = 0
+
+        if self.isCom:
+            import serial
+            self._serial = serial.Serial(self.ComName, self.baud, timeout=RECV_TIMEOUT_S)
+            self._sock = None
+        else:
+            self._serial = None
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._sock.bind(("0.0.0.0", self.port + 1))
+            self._sock.settimeout(RECV_TIMEOUT_S)
+        self._running = True
+        ## @var PX4MavDirect.t1
+        # 接收线程
+        self.t1 = threading.Thread(target=self._recvLoop, args=(), daemon=True)
+        self.t1.start()
+        print("Px4 Direct Controller Initialized!")
+
+    def _write(self, packer, *values):
+        # 所有消息共用一个发送序号，飞控据此统计丢包
+        with self._txLock:
+            packer.seq = self._txSeq
+            packer.pack(*values)
+            self._txSeq = packer.seq
+            frame = packer.frame()
+            if self._sock is not None:
+                self._sock.sendto(frame, (self.ip, self.port))
+            else:
+                self._serial.write(frame)
+
+    def _timeBootMs(self):
+        return int((time.monotonic() - self._t0) * 1000) & 0xFFFFFFFF
+
+    def _recvLoop(self):
+        nextHb = 0.0
+        while self._running:
+            now = time.monotonic()
+            if now >= nextHb:
+                # 与mavros相同：MAV_TYPE_ONBOARD_CONTROLLER, MAV_AUTOPILOT_INVALID, MAV_STATE_ACTIVE
+                try:
+                    self._write(self._hbPacker, 0, 18, 8, 0, 4, 3)
+                except OSError:
+                    pass
+                nextHb = now + HEARTBEAT_S
+            try:
+                if self._sock is not None:
+                    data = self._sock.recv(65536)
+                else:
+                    data = self._serial.read(max(1, self._serial.in_waiting))
+            except socket.timeout:
+                continue
+            except (OSError, ValueError):
+                if not self._running:
+                    break
+                continue
+            if not data:
+                continue
+            for msgid, sysid, compid, values in self.parser.feed(data):
+                try:
+                    self._handlers[msgid](sysid, compid, values)
+                except Exception:
+                    # 与mavros回调出错时一样：记录后继续处理下一条消息，接收线程不能退出
+                    self.handlerErrors += 1
+                    if self.handlerErrors == 1 or self.handlerErrors % 100 == 0:
+                        print(f"[PX4MavDirect] msg {msgid} handler error #{self.handlerErrors}:\n"
+                              f"{traceback.format_exc()}", end="")
+
+    def _onHeartbeat(self, sysid, compid, values):
+        custom, mavType, autopilot, baseMode = values[0], values[1], values[2], values[3]
+        if autopilot == 8: # MAV_AUTOPILOT_INVALID：地面站、机载电脑等，不是飞控
+            return
+        self.tgtSys = sysid
+        self.tgtComp = compid
+        self.armed = bool(baseMode & MAV_MODE_FLAG_SAFETY_ARMED)
+        mainMode = (custom >> 16) & 0xFF
+        subMode = (custom >> 24) & 0xFF
+        self.mavros_state = PX4_MODES.get((mainMode, subMode if mainMode == PX4_MAIN_MODE_AUTO else 0),
+                                          "CMODE(%d)" % custom)
+        self._gotHeartbeat.set()
+
+    def _onAttitude(self, sysid, compid, values):
+        # mavros imu插件：ENU/base_link姿态 = NED_ENU_Q * q_ned_frd * AIRCRAFT_BASELINK_Q，角速度转到base_link
+        self._attEnu = _qmul(_qmul(NED_ENU_Q, Quat(values[1], values[2], values[3], values[4])), AIRCRAFT_BASELINK_Q)
+        self._rateEnu = (values[5], -values[6], -values[7])
+
+    def _onLocalPosition(self, sysid, compid, values):
+        # mavros local_position插件每收到一条LOCAL_POSITION_NED发布一次pose和velocity_local，姿态取最近一次
+        recvTime = time.monotonic()
+        stamp = values[0] * 1e-3
+        x, y, z, vx, vy, vz = values[1:7]
+        p = (y, x, -z)  # ENU位置
+        v = (vy, vx, -vz)  # ENU速度
+        q = self._attEnu
+        w = self._rateEnu
+        ang = self.q2Euler(q)
+        # 以下与PX4MavCtrler.local_pose_callback / local_vel_callback相同
+        pose = PoseState(
+            self.poseState.seq + 1,
+            stamp,
+            recvTime,
+            (p[1], p[0], -p[2]),
+            (ang[1], ang[0], self.yawSat(-ang[2] + math.pi / 2)),
+            (q.w, q.x, q.y, q.z),
+        )
+        vel = VelState(
+            self.velState.seq + 1,
+            stamp,
+            recvTime,
+            (v[1], v[0], -v[2]),
+            (w[1], w[0], -w[2]),
+        )
+        self.poseState = pose
+        self.velState = vel
+        self.poseRing.append(recvTime, (pose.stamp,) + pose.posNED + pose.angEular + pose.angQuatern)
+        self.velRing.append(recvTime, (vel.stamp,) + vel.velNED + vel.angRate)
+        self.uavAngQuatern = list(pose.angQuatern)
+        self.uavAngEular = list(pose.angEular)
+        self.uavPosNED = list(pose.posNED)
+        self.uavVelNED = list(vel.velNED)
+        self.uavAngRate = list(vel.angRate)
+        if self.stateStore is not None:
+            self.stateStore.putPose(self.CopterID, pose)
+            self.stateStore.putVel(self.CopterID, vel)
+
+    def _onGlobalPosition(self, sysid, compid, values):
+        recvTime = time.monotonic()
+        LLA = [values[1] * 1e-7, values[2] * 1e-7, values[3] * 1e-3]
+        self.gps = LLA
+        self.uavGlobalPos = self.gpsFrame.lla2ned(LLA)
+        self.gpsRing.append(recvTime, [values[0] * 1e-3] + LLA + self.uavGlobalPos)
+
+    ## @brief 设置GPS原点
+    # @param LonLatAlt GPS的经度、纬度和高度
+    def setGPSOriLLA(self, LonLatAlt=[40.1540302, 116.2593683, 50]):
+        self.trueGpsUeCenter = LonLatAlt
+        self.gpsFrame = EarthModel.LocalFrame(LonLatAlt, self.geo)
+
+    ## @brief 等待飞控心跳（直连模式不需要启动mavros）
+    # @param timeout 超时（秒）
+    # @return 是否收到心跳
+    def InitMavLoop(self, timeout=10.0):
+        ok = self._gotHeartbeat.wait(timeout)
+        print("PX4 heartbeat, sysid %d" % self.tgtSys if ok else "No heartbeat from PX4")
+        return ok
+
+    ## @brief 初始化Offboard模式
+    def initOffboard(self):
+        self.prepareOffboard()
+        self.t2 = threading.Thread(target=self.OffboardLoop, args=())
+        self.t2.start()
+        # 等待offboard消息发一阵，让PX4认为通信健康
+        time.sleep(1)
+        self.engageOffboard()
+
+    ## @brief Offboard准备：发出零速设定点并设置失联保护参数，之后需要有线程持续发布设定点
+    def prepareOffboard(self):
+        self.isInOffboard = True
+        print("Offboard Started.")
+        self.SendVelNED(0, 0, 0, 0)
+        self.sendMavSetParam("NAV_RCL_ACT", 0, "INT")
+        self.sendMavSetParam("NAV_DLL_ACT", 0, "INT")
+        self.sendMavSetParam("COM_RCL_EXCEPT", 4, "INT")
+
+    ## @brief 切换到Offboard模式并解锁，调用前设定点应已持续发布约1秒
+    def engageOffboard(self):
+        self.offboard_state = self.offboard()
+        time.sleep(0.2)
+        self.arm_state = self.arm()
+
+    ## @brief Offboard发布循环，策略与PX4MavCtrler.OffboardLoop相同
+    def OffboardLoop(self):
+        keepalive = 1.0 / self.offboardHz
+        minGap = 1.0 / self.offboardMaxHz if self.offboardMaxHz > 0 else 0.0
+        while self.isInOffboard and self._running:
+            lastPub = self._offLastPub
+            if lastPub is not None:
+                self._offEvent.wait(max(0.0, lastPub + keepalive - time.monotonic()))
+                gap = lastPub + minGap - time.monotonic()
+                if gap > 0:
+                    time.sleep(gap)
+            self.publishOffboard()
+        print("Offboard Stoped.")
+
+    ## @brief 发出当前设定点并记录统计
+    def publishOffboard(self):
+        self._offEvent.clear()
+        cmd, seq, t_set = self._offSlot
+        frame, mask = cmd[0], cmd[1]
+        self._write(self.spPacker, self._timeBootMs(), self.tgtSys, self.tgtComp, frame, mask, *cmd[2:])
+
+        now = time.monotonic()
+        if self._offLastPub is not None:
+            self.offPubInterval.record(now - self._offLastPub)
+        self._offLastPub = now
+        self.offStats["published"] += 1
+        if seq != self._offLastSeq:
+            self.offStats["onChange"] += 1
+            self.offPubLatency.record(now - t_set)
+            self._offLastSeq = seq
+        else:
+            self.offStats["keepalive"] += 1
+
+    ## @brief 有新设定点或到了保活时刻时发布，供统一发布线程每拍调用
+    #  @param now 当前time.monotonic()
+    #  @return 是否发布
+    def pollOffboard(self, now):
+        if self._offSlot[1] == self._offLastSeq and self._offLastPub is not None \
+                and now - self._offLastPub < 1.0 / self.offboardHz:
+            return False
+        self.publishOffboard()
+        return True
+
+    def _swapOffCmd(self, frame, typeMask, pos, vel=(0.0, 0.0, 0.0), acc=(0.0, 0.0, 0.0), yaw=0.0, yawRate=0.0):
+        # pos/vel/acc/yaw/yawRate为PX4MavCtrler写入PositionTarget的ENU值，这里按mavros换算后整体替换
+        cmd = (frame, typeMask) + mavrosLocalToNed(frame, pos, vel, acc, yaw, yawRate)
+        seq = self._offSlot[1] + 1
+        if self.isInOffboard and self._offEvent.is_set():
+            self.offStats["coalesced"] += 1
+        self.offCmd = cmd
+        self._offSlot = (cmd, seq, time.monotonic())
+        self.offStats["cmds"] += 1
+        self._offEvent.set()
+
+    ## @brief 结束Offboard模式并关闭链路
+    def endOffboard(self):
+        self.isInOffboard = False
+        self._offEvent.set()
+        if self.t2 is not None:
+            self.t2.join()
+        self.stopRun()
+
+    ## @brief 停止接收线程并关闭socket/串口
+    def stopRun(self):
+        if not self._running:
+            return
+        self._running = False
+        self.t1.join()
+        if self._sock is not None:
+            self._sock.close()
+        else:
+            self._serial.close()
+
+    ## @brief 发送北东地坐标系下的速度指令，坐标约定与PX4MavCtrler相同
+    def SendVelNED(self, vx=math.nan, vy=math.nan, vz=math.nan, yawrate=math.nan):
+        self._swapOffCmd(MAV_FRAME_LOCAL_NED, self.calcTypeMask([0, 1, 0, 0, 0, 1]),
+                         (0.0, 0.0, 0.0), (float(vx), float(-vy), float(-vz)), yawRate=float(-yawrate))
+
+    ## @brief 发送机体坐标系下的速度指令，坐标约定与PX4MavCtrler相同
+    def SendVelFRD(self, vx=math.nan, vy=math.nan, vz=math.nan, yawrate=math.nan):
+        self._swapOffCmd(MAV_FRAME_BODY_NED, self.calcTypeMask([0, 1, 0, 0, 0, 1]),
+                         (0.0, 0.0, 0.0), (float(vx), float(-vy), float(-vz)), yawRate=float(-yawrate))
+
+    ## @brief 发送北东地坐标系下的位置指令，坐标约定与PX4MavCtrler相同
+    def SendPosNED(self, x=math.nan, y=math.nan, z=math.nan, yaw=math.nan):
+        self._swapOffCmd(MAV_FRAME_LOCAL_NED, self.calcTypeMask([1, 0, 0, 0, 1, 0]),
+                         (float(x), float(-y), float(-z)), yaw=float(-yaw + math.pi / 2))
+
+    ## @brief 发送北东地坐标系下的位置、速度指令，坐标约定与PX4MavCtrler相同
+    def SendPosVelNED(self, PosE=[math.nan] * 3, VelE=[math.nan] * 3, yaw=math.nan, yawrate=math.nan):
+        PosE = self.fillList(PosE, 3, math.nan)
+        VelE = self.fillList(VelE, 3, math.nan)
+        self._swapOffCmd(MAV_FRAME_LOCAL_NED, self.calcTypeMask([1, 1, 0, 0, 1, 1]),
+                         (float(PosE[0]), float(-PosE[1]), float(-PosE[2])),
+                         (float(VelE[0]), float(-VelE[1]), float(-VelE[2])),
+                         yaw=float(-yaw + math.pi / 2), yawRate=float(-yawrate))
+
+    ## @brief 发送北东地坐标系下的位置、速度、加速度指令，坐标约定与PX4MavCtrler相同
+    def SendPosVelAccNED(self, PosE=[math.nan] * 3, VelE=[math.nan] * 3, AccE=[math.nan] * 3,
+                         yaw=math.nan, yawrate=math.nan):
+        PosE = self.fillList(PosE, 3, math.nan)
+        VelE = self.fillList(VelE, 3, math.nan)
+        AccE = self.fillList(AccE, 3, math.nan)
+        self._swapOffCmd(MAV_FRAME_LOCAL_NED, self.calcTypeMask([1, 1, 1, 0, 1, 1]),
+                         (float(PosE[0]), float(-PosE[1]), float(-PosE[2])),
+                         (float(VelE[0]), float(-VelE[1]), float(-VelE[2])),
+                         (float(AccE[0]), float(-AccE[1]), float(-AccE[2])),
+                         yaw=float(-yaw + math.pi / 2), yawRate=float(-yawrate))
+
+    ## @brief 发送MAVLink长格式命令
+    def SendMavCmdLong(self, command, param1=0, param2=0, param3=0, param4=0, param5=0, param6=0, param7=0):
+        self._write(self._cmdPacker, param1, param2, param3, param4, param5, param6, param7,
+                    command, self.tgtSys, self.tgtComp, 0)
+
+    ## @brief 发送解锁/上锁指令
+    def SendMavArm(self, isArm=1):
+        if isArm:
+            self.arm()
+        else:
+            self.disarm()
+
+    ## @brief 解锁。与经mavros的ROS2异步服务一样，发出命令即返回，不等待COMMAND_ACK
+    def arm(self):
+        self.SendMavCmdLong(MAV_CMD_COMPONENT_ARM_DISARM, 1)
+        return True
+
+    ## @brief 上锁
+    def disarm(self):
+        self.SendMavCmdLong(MAV_CMD_COMPONENT_ARM_DISARM, 0)
+        return True
+
+    ## @brief 切换到Offboard模式
+    def offboard(self):
+        self.SendMavCmdLong(MAV_CMD_DO_SET_MODE, MAV_MODE_FLAG_CUSTOM_MODE_ENABLED, PX4_MAIN_MODE_OFFBOARD)
+        return True
+
+    ## @brief 切换到自动降落模式
+    def land(self):
+        self.SendMavCmdLong(MAV_CMD_DO_SET_MODE, MAV_MODE_FLAG_CUSTOM_MODE_ENABLED, PX4_MAIN_MODE_AUTO,
+                            PX4_SUB_MODE_AUTO_LAND)
+        return True
+
+    ## @brief 设置飞控参数；整型参数按mavros/PX4的约定把int32的字节放进float字段
+    def sendMavSetParam(self, param_id_str, param_value, param_type):
+        if param_type == "INT":
+            value = struct.unpack("<f", struct.pack("<i", int(param_value)))[0]
+            ptype = MAV_PARAM_TYPE_INT32
+        else:
+            value = float(param_value)
+            ptype = MAV_PARAM_TYPE_REAL32
+        self._write(self._paramPacker, value, self.tgtSys, self.tgtComp, param_id_str.encode(), ptype)
+
+    ## @brief 发送hil_actuator_controls消息（rfly_ctrl、rfly_ctrl1、rfly_ctrl2），参数含义与PX4MavCtrler相同
+    def SendHILCtrlMsg(self, ctrls=[0] * 16, idx=0):
+        mode = 1
+        if 0.5 <= idx < 1.5:
+            mode = 101
+        elif 1.5 <= idx < 2.5:
+            mode = 201
+        self._write(self.hilPacker, int(time.time() * 1000), self.fillList(ctrls, 16, float(0)), mode, 1)
+
+
+## @brief 模拟PX4的本地MAVLink端点，用于没有CopterSim时测试直连后端
+#
+#  在port上收设定点和命令（用pymavlink解码，与直连后端的打包互相独立），以一阶响应跟踪位置/速度设定点，
+#  按hz发回LOCAL_POSITION_NED、ATTITUDE_QUATERNION、GLOBAL_POSITION_INT，每秒一次HEARTBEAT。
+class FakePX4:
+    ## @brief 构造函数
+    # @param CopterID 模拟的飞机ID，端口规则与PX4MavDirect相同
+    # @param ip 直连后端所在的IP
+    # @param hz 状态发送频率
+    # @param tau 位置跟踪的时间常数（秒）
+    def __init__(self, CopterID=1, ip="127.0.0.1", hz=50.0, tau=0.3):
+        from pymavlink.dialects.v20 import common as mavlink2
+        self.port = 20100 + CopterID * 2 - 2
+        self.peer = (ip, self.port + 1)
+        self.hz = hz
+        self.tau = tau
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("0.0.0.0", self.port))
+        self.sock.setblocking(False)
+        self.mav = mavlink2.MAVLink(None, CopterID, 1)
+        self.pos = [0.0, 0.0, 0.0]
+        self.vel = [0.0, 0.0, 0.0]
+        self.yaw = 0.0
+        self.armed = False
+        self.mode = (3, 0) # POSCTL
+        self.params = {}
+        ## @var FakePX4.setpoints
+        # 收到的设定点数
+        self.setpoints = 0
+        ## @var FakePX4.lastSetpoint
+        # 最近一个设定点(收到时刻time.monotonic(), pymavlink消息)
+        self.lastSetpoint = None
+        self.home = EarthModel.LocalFrame([40.1540302, 116.2593683, 50], EarthModel.EarthModel())
+        self.running = False
+
+    def _recv(self):
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                return
+            for msg in self.mav.parse_buffer(data) or []:
+                kind = msg.get_type()
+                if kind == "SET_POSITION_TARGET_LOCAL_NED":
+                    self.setpoints += 1
+                    self.lastSetpoint = (time.monotonic(), msg)
+                elif kind == "COMMAND_LONG":
+                    if msg.command == MAV_CMD_COMPONENT_ARM_DISARM:
+                        self.armed = msg.param1 > 0.5
+                    elif msg.command == MAV_CMD_DO_SET_MODE:
+                        self.mode = (int(msg.param2), int(msg.param3) if int(msg.param2) == PX4_MAIN_MODE_AUTO else 0)
+                elif kind == "PARAM_SET":
+                    self.params[msg.param_id] = msg.param_value
+
+    def _step(self, dt):
+        sp = self.lastSetpoint[1] if self.lastSetpoint else None
+        target = list(self.pos)
+        if self.armed and self.mode == (PX4_MAIN_MODE_OFFBOARD, 0) and sp is not None:
+            if not sp.type_mask & 7:
+                target = [sp.x, sp.y, sp.z]
+            elif not sp.type_mask & (7 << 3):
+                target = [p + v * self.tau for p, v in zip(self.pos, (sp.vx, sp.vy, sp.vz))]
+            if not sp.type_mask & (1 << 10) and not math.isnan(sp.yaw):
+                self.yaw += (sp.yaw - self.yaw) * min(1.0, dt / self.tau)
+        elif self.armed and self.mode == (PX4_MAIN_MODE_AUTO, PX4_SUB_MODE_AUTO_LAND):
+            target = [self.pos[0], self.pos[1], 0.0]
+            if self.pos[2] > -0.05:
+                self.armed = False
+        k = min(1.0, dt / self.tau)
+        new = [p + (t - p) * k for p, t in zip(self.pos, target)]
+        self.vel = [(n - p) / dt for n, p in zip(new, self.pos)]
+        self.pos = new
+
+    ## @brief 运行
+    # @param duration 运行时长（秒），None表示直到stop()
+    def run(self, duration=None):
+        self.running = True
+        sched = TickScheduler.TickScheduler(1.0 / self.hz)
+        t0 = time.monotonic()
+        nextHb = 0.0
+        for k in sched.run(duration):
+            if not self.running:
+                break
+            self._recv()
+            self._step(1.0 / self.hz)
+            now = time.monotonic()
+            tb = int((now - t0) * 1000)
+            out = [
+                self.mav.local_position_ned_encode(tb, *self.pos, *self.vel),
+                self.mav.attitude_quaternion_encode(tb, math.cos(self.yaw / 2), 0.0, 0.0, math.sin(self.yaw / 2),
+                                                    0.0, 0.0, 0.0),
+            ]
+            lla = self.home.ned2lla(self.pos)
+            out.append(self.mav.global_position_int_encode(tb, int(lla[0] * 1e7), int(lla[1] * 1e7),
+                                                           int(lla[2] * 1e3), int(-self.pos[2] * 1e3), 0, 0, 0, 0))
+            if now >= nextHb:
+                base = MAV_MODE_FLAG_CUSTOM_MODE_ENABLED | (MAV_MODE_FLAG_SAFETY_ARMED if self.armed else 0)
+                custom = self.mode[0] << 16 | self.mode[1] << 24
+                out.append(self.mav.heartbeat_encode(2, 12, base, custom, 4)) # QUADROTOR, PX4, ACTIVE
+                nextHb = now + HEARTBEAT_S
+            try:
+                self.sock.sendto(b"".join(msg.pack(self.mav) for msg in out), self.peer)
+            except OSError:
+                pass
+        self.running = False
+
+    ## @brief 停止运行并关闭socket
+    def stop(self):
+        self.running = False
+
+
+def _selftest(args):
+    fake = FakePX4(args.id)
+    tf = threading.Thread(target=fake.run, args=(), daemon=True)
+    tf.start()
+    mav = PX4MavDirect(args.id)
+    assert mav.InitMavLoop(5.0), "no heartbeat"
+    mav.initOffboard()
+
+    # 与mavros_plot8.SendRealPosNED相同的写法：期望NED (n, e, d)
+    n, e, d, yaw = 2.0, 1.0, -1.5, 0.3
+    t_send = time.monotonic()
+    mav.SendPosNED(e, -n, d, yaw)
+    while fake.lastSetpoint is None or fake.lastSetpoint[1].x != n:
+        time.sleep(0.0005)
+    print(f"setpoint -> fake PX4: {(fake.lastSetpoint[0] - t_send) * 1e3:.2f} ms, "
+          f"NED target=({fake.lastSetpoint[1].x:.2f}, {fake.lastSetpoint[1].y:.2f}, {fake.lastSetpoint[1].z:.2f}) "
+          f"yaw={fake.lastSetpoint[1].yaw:.3f}")
+    time.sleep(3.0)
+    print("mode:", mav.mavros_state, "armed:", mav.armed, "params:", sorted(fake.params))
+    print("uavPosNED:", [round(v, 3) for v in mav.uavPosNED], "uavAngEular:", [round(v, 3) for v in mav.uavAngEular])
+    assert all(abs(a - b) < 0.05 for a, b in zip(mav.uavPosNED, (n, e, d))), mav.uavPosNED
+    assert abs(mav.uavAngEular[2] - yaw) < 0.05, mav.uavAngEular
+    mav.land()
+    time.sleep(2.0)
+    print("mode:", mav.mavros_state, "armed:", mav.armed, "pos:", [round(v, 3) for v in mav.uavPosNED])
+    print("[offboard]", mav.formatOffboardReport())
+    print(f"parser: frames={mav.parser.frames} skipped={mav.parser.skipped} crcErrors={mav.parser.crcErrors}, "
+          f"pose {mav.poseRing.total} records")
+    mav.endOffboard()
+    fake.stop()
+    tf.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="直连MAVLink后端：模拟端点与自检")
+    parser.add_argument("--id", type=int, default=1, help="CopterID")
+    parser.add_argument("--fake", action="store_true", help="只运行模拟PX4端点，直到Ctrl+C")
+    parser.add_argument("--selftest", action="store_true", help="模拟端点 + 直连后端自检")
+    args = parser.parse_args()
+    if args.fake:
+        fake = FakePX4(args.id)
+        print(f"fake PX4 on udp {fake.port} -> {fake.peer[0]}:{fake.peer[1]}")
+        try:
+            fake.run()
+        except KeyboardInterrupt:
+            pass
+    else:
+        _selftest(args)
+
+
+if __name__ == "__main__":
+    main()
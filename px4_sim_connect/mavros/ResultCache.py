@@ -0,0 +1,122 @@
+import os
+import json
+import hashlib
+
+## @file
+#  @brief 分析结果的持久化缓存
+#  @anchor ResultCache接口库文件
+#
+#  缓存键由输入日志的内容哈希和统计参数（par、ROUND_N 等）共同决定：
+#  日志内容一变，键随之改变，旧结果自然失效；旧条目按最近使用时间（LRU）淘汰，
+#  缓存目录总大小不超过 max_bytes。
+#  文件哈希按 (路径, 大小, 修改时间) 记忆在 files.json 中，未改动的日志不会被重复读取。
+
+## @brief 缓存格式版本，统计口径变化时递增使旧缓存全部失效
+CACHE_VERSION = 1
+## @brief 默认缓存目录
+DEFAULT_DIR = ".result_cache"
+
+
+## @brief 基于内容哈希的结果缓存
+class ResultCache:
+    ## @brief 构造函数
+    # @param cache_dir 缓存目录
+    # @param max_bytes 缓存条目总大小上限（字节）
+    def __init__(self, cache_dir=DEFAULT_DIR, max_bytes=64 << 20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        ## @var ResultCache.hits
+        # 命中次数
+        self.hits = 0
+        ## @var ResultCache.misses
+        # 未命中次数
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index_path = os.path.join(cache_dir, "files.json")
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                self._files = json.load(f)
+        except (OSError, ValueError):
+            self._files = {}
+
+    ## @brief 计算文件内容的 sha256，大小和修改时间不变时直接复用记忆的结果
+    # @param path 文件路径
+    # @return 十六进制哈希串
+    def file_hash(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        memo = self._files.get(path)
+        if memo is not None and memo[0] == stamp:
+            return memo[1]
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        self._files[path] = [stamp, digest]
+        self._save_index()
+        return digest
+
+    ## @brief 由输入日志和参数生成缓存键
+    # @param paths 输入日志路径列表（顺序有意义）
+    # @param params 影响结果的参数
+    # @return 缓存键
+    def make_key(self, paths, **params):
+        desc = {
+            "version": CACHE_VERSION,
+            "files": [self.file_hash(p) for p in paths],
+            "params": params,
+        }
+        return hashlib.sha256(json.dumps(desc, sort_keys=True).encode("utf-8")).hexdigest()
+
+    ## @brief 读取缓存结果，命中时刷新其 LRU 时间
+    # @param key 缓存键
+    # @return 缓存的结果，未命中返回 None
+    def get(self, key):
+        path = self._entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    ## @brief 写入结果（先写临时文件再原子替换），并按 LRU 淘汰超出容量的条目
+    # @param key 缓存键
+    # @param value 可 JSON 序列化的结果
+    def put(self, key, value):
+        path = self._entry_path(key)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        self._evict()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def _save_index(self):
+        tmp = self._index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._files, f)
+        os.replace(tmp, self._index_path)
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json") or name == "files.json":
+                continue
+            st = os.stat(os.path.join(self.cache_dir, name))
+            entries.append((st.st_mtime_ns, st.st_size, name))
+            total += st.st_size
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
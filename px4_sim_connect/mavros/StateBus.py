@@ -0,0 +1,365 @@
+import os
+import sys
+import time
+import struct
+import argparse
+import threading
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+## @file
+#  @brief 共享内存状态总线：控制进程写入各机状态，本机任意多个进程免拷贝地轮询读取
+#  @anchor StateBus接口库文件
+#
+#  共享内存布局为定长头HEADER之后跟max_vehicles条定长记录RECORD（numpy结构化数组，小端）。
+#  每条记录一架飞机，以seqlock保护：写入前seq加1（变为奇数），写完再加1（变为偶数）；
+#  读者先读seq，为奇数说明正在写入，否则拷贝整条记录后再读一次seq，两次相同才说明读到的是一致的快照，不同则重试。
+#  写者从不等待读者，读者也不加锁，控制进程的开销只有每条消息几次numpy赋值，与读者数量无关。
+#
+#  StateBusWriter实现putPose/putVel，可直接作为PX4MavCtrler的stateStore传入。
+#  一个总线只能有一个写进程；进程内多个回调线程的写入由写者内部的锁串行化。
+#  recvTime/stamp使用time.monotonic()，Linux上各进程同一时钟，读者可直接算出数据的新旧。
+#  seqlock依赖写入顺序对读者可见，x86的存储顺序保证这一点。
+#  直接运行本文件可查看总线上各机的状态，加--bench则用多个读进程做一致性和速率自检。
+
+## @brief 默认的共享内存名
+BUS_NAME = "rfly_statebus"
+## @brief 默认的最大飞机数
+MAX_VEHICLES = 64
+## @brief 总线魔数
+MAGIC = b"RFSB"
+## @brief 布局版本，RECORD改变时加1
+VERSION = 1
+
+# 读者遇到正在写入的记录时让出CPU，单核上写者才能写完
+_yield = getattr(os, "sched_yield", lambda: time.sleep(0))
+
+## @brief 总线头：magic, version, max_vehicles, record_size，补齐到64字节
+HEADER = struct.Struct("<4sHHI")
+HEADER_SIZE = 64
+
+## @brief 每架飞机一条的状态记录
+RECORD = np.dtype([
+    ("seq", "<u8"),        # seqlock计数，奇数表示正在写入
+    ("copterID", "<i4"),   # 飞机ID，0表示空槽
+    ("flags", "<u4"),
+    ("poseSeq", "<u8"),    # 位姿消息计数
+    ("velSeq", "<u8"),     # 速度消息计数
+    ("poseStamp", "<f8"),  # 位姿消息头时间戳（秒）
+    ("poseTime", "<f8"),   # 位姿消息接收时刻time.monotonic()
+    ("velStamp", "<f8"),
+    ("velTime", "<f8"),
+    ("wallTime", "<f8"),   # 最近一次写入的time.time()
+    ("pos", "<f8", 3),     # NED位置
+    ("att", "<f8", 3),     # 欧拉角（弧度）
+    ("quat", "<f8", 4),    # 四元数
+    ("vel", "<f8", 3),     # NED速度
+    ("rate", "<f8", 3),    # 角速率
+], align=True)
+
+
+def _attach(name):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    # 3.13之前，附加到已有共享内存也会登记到resource_tracker，读进程退出时会把它删掉
+    if os.name == "posix":
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+    return shm
+
+
+def _layout(shm):
+    magic, version, n, size = HEADER.unpack_from(shm.buf, 0)
+    if magic != MAGIC or version != VERSION or size != RECORD.itemsize:
+        raise ValueError(f"incompatible state bus layout: {magic!r} v{version} record {size} bytes")
+    return n
+
+
+## @brief 状态总线写者（控制进程）
+class StateBusWriter:
+    ## @brief 构造函数
+    # @param name 共享内存名
+    # @param max_vehicles 最大飞机数；同名总线已存在且布局相同时直接复用，读者无需重新连接
+    def __init__(self, name=BUS_NAME, max_vehicles=MAX_VEHICLES):
+        self.name = name
+        reattach = False
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                                  size=HEADER_SIZE + max_vehicles * RECORD.itemsize)
+            self.shm.buf[:HEADER_SIZE + max_vehicles * RECORD.itemsize] = bytes(HEADER_SIZE + max_vehicles * RECORD.itemsize)
+            HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, max_vehicles, RECORD.itemsize)
+        except FileExistsError:
+            # 上次的控制进程没有正常退出
+            reattach = True
+            self.shm = shared_memory.SharedMemory(name=name)
+            if _layout(self.shm) != max_vehicles:
+                self.shm.close()
+                raise ValueError(f"state bus {name} exists with a different max_vehicles")
+        ## @var StateBusWriter.records
+        # 共享内存上的记录数组
+        self.records = np.ndarray((max_vehicles,), dtype=RECORD, buffer=self.shm.buf, offset=HEADER_SIZE)
+        self._seq = self.records["seq"]
+        if reattach:
+            self._reset()
+        self._lock = threading.Lock()
+        self._slot = {int(cid): i for i, cid in enumerate(self.records["copterID"]) if cid}
+        ## @var StateBusWriter.writes
+        # 累计写入次数
+        self.writes = 0
+
+    def _reset(self):
+        # 清掉上次运行留下的记录：上次的写者可能死在两次seq加1之间，seq停在奇数会让读者一直重试，
+        # 之后每次写入的奇偶也都反了；旧的copterID也会让读者看到上次运行的飞机。
+        # 先把seq置为奇数再清空其余字段，最后加1变为偶数，正在读的读者会发现seq变化而重读
+        seq = self._seq
+        seq |= 1
+        for field in RECORD.names:
+            if field != "seq":
+                self.records[field] = 0
+        seq += 1
+
+    def _slotOf(self, copterID):
+        i = self._slot.get(copterID)
+        if i is None:
+            free = np.flatnonzero(self.records["copterID"] == 0)
+            if not len(free):
+                raise ValueError(f"state bus {self.name} is full ({len(self.records)} vehicles)")
+            i = int(free[0])
+            self.records["copterID"][i] = copterID
+            self._slot[copterID] = i
+        return i
+
+    ## @brief 写入位姿快照（PX4MavCtrler的位姿回调调用）
+    # @param copterID 飞机ID（非0）
+    # @param state PoseState
+    def putPose(self, copterID, state):
+        r = self.records
+        with self._lock:
+            i = self._slotOf(copterID)
+            self._seq[i] += 1
+            r["poseSeq"][i] = state.seq
+            r["poseStamp"][i] = state.stamp
+            r["poseTime"][i] = state.recvTime
+            r["wallTime"][i] = time.time()
+            r["pos"][i] = state.posNED
+            r["att"][i] = state.angEular
+            r["quat"][i] = state.angQuatern
+            self._seq[i] += 1
+            self.writes += 1
+
+    ## @brief 写入速度快照（PX4MavCtrler的速度回调调用）
+    # @param copterID 飞机ID（非0）
+    # @param state VelState
+    def putVel(self, copterID, state):
+        r = self.records
+        with self._lock:
+            i = self._slotOf(copterID)
+            self._seq[i] += 1
+            r["velSeq"][i] = state.seq
+            r["velStamp"][i] = state.stamp
+            r["velTime"][i] = state.recvTime
+            r["wallTime"][i] = time.time()
+            r["vel"][i] = state.velNED
+            r["rate"][i] = state.angRate
+            self._seq[i] += 1
+            self.writes += 1
+
+    ## @brief 关闭总线
+    # @param unlink 是否删除共享内存；已附加的读者仍可读到最后的状态，直到它们关闭
+    def close(self, unlink=True):
+        self.records = None
+        self._seq = None
+        self.shm.close()
+        if unlink:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+## @brief 状态总线读者（分析、可视化、转发等进程）
+class StateBusReader:
+    ## @brief 构造函数
+    # @param name 共享内存名
+    # @param timeout 等待写者创建总线的时间（秒），None表示不等待
+    # @param readTimeout 一条记录持续处于写入状态超过该时间（秒）时read/readAll/poll抛出TimeoutError（写者死在写入中途）
+    def __init__(self, name=BUS_NAME, timeout=None, readTimeout=1.0):
+        self.readTimeout = readTimeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                self.shm = _attach(name)
+                break
+            except FileNotFoundError:
+                if deadline is None or time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        n = _layout(self.shm)
+        ## @var StateBusReader.records
+        # 共享内存上的记录数组（直接读取可能读到写了一半的记录，一致的快照请用read/readAll）
+        self.records = np.ndarray((n,), dtype=RECORD, buffer=self.shm.buf, offset=HEADER_SIZE)
+        self._seq = self.records["seq"]
+        ## @var StateBusReader.retries
+        # 因写者正在写入而重读的次数
+        self.retries = 0
+
+    ## @brief 总线上已有的飞机ID
+    def ids(self):
+        cids = self.records["copterID"]
+        return [int(c) for c in cids[cids != 0]]
+
+    def _index(self, copterID):
+        hit = np.flatnonzero(self.records["copterID"] == copterID)
+        if not len(hit):
+            raise KeyError(copterID)
+        return int(hit[0])
+
+    def _read(self, i, out, k=0):
+        seq = self._seq
+        deadline = None
+        while True:
+            s = int(seq[i])
+            if not s & 1:
+                out[k:k + 1] = self.records[i:i + 1]
+                if int(seq[i]) == s:
+                    return s
+            self.retries += 1
+            now = time.monotonic()
+            if deadline is None:
+                deadline = now + self.readTimeout
+            elif now > deadline:
+                raise TimeoutError(f"state bus record {i} stuck at seq {s}, writer died while writing?")
+            _yield()
+
+    ## @brief 一架飞机的一致快照
+    # @param copterID 飞机ID
+    # @return RECORD类型的标量拷贝，按字段名取值，如rec["pos"]
+    def read(self, copterID):
+        out = np.zeros(1, dtype=RECORD)
+        self._read(self._index(copterID), out)
+        return out[0]
+
+    ## @brief 全部飞机的快照（每条记录各自一致）
+    # @return RECORD结构化数组拷贝，只含非空槽
+    def readAll(self):
+        idx = np.flatnonzero(self.records["copterID"] != 0)
+        out = np.zeros(len(idx), dtype=RECORD)
+        for k, i in enumerate(idx.tolist()):
+            self._read(i, out, k)
+        return out
+
+    ## @brief 只取上次之后有更新的飞机
+    # @param last 字典 copterID -> 上次读到的seq，调用后原地更新
+    # @return 有更新的记录列表
+    def poll(self, last):
+        changed = []
+        seq = self._seq
+        for i in np.flatnonzero(self.records["copterID"] != 0).tolist():
+            s = int(seq[i])
+            cid = int(self.records["copterID"][i])
+            if last.get(cid) == s:
+                continue
+            out = np.zeros(1, dtype=RECORD)
+            last[cid] = self._read(i, out)
+            changed.append(out[0])
+        return changed
+
+    ## @brief 断开总线（不删除共享内存）
+    def close(self):
+        self.records = None
+        self._seq = None
+        self.shm.close()
+
+
+def _watch(args):
+    bus = StateBusReader(args.name, timeout=args.wait)
+    last = {}
+    prev = {}
+    period = 1.0 / args.hz
+    try:
+        while True:
+            now = time.monotonic()
+            for rec in bus.poll(last):
+                cid = int(rec["copterID"])
+                n0, t0 = prev.get(cid, (int(rec["poseSeq"]), now))
+                rate = (int(rec["poseSeq"]) - n0) / (now - t0) if now > t0 else 0.0
+                prev[cid] = (int(rec["poseSeq"]), now)
+                pos = rec["pos"]
+                print(f"[{cid}] pos=({pos[0]:.2f}, {pos[1]:.2f}, {pos[2]:.2f}) "
+                      f"yaw={np.degrees(rec['att'][2]):.1f} age={(now - rec['poseTime']) * 1e3:.1f} ms "
+                      f"pose {rate:.0f} Hz")
+            time.sleep(period)
+    except KeyboardInterrupt:
+        pass
+    print(f"retries={bus.retries}")
+    bus.close()
+
+
+def _bench_reader(name, seconds, result):
+    bus = StateBusReader(name, timeout=5.0)
+    reads = torn = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        for rec in bus.readAll():
+            reads += 1
+            # 写者令一条记录的所有字段等于同一个计数，读到不同值即为撕裂
+            k = rec["poseSeq"]
+            if not (np.all(rec["pos"] == k) and np.all(rec["att"] == k) and rec["poseStamp"] == k):
+                torn += 1
+    result.put((reads, torn, bus.retries))
+    bus.close()
+
+
+def _bench(args):
+    import multiprocessing
+    import types
+    name = args.name + "_bench"
+    bus = StateBusWriter(name, max_vehicles=args.vehicles)
+    result = multiprocessing.Queue()
+    readers = [multiprocessing.Process(target=_bench_reader, args=(name, args.seconds, result))
+               for _ in range(args.readers)]
+    for p in readers:
+        p.start()
+    writes = 0
+    end = time.monotonic() + args.seconds
+    t0 = time.perf_counter()
+    while time.monotonic() < end:
+        writes += 1
+        for cid in range(1, args.vehicles + 1):
+            bus.putPose(cid, types.SimpleNamespace(seq=writes, stamp=writes, recvTime=time.monotonic(),
+                                                   posNED=(writes,) * 3, angEular=(writes,) * 3,
+                                                   angQuatern=(1.0, 0.0, 0.0, 0.0)))
+    elapsed = time.perf_counter() - t0
+    stats = [result.get() for _ in readers]
+    for p in readers:
+        p.join()
+    # 子进程与本进程共用resource_tracker，读者附加时的注销也注销了写者的登记，这里补回
+    if os.name == "posix" and sys.version_info < (3, 13):
+        resource_tracker.register(bus.shm._name, "shared_memory")
+    bus.close()
+    print(f"writer: {bus.writes} records in {elapsed:.2f} s, {elapsed / max(bus.writes, 1) * 1e6:.2f} us/record")
+    for k, (reads, torn, retries) in enumerate(stats):
+        print(f"reader {k}: {reads} records, torn={torn}, retries={retries}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="共享内存状态总线")
+    parser.add_argument("--name", default=BUS_NAME, help="共享内存名")
+    parser.add_argument("--bench", action="store_true", help="多进程一致性和速率自检")
+    parser.add_argument("--hz", type=float, default=5.0, help="--watch 的刷新频率")
+    parser.add_argument("--wait", type=float, default=None, help="等待写者创建总线的时间（秒）")
+    parser.add_argument("--readers", type=int, default=2, help="--bench 的读进程数")
+    parser.add_argument("--vehicles", type=int, default=8, help="--bench 的飞机数")
+    parser.add_argument("--seconds", type=float, default=3.0, help="--bench 的时长")
+    args = parser.parse_args()
+    if args.bench:
+        _bench(args)
+    else:
+        _watch(args)
+
+
+if __name__ == "__main__":
+    main()
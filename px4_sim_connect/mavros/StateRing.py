@@ -0,0 +1,110 @@
+import threading
+import numpy as np
+
+## @file
+#  @brief 预分配的定长状态环形缓冲区
+#  @anchor StateRing接口库文件
+#
+#  每个订阅话题一个StateRing，回调中把整条消息写入预先分配好的numpy行，
+#  不随消息数增长分配内存；写满后覆盖最旧的数据。
+#  查询接口（最近N条、时间窗口、按时刻插值）都是向量化的，并返回拷贝，调用方可以随意修改。
+#  写入与查询之间用一把锁保护，锁内只做行拷贝。
+
+
+## @brief 带时间索引的numpy环形缓冲区
+class StateRing:
+    ## @brief 构造函数
+    # @param names 每列的名称，列数即每条记录的宽度
+    # @param capacity 最多保留的记录条数
+    # @param angles 角度列名称（弧度），插值时先解卷绕再插值，避免在±pi处跳变
+    def __init__(self, names, capacity=4096, angles=()):
+        ## @var StateRing.names
+        # 列名称元组
+        self.names = tuple(names)
+        ## @var StateRing.capacity
+        # 最多保留的记录条数
+        self.capacity = int(capacity)
+        self._col = {name: i for i, name in enumerate(self.names)}
+        self._angles = [self._col[name] for name in angles]
+        self._t = np.zeros(self.capacity)
+        self._data = np.zeros((self.capacity, len(self.names)))
+        self._count = 0
+        self._lock = threading.Lock()
+
+    ## @brief 写入一条记录
+    # @param t 记录时刻（秒），应单调不减
+    # @param values 与names等长的数值序列
+    def append(self, t, values):
+        with self._lock:
+            i = self._count % self.capacity
+            self._t[i] = t
+            self._data[i] = values
+            self._count += 1
+
+    ## @brief 当前保留的记录条数
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    ## @brief 累计写入的记录条数（含已被覆盖的）
+    @property
+    def total(self):
+        return self._count
+
+    ## @brief 列名对应的列下标
+    # @param name 列名称
+    def index(self, name):
+        return self._col[name]
+
+    ## @brief 最近N条记录，按时间先后排列
+    # @param n 条数，超过已保留条数时返回全部
+    # @return (t, data)：t为(M,)数组，data为(M,len(names))数组
+    def last(self, n):
+        with self._lock:
+            n = min(int(n), self._count, self.capacity)
+            end = self._count % self.capacity
+            idx = np.arange(end - n, end) % self.capacity
+            return self._t[idx], self._data[idx]
+
+    ## @brief 全部保留的记录，按时间先后排列
+    # @return (t, data)
+    def all(self):
+        return self.last(self.capacity)
+
+    ## @brief 时间窗口[t0, t1]内的记录
+    # @param t0 起始时刻，None表示不限
+    # @param t1 结束时刻，None表示不限
+    # @return (t, data)
+    def window(self, t0=None, t1=None):
+        t, data = self.all()
+        lo = 0 if t0 is None else np.searchsorted(t, t0, side="left")
+        hi = len(t) if t1 is None else np.searchsorted(t, t1, side="right")
+        return t[lo:hi], data[lo:hi]
+
+    ## @brief 按时刻线性插值
+    #
+    #  超出已保留数据范围的时刻取首/尾记录的值；没有任何记录时返回NaN。
+    # @param t 标量或(M,)数组的查询时刻
+    # @return t为标量时返回(len(names),)数组，否则返回(M,len(names))数组
+    def at(self, t):
+        ts, data = self.all()
+        scalar = np.ndim(t) == 0
+        tq = np.atleast_1d(np.asarray(t, dtype=float))
+        out = np.full((len(tq), len(self.names)), np.nan)
+        if len(ts):
+            if self._angles:
+                data[:, self._angles] = np.unwrap(data[:, self._angles], axis=0)
+            for j in range(len(self.names)):
+                out[:, j] = np.interp(tq, ts, data[:, j])
+            if self._angles:
+                out[:, self._angles] = (out[:, self._angles] + np.pi) % (2 * np.pi) - np.pi
+        return out[0] if scalar else out
+
+    ## @brief 把时间窗口内的记录保存为npz文件（t、data、names三个数组）
+    # @param path 文件路径
+    # @param t0 起始时刻，None表示不限
+    # @param t1 结束时刻，None表示不限
+    # @return 保存的记录条数
+    def save(self, path, t0=None, t1=None):
+        t, data = self.window(t0, t1)
+        np.savez(path, t=t, data=data, names=np.array(self.names))
+        return len(t)
@@ -0,0 +1,229 @@
+import time
+import math
+import argparse
+import multiprocessing
+import numpy as np
+
+## @file
+#  @brief 无漂移的定周期节拍调度器
+#  @anchor TickScheduler接口库文件
+#
+#  第k拍的截止时刻固定为 t0 + k*dt，不随每拍的执行耗时累积漂移。
+#  一拍的工作超过周期（overrun）时有两种策略：
+#  - "skip"：丢弃已错过的拍，直接跳到最近一个已到期的拍，拍号与墙钟保持对齐；
+#  - "compress"：不丢拍，错过的拍连续执行直到追上截止时刻。
+#  等待可以是纯sleep，也可以sleep到截止前spin_s秒再忙等，以消除sleep的唤醒误差。
+#  每拍记录唤醒延迟（实际开始时刻-截止时刻）和抖动（相邻两拍间隔与dt之差的绝对值）的直方图。
+#
+#  直接运行本文件可在人为CPU负载下测试50Hz节拍能否保持：
+#  python3 TickScheduler.py --load 4
+
+## @brief 调度器使用的时钟
+clock = time.perf_counter
+
+
+## @brief 定宽分桶的时间直方图，记录开销为O(1)
+class TickHistogram:
+    ## @brief 构造函数
+    # @param bin_s 桶宽（秒）
+    # @param max_s 量程（秒），超出量程的值计入最后一个桶，最大值仍精确记录
+    def __init__(self, bin_s=10e-6, max_s=0.05):
+        self.bin_s = bin_s
+        self.counts = np.zeros(int(math.ceil(max_s / bin_s)) + 1, dtype=np.int64)
+        ## @var TickHistogram.count
+        # 记录次数
+        self.count = 0
+        ## @var TickHistogram.max
+        # 最大值（秒）
+        self.max = 0.0
+        self._sum = 0.0
+
+    ## @brief 记录一个值
+    # @param x 非负的时间值（秒）
+    def record(self, x):
+        i = int(x / self.bin_s)
+        if i >= len(self.counts):
+            i = len(self.counts) - 1
+        self.counts[i] += 1
+        self.count += 1
+        self._sum += x
+        if x > self.max:
+            self.max = x
+
+    ## @brief 平均值（秒）
+    def mean(self):
+        return self._sum / self.count if self.count else 0.0
+
+    ## @brief 百分位数（取所在桶的上沿，秒）
+    # @param p 百分位，0~100
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        i = int(np.searchsorted(np.cumsum(self.counts), math.ceil(self.count * p / 100.0)))
+        return min((i + 1) * self.bin_s, self.max)
+
+    ## @brief 统计摘要，单位毫秒
+    def summary(self):
+        return {
+            "n": self.count,
+            "mean_ms": self.mean() * 1e3,
+            "p50_ms": self.percentile(50) * 1e3,
+            "p99_ms": self.percentile(99) * 1e3,
+            "max_ms": self.max * 1e3,
+        }
+
+
+## @brief 定周期节拍调度器
+class TickScheduler:
+    ## @brief 构造函数
+    # @param dt 节拍周期（秒）
+    # @param overrun 超时策略，"skip"或"compress"
+    # @param spin_s 截止前最后spin_s秒改为忙等，0表示纯sleep
+    def __init__(self, dt, overrun="skip", spin_s=0.0):
+        if overrun not in ("skip", "compress"):
+            raise ValueError(f"unknown overrun policy: {overrun}")
+        self.dt = dt
+        self.overrun = overrun
+        self.spin_s = spin_s
+        ## @var TickScheduler.latency
+        # 唤醒延迟直方图
+        self.latency = TickHistogram()
+        ## @var TickScheduler.jitter
+        # 相邻两拍间隔抖动直方图
+        self.jitter = TickHistogram()
+        ## @var TickScheduler.ticks
+        # 已执行的拍数
+        self.ticks = 0
+        ## @var TickScheduler.late
+        # 上一拍工作超过周期、本拍开始时已过截止时刻的次数
+        self.late = 0
+        ## @var TickScheduler.skipped
+        # skip策略下丢弃的拍数
+        self.skipped = 0
+        self.start()
+
+    ## @brief 以当前时刻（或指定时刻）为第0拍重新开始计拍，统计不清零
+    # @param t0 第0拍的截止时刻，默认为当前时刻
+    def start(self, t0=None):
+        self.t0 = clock() if t0 is None else t0
+        self.k = -1
+        self._last_start = None
+
+    ## @brief 第k拍的截止时刻
+    def deadline(self, k):
+        return self.t0 + k * self.dt
+
+    def _next(self):
+        k = self.k + 1
+        now = clock()
+        if self.overrun == "skip" and now > self.deadline(k):
+            due = int((now - self.t0) / self.dt)
+            if due > k:
+                self.skipped += due - k
+                k = due
+        return k
+
+    def _sleep_until(self, deadline):
+        remain = deadline - clock()
+        if remain > self.spin_s:
+            time.sleep(remain - self.spin_s)
+        while clock() < deadline:
+            pass
+
+    def _begin(self, k):
+        deadline = self.deadline(k)
+        if k and clock() > deadline:
+            self.late += 1
+        self._sleep_until(deadline)
+        now = clock()
+        self.latency.record(now - deadline)
+        if self._last_start is not None and k == self.k + 1:
+            self.jitter.record(abs(now - self._last_start - self.dt))
+        self._last_start = now
+        self.k = k
+        self.ticks += 1
+        return k
+
+    ## @brief 等待下一拍的截止时刻
+    # @return 下一拍的拍号k，对应相对t0的时刻k*dt
+    def wait(self):
+        return self._begin(self._next())
+
+    ## @brief 从当前时刻开始按节拍迭代
+    #
+    #  迭代在拍号达到n或拍时刻k*dt达到duration时结束，结束判断在等待之前进行，不会多等一拍。
+    # @param duration 持续时间（秒），None表示不限
+    # @param n 最多拍数，None表示不限
+    # @return 生成器，依次产生拍号k
+    def run(self, duration=None, n=None):
+        self.start()
+        while True:
+            k = self._next()
+            if n is not None and k >= n:
+                return
+            if duration is not None and k * self.dt >= duration - 1e-9:
+                return
+            yield self._begin(k)
+
+    ## @brief 统计报告
+    def report(self):
+        return {
+            "dt_ms": self.dt * 1e3,
+            "overrun": self.overrun,
+            "spin_ms": self.spin_s * 1e3,
+            "ticks": self.ticks,
+            "late": self.late,
+            "skipped": self.skipped,
+            "latency": self.latency.summary(),
+            "jitter": self.jitter.summary(),
+        }
+
+    ## @brief 单行文本形式的统计报告
+    def format_report(self):
+        r = self.report()
+        lat = r["latency"]
+        jit = r["jitter"]
+        return (
+            f"ticks={r['ticks']} late={r['late']} skipped={r['skipped']} | "
+            f"latency p50={lat['p50_ms']:.3f} p99={lat['p99_ms']:.3f} max={lat['max_ms']:.3f} ms | "
+            f"jitter p50={jit['p50_ms']:.3f} p99={jit['p99_ms']:.3f} max={jit['max_ms']:.3f} ms"
+        )
+
+
+def _burn(stop):
+    while not stop.is_set():
+        pass
+
+
+def _bench(dt, seconds, overrun, spin_s, work_s):
+    sched = TickScheduler(dt, overrun=overrun, spin_s=spin_s)
+    for _ in sched.run(duration=seconds):
+        end = clock() + work_s
+        while clock() < end:
+            pass
+    # 第一拍到最后一拍开始时刻之间的平均频率
+    return sched, (sched.ticks - 1) / (sched._last_start - sched.t0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="节拍调度器在CPU负载下的延迟/抖动测试")
+    parser.add_argument("--hz", type=float, default=50.0, help="节拍频率")
+    parser.add_argument("--seconds", type=float, default=5.0, help="每组测试时长")
+    parser.add_argument("--load", type=int, default=0, help="并行占满CPU的进程数")
+    parser.add_argument("--work-ms", type=float, default=1.0, help="每拍模拟的工作耗时（毫秒）")
+    args = parser.parse_args()
+
+    stop = multiprocessing.Event()
+    burners = [multiprocessing.Process(target=_burn, args=(stop,), daemon=True) for _ in range(args.load)]
+    for p in burners:
+        p.start()
+    print(f"{args.hz:g} Hz, {args.seconds:g} s per case, work {args.work_ms:g} ms/tick, {args.load} busy processes")
+    try:
+        for overrun in ("skip", "compress"):
+            for spin_s in (0.0, 0.0005):
+                sched, rate = _bench(1.0 / args.hz, args.seconds, overrun, spin_s, args.work_ms / 1e3)
+                print(f"{overrun:<8} spin={spin_s * 1e3:.1f}ms rate={rate:7.3f} Hz  {sched.format_report()}")
+    finally:
+        stop.set()
+        for p in burners:
+            p.join()
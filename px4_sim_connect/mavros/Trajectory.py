@@ -0,0 +1,204 @@
+import numpy as np
+
+## @file
+#  @brief 预计算的参考轨迹库
+#  @anchor Trajectory接口库文件
+#
+#  每条轨迹按给定的节拍周期dt和持续时间一次性算出整张表：位置、速度、加速度（NED，相对任务原点）和偏航角，
+#  速度和加速度都是解析导数，可直接作为前馈。飞行循环按拍号k取第k行，热路径中没有三角函数运算。
+#  轨迹由一个可JSON序列化的参数字典（spec）完全确定，写入日志文件头后，
+#  分析脚本用from_spec()重新生成target，日志中不必逐条保存。
+#
+#  周期轨迹在t=0时都从原点出发：
+#  - figure8：n = a sin φ, e = b sin φ cos φ（与mavros_plot8原generate8相同）
+#  - ellipse：n = a sin φ, e = b (1 - cos φ)
+#  - lemniscate：伯努利双纽线，n = a cos φ / (1 + sin²φ), e = a sin φ cos φ / (1 + sin²φ)，φ从π/2开始
+#  - helix：半径r的圆（同ellipse）叠加匀速爬升
+#  其中 φ = 2π (t mod period) / period。
+#  waypoints为过航点的三次样条，首末速度为0，到达最后一个航点后悬停。
+
+
+## @brief 预计算的轨迹表
+class Trajectory:
+    ## @brief 构造函数
+    # @param spec 生成该轨迹的参数字典（含kind）
+    # @param t (N,)时刻
+    # @param pos (N,3)位置
+    # @param vel (N,3)速度
+    # @param acc (N,3)加速度
+    # @param yaw (N,)偏航角（弧度）
+    def __init__(self, spec, t, pos, vel, acc, yaw):
+        self.spec = spec
+        self.t = t
+        self.pos = pos
+        self.vel = vel
+        self.acc = acc
+        self.yaw = yaw
+
+    def __len__(self):
+        return len(self.t)
+
+    ## @brief 按拍号取(n, e, d, yaw)，超出表长的拍号取最后一行
+    # @param k 拍号数组
+    # @return (M,4)数组
+    def target(self, k):
+        i = np.clip(np.asarray(k, dtype=np.int64), 0, len(self.t) - 1)
+        return np.column_stack((self.pos[i], self.yaw[i]))
+
+
+def _time(dt, duration):
+    return np.arange(int(round(duration / dt))) * dt
+
+
+def _phase(t, period, phase0=0.0):
+    return (t % period) / period * 2 * np.pi + phase0
+
+
+def _planar(spec, t, n, e, d, yaw, w):
+    # n、e为(值, 对φ一阶导, 对φ二阶导)，按 dφ/dt = w 换算为对时间的导数
+    pos = np.column_stack((n[0], e[0], d[0]))
+    vel = np.column_stack((w * n[1], w * e[1], d[1]))
+    acc = np.column_stack((w * w * n[2], w * w * e[2], d[2]))
+    return Trajectory(spec, t, pos, vel, acc, np.full(len(t), float(yaw)))
+
+
+def _level(t, height):
+    zero = np.zeros(len(t))
+    return (np.full(len(t), float(height)), zero, zero)
+
+
+def _quotient(u, u1, u2, v, v1, v2):
+    # f = u/v 及其一、二阶导
+    f1 = (u1 * v - u * v1) / (v * v)
+    f2 = (u2 - 2 * f1 * v1 - u / v * v2) / v
+    return (u / v, f1, f2)
+
+
+## @brief 八字轨迹
+# @param a N方向半径
+# @param b E方向半径
+# @param period 单圈时间（秒）
+# @param height 高度（NED的d，负值向上）
+# @param dt 节拍周期（秒）
+# @param duration 持续时间（秒）
+# @param yaw 偏航角（弧度）
+def figure8(a, b, period, height, dt, duration, yaw=0.0):
+    spec = dict(kind="figure8", a=a, b=b, period=period, height=height, dt=dt, duration=duration, yaw=yaw)
+    t = _time(dt, duration)
+    w = 2 * np.pi / period
+    ph = _phase(t, period)
+    s, c = np.sin(ph), np.cos(ph)
+    s2, c2 = np.sin(2 * ph), np.cos(2 * ph)
+    n = (a * s, a * c, -a * s)
+    e = (b * c * s, b * c2, -2 * b * s2)
+    return _planar(spec, t, n, e, _level(t, height), yaw, w)
+
+
+## @brief 椭圆轨迹，圆心在(0, b)
+# @param a N方向半轴
+# @param b E方向半轴
+def ellipse(a, b, period, height, dt, duration, yaw=0.0):
+    spec = dict(kind="ellipse", a=a, b=b, period=period, height=height, dt=dt, duration=duration, yaw=yaw)
+    t = _time(dt, duration)
+    w = 2 * np.pi / period
+    ph = _phase(t, period)
+    s, c = np.sin(ph), np.cos(ph)
+    n = (a * s, a * c, -a * s)
+    e = (b * (1 - c), b * s, b * c)
+    return _planar(spec, t, n, e, _level(t, height), yaw, w)
+
+
+## @brief 伯努利双纽线轨迹
+# @param a 双纽线半宽（N方向最远点到原点的距离）
+def lemniscate(a, period, height, dt, duration, yaw=0.0):
+    spec = dict(kind="lemniscate", a=a, period=period, height=height, dt=dt, duration=duration, yaw=yaw)
+    t = _time(dt, duration)
+    w = 2 * np.pi / period
+    ph = _phase(t, period, np.pi / 2)
+    s, c = np.sin(ph), np.cos(ph)
+    s2, c2 = np.sin(2 * ph), np.cos(2 * ph)
+    den = (1 + s * s, s2, 2 * c2)
+    n = _quotient(a * c, -a * s, -a * c, *den)
+    e = _quotient(a * s2 / 2, a * c2, -2 * a * s2, *den)
+    return _planar(spec, t, n, e, _level(t, height), yaw, w)
+
+
+## @brief 螺旋轨迹：半径r的圆，圆心在(0, r)，同时以climb_rate匀速爬升
+# @param r 半径
+# @param climb_rate 爬升率（m/s，正值向上）
+# @param height 起始高度
+def helix(r, period, climb_rate, height, dt, duration, yaw=0.0):
+    spec = dict(kind="helix", r=r, period=period, climb_rate=climb_rate, height=height,
+                dt=dt, duration=duration, yaw=yaw)
+    t = _time(dt, duration)
+    w = 2 * np.pi / period
+    ph = _phase(t, period)
+    s, c = np.sin(ph), np.cos(ph)
+    n = (r * s, r * c, -r * s)
+    e = (r * (1 - c), r * s, r * c)
+    d = (height - climb_rate * t, np.full(len(t), -float(climb_rate)), np.zeros(len(t)))
+    return _planar(spec, t, n, e, d, yaw, w)
+
+
+## @brief 过航点的三次样条轨迹（首末速度为0）
+# @param points 航点列表[(n, e, d), ...]，至少两个
+# @param speed 平均速度（m/s），用于按航段长度分配到达时刻
+# @param dt 节拍周期（秒）
+# @param duration 持续时间（秒），默认到达最后一个航点即结束，更长时在最后一个航点悬停
+def waypoints(points, speed, dt, duration=None, yaw=0.0):
+    P = np.asarray(points, dtype=float)
+    seg = np.linalg.norm(np.diff(P, axis=0), axis=1)
+    if len(P) < 2 or np.any(seg <= 0):
+        raise ValueError("waypoints need at least two distinct consecutive points")
+    knots = np.concatenate(([0.0], np.cumsum(seg) / speed))
+    if duration is None:
+        duration = knots[-1] + dt
+    spec = dict(kind="waypoints", points=P.tolist(), speed=speed, dt=dt, duration=duration, yaw=yaw)
+    t = _time(dt, duration)
+
+    # 夹持边界（端点一阶导为0）下求各航点处的二阶导M
+    h = np.diff(knots)
+    m = len(P)
+    A = np.zeros((m, m))
+    rhs = np.zeros((m, 3))
+    slope = np.diff(P, axis=0) / h[:, None]
+    A[0, 0], A[0, 1] = 2 * h[0], h[0]
+    rhs[0] = 6 * slope[0]
+    A[-1, -2], A[-1, -1] = h[-1], 2 * h[-1]
+    rhs[-1] = -6 * slope[-1]
+    for i in range(1, m - 1):
+        A[i, i - 1:i + 2] = (h[i - 1], 2 * (h[i - 1] + h[i]), h[i])
+        rhs[i] = 6 * (slope[i] - slope[i - 1])
+    M = np.linalg.solve(A, rhs)
+
+    tc = np.minimum(t, knots[-1])
+    j = np.clip(np.searchsorted(knots, tc, side="right") - 1, 0, m - 2)
+    hj = h[j][:, None]
+    A_ = ((knots[j + 1] - tc) / h[j])[:, None]
+    B_ = 1 - A_
+    pos = (A_ * P[j] + B_ * P[j + 1]
+           + ((A_ ** 3 - A_) * M[j] + (B_ ** 3 - B_) * M[j + 1]) * hj * hj / 6)
+    vel = slope[j] + (-(3 * A_ * A_ - 1) * M[j] + (3 * B_ * B_ - 1) * M[j + 1]) * hj / 6
+    acc = A_ * M[j] + B_ * M[j + 1]
+    done = t >= knots[-1]
+    vel[done] = 0.0
+    acc[done] = 0.0
+    return Trajectory(spec, t, pos, vel, acc, np.full(len(t), float(yaw)))
+
+
+## @brief 轨迹类型到生成函数的映射
+GENERATORS = {
+    "figure8": figure8,
+    "ellipse": ellipse,
+    "lemniscate": lemniscate,
+    "helix": helix,
+    "waypoints": waypoints,
+}
+
+
+## @brief 由参数字典重新生成轨迹
+# @param spec Trajectory.spec
+# @return Trajectory
+def from_spec(spec):
+    params = dict(spec)
+    return GENERATORS[params.pop("kind")](**params)
@@ -0,0 +1,229 @@
+import json
+import math
+import time
+import collections
+import numpy as np
+
+## @file
+#  @brief 数字孪生链路的时延统计：定内存直方图和时钟偏差估计
+#  @anchor TwinLatency接口库文件
+#
+#  LatencyHistogram为HDR风格的对数-线性分桶直方图：以微秒为单位，每个2的幂区间再等分为若干子桶，
+#  相对误差不超过 1/2^(sub_bits-1)（默认7位约1.6%），量程1µs~max_s，内存固定（默认约1300个桶），
+#  长时间运行也不会增长，可给出p50/p99/p99.9/max。
+#
+#  ClockOffset按NTP的方法估计对端时钟相对本机的偏差：本机在t1发出PING，对端在t2收到、t3回复PONG，
+#  本机在t4收到，则
+#    offset = ((t2 - t1) + (t3 - t4)) / 2    （对端时钟 - 本机时钟）
+#    rtt    = (t4 - t1) - (t3 - t2)
+#  假设往返路径对称，误差不超过rtt/2；在最近window个样本中取rtt最小的一个作为估计值（NTP时钟滤波）。
+#  对端报文中的墙钟时间戳减去offset即换算到本机时钟，单向时延 = 本机收到时刻 - 换算后的发送时刻。
+
+
+## @brief HDR风格的定内存时延直方图
+class LatencyHistogram:
+    ## @brief 构造函数
+    # @param max_s 量程（秒），超出量程的值计入最后一个桶，最大值仍精确记录
+    # @param sub_bits 每个2的幂区间的子桶位数，决定相对精度
+    def __init__(self, max_s=60.0, sub_bits=7):
+        self.sub_bits = sub_bits
+        self._full = 1 << sub_bits
+        self._half = self._full >> 1
+        self.max_s = max_s
+        self.counts = np.zeros(self._index(int(max_s * 1e6)) + 1, dtype=np.int64)
+        self.reset()
+
+    ## @brief 清空统计
+    def reset(self):
+        self.counts[:] = 0
+        ## @var LatencyHistogram.count
+        # 记录次数
+        self.count = 0
+        ## @var LatencyHistogram.min
+        # 最小值（秒）
+        self.min = math.inf
+        ## @var LatencyHistogram.max
+        # 最大值（秒）
+        self.max = -math.inf
+        ## @var LatencyHistogram.negative
+        # 小于0的值的个数（时钟偏差未校正或估计有误时出现），按0计入
+        self.negative = 0
+        self._sum = 0.0
+
+    def _index(self, us):
+        e = us.bit_length() - self.sub_bits
+        if e <= 0:
+            return us
+        return e * self._half + (us >> e)
+
+    def _upper(self, i):
+        # 第i个桶的上沿（微秒）
+        if i < self._full:
+            return i + 1
+        e = (i - self._full) // self._half + 1
+        return (i - e * self._half + 1) << e
+
+    ## @brief 记录一个值
+    # @param x 时间值（秒）
+    def record(self, x):
+        if x < 0:
+            self.negative += 1
+            us = 0
+        else:
+            us = int(x * 1e6)
+        i = self._index(us)
+        if i >= len(self.counts):
+            i = len(self.counts) - 1
+        self.counts[i] += 1
+        self.count += 1
+        self._sum += x
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+
+    ## @brief 合并另一个相同参数的直方图
+    def merge(self, other):
+        self.counts += other.counts
+        self.count += other.count
+        self.negative += other.negative
+        self._sum += other._sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    ## @brief 平均值（秒）
+    def mean(self):
+        return self._sum / self.count if self.count else 0.0
+
+    ## @brief 百分位数（取所在桶的上沿，秒）
+    # @param p 百分位，0~100
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        i = int(np.searchsorted(np.cumsum(self.counts), math.ceil(self.count * p / 100.0)))
+        return min(self._upper(i) * 1e-6, self.max)
+
+    ## @brief 统计摘要，单位毫秒
+    def summary(self):
+        if not self.count:
+            return {"n": 0}
+        return {
+            "n": self.count,
+            "mean_ms": self.mean() * 1e3,
+            "min_ms": self.min * 1e3,
+            "p50_ms": self.percentile(50) * 1e3,
+            "p99_ms": self.percentile(99) * 1e3,
+            "p999_ms": self.percentile(99.9) * 1e3,
+            "max_ms": self.max * 1e3,
+            "negative": self.negative,
+        }
+
+    ## @brief 单行文本摘要
+    def format(self):
+        s = self.summary()
+        if not s["n"]:
+            return "n=0"
+        text = (
+            f"n={s['n']} mean={s['mean_ms']:.2f} p50={s['p50_ms']:.2f} p99={s['p99_ms']:.2f} "
+            f"p99.9={s['p999_ms']:.2f} max={s['max_ms']:.2f} ms"
+        )
+        if self.negative:
+            text += f" ({self.negative} negative)"
+        return text
+
+    ## @brief 可JSON序列化的完整内容（只保存非零桶），可用from_dict()恢复后合并
+    def to_dict(self):
+        nz = np.flatnonzero(self.counts)
+        return {
+            "max_s": self.max_s, "sub_bits": self.sub_bits, "count": self.count, "sum": self._sum,
+            "min": self.min if self.count else None, "max": self.max if self.count else None,
+            "negative": self.negative, "index": nz.tolist(), "counts": self.counts[nz].tolist(),
+        }
+
+    ## @brief 由to_dict()的结果恢复
+    @classmethod
+    def from_dict(cls, d):
+        h = cls(d["max_s"], d["sub_bits"])
+        h.counts[d["index"]] = d["counts"]
+        h.count = d["count"]
+        h._sum = d["sum"]
+        h.negative = d["negative"]
+        if d["count"]:
+            h.min = d["min"]
+            h.max = d["max"]
+        return h
+
+
+## @brief NTP式时钟偏差估计
+class ClockOffset:
+    ## @brief 构造函数
+    # @param window 参与滤波的最近样本数
+    def __init__(self, window=8):
+        self.samples = collections.deque(maxlen=window)
+        ## @var ClockOffset.offset
+        # 对端时钟 - 本机时钟（秒），尚无样本时为None
+        self.offset = None
+        ## @var ClockOffset.rtt
+        # 所选样本的往返时间（秒）
+        self.rtt = None
+
+    ## @brief 加入一次PING/PONG往返
+    # @param t1 本机发出PING的时刻
+    # @param t2 对端收到PING的时刻
+    # @param t3 对端发出PONG的时刻
+    # @param t4 本机收到PONG的时刻
+    # @return 本次样本的(offset, rtt)
+    def add(self, t1, t2, t3, t4):
+        rtt = (t4 - t1) - (t3 - t2)
+        offset = ((t2 - t1) + (t3 - t4)) / 2
+        self.samples.append((rtt, offset))
+        self.rtt, self.offset = min(self.samples)
+        return offset, rtt
+
+    ## @brief 对端墙钟时间戳换算到本机时钟
+    def to_local(self, t_remote):
+        return t_remote - (self.offset or 0.0)
+
+
+## @brief 按间隔把统计快照追加写入JSON Lines文件
+class LatencyExporter:
+    ## @brief 构造函数
+    # @param path 输出文件路径，None表示不导出
+    # @param interval 导出间隔（秒）
+    def __init__(self, path, interval=10.0):
+        self.path = path
+        self.interval = interval
+        self._next = time.monotonic() + interval
+
+    ## @brief 到达导出间隔时写入一行
+    # @param snapshot 可调用对象，返回本次要写入的字典
+    # @param force 忽略间隔立即写入（例如退出时）
+    # @return 是否写入
+    def maybe_export(self, snapshot, force=False):
+        if self.path is None:
+            return False
+        now = time.monotonic()
+        if not force and now < self._next:
+            return False
+        self._next = now + self.interval
+        rec = {"time": time.time()}
+        rec.update(snapshot())
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec) + "\n")
+        return True
+
+
+if __name__ == "__main__":
+    # 精度和开销自检：与排序得到的精确百分位比较
+    rng = np.random.default_rng(0)
+    x = rng.lognormal(np.log(2e-3), 0.8, 200000)
+    h = LatencyHistogram()
+    t0 = time.perf_counter()
+    for v in x.tolist():
+        h.record(v)
+    t1 = time.perf_counter()
+    print(f"{len(h.counts)} buckets, record {(t1 - t0) / len(x) * 1e9:.0f} ns/value")
+    for p in (50, 99, 99.9):
+        exact = np.percentile(x, p)
+        print(f"p{p:<5} exact={exact * 1e3:.4f} ms  hist={h.percentile(p) * 1e3:.4f} ms  "
+              f"err={(h.percentile(p) / exact - 1) * 100:+.2f}%")
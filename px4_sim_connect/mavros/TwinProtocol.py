@@ -0,0 +1,351 @@
+import json
+import time
+import struct
+
+## @file
+#  @brief 数字孪生链路（mavros_plot8 → mav_tranfer）的UDP报文协议
+#  @anchor TwinProtocol接口库文件
+#
+#  二进制报文为定长小端布局，公共头之后按类型跟随负载：
+#  - 公共头 HEADER：magic(b"TW"), version, kind, vehicle_id, flags, seq, t_mono(f8), t_wall(f8)
+#  - STATE：pos(3×f4), att(3×f4)，与原JSON的pos/att_deg含义相同
+#  - START：dt(f8)
+#  - HELLO / HELLO_ACK：version(B)，发送端声明支持的最高版本，接收端回复协商后的版本
+#  - PING：无负载，头中的t_wall即发出时刻t1
+#  - PONG：t1(f8), t2(f8)，回显PING的t1和收到PING的时刻t2，头中的t_wall为回复时刻t3
+#  seq按车辆递增，接收端据此检测丢包和乱序；t_mono为发送端time.monotonic()，t_wall为time.time()。
+#
+#  发送端默认先协商：发出HELLO并等待HELLO_ACK，超时则退回JSON；
+#  接收端按首字节区分二进制（b"T"）和JSON（b"{"），两种报文可以混合接收。
+#  接收端定期向发送端发PING，发送端在每次发送时顺带回复PONG，接收端据此估计两端的时钟偏差（见TwinLatency）。
+#  直接运行本文件可对比两种编码的大小和编解码耗时。
+
+## @brief 报文魔数
+MAGIC = b"TW"
+## @brief 当前协议版本
+VERSION = 1
+
+KIND_STATE = 1
+KIND_START = 2
+KIND_HELLO = 3
+KIND_HELLO_ACK = 4
+KIND_PING = 5
+KIND_PONG = 6
+
+HEADER = struct.Struct("<2sBBHHIdd")
+STATE = struct.Struct("<2sBBHHIdd3f3f")
+START = struct.Struct("<2sBBHHIddd")
+HELLO = struct.Struct("<2sBBHHIddB")
+PONG = struct.Struct("<2sBBHHIdddd")
+
+_KIND_NAMES = {"state": KIND_STATE, "start": KIND_START, "hello": KIND_HELLO, "hello_ack": KIND_HELLO_ACK,
+               "ping": KIND_PING, "pong": KIND_PONG}
+
+
+## @brief 解码后的报文
+class Packet(object):
+    __slots__ = ("kind", "vehicle", "seq", "t_mono", "t_wall", "pos", "att", "dt", "version", "echo", "binary")
+
+    def __init__(self, kind, vehicle, seq, t_mono, t_wall, pos=None, att=None, dt=None, version=None, echo=None,
+                 binary=True):
+        ## @var Packet.kind
+        # 报文类型 KIND_*
+        self.kind = kind
+        ## @var Packet.vehicle
+        # 车辆ID
+        self.vehicle = vehicle
+        ## @var Packet.seq
+        # 序号，JSON报文未携带时为None
+        self.seq = seq
+        self.t_mono = t_mono
+        self.t_wall = t_wall
+        self.pos = pos
+        self.att = att
+        self.dt = dt
+        self.version = version
+        ## @var Packet.echo
+        # PONG报文回显的(t1, t2)
+        self.echo = echo
+        ## @var Packet.binary
+        # 是否为二进制报文
+        self.binary = binary
+
+
+## @brief STATE报文编码
+# @param vehicle 车辆ID
+# @param seq 序号
+# @param pos 位置(x, y, z)
+# @param att 姿态(roll, pitch, yaw)
+# @param t_mono 发送端单调时钟，默认当前time.monotonic()
+# @param t_wall 发送端墙钟，默认当前time.time()
+# @return bytes
+def encode_state(vehicle, seq, pos, att, t_mono=None, t_wall=None):
+    return STATE.pack(
+        MAGIC, VERSION, KIND_STATE, vehicle, 0, seq & 0xFFFFFFFF,
+        time.monotonic() if t_mono is None else t_mono,
+        time.time() if t_wall is None else t_wall,
+        pos[0], pos[1], pos[2], att[0], att[1], att[2],
+    )
+
+
+## @brief START报文编码
+def encode_start(vehicle, seq, dt):
+    return START.pack(MAGIC, VERSION, KIND_START, vehicle, 0, seq & 0xFFFFFFFF, time.monotonic(), time.time(), dt)
+
+
+## @brief HELLO/HELLO_ACK报文编码
+# @param kind KIND_HELLO或KIND_HELLO_ACK
+# @param version 支持的最高版本（HELLO）或协商后的版本（HELLO_ACK）
+def encode_hello(kind, vehicle, version=VERSION):
+    return HELLO.pack(MAGIC, VERSION, kind, vehicle, 0, 0, time.monotonic(), time.time(), version)
+
+
+## @brief PING报文编码，发出时刻t1记在头的t_wall中
+# @param seq PING序号
+def encode_ping(vehicle, seq):
+    return HEADER.pack(MAGIC, VERSION, KIND_PING, vehicle, 0, seq & 0xFFFFFFFF, time.monotonic(), time.time())
+
+
+## @brief PONG报文编码
+# @param ping 收到的PING报文
+# @param t2 收到PING的时刻（time.time()）
+def encode_pong(vehicle, ping, t2):
+    return PONG.pack(MAGIC, VERSION, KIND_PONG, vehicle, 0, ping.seq, time.monotonic(), time.time(), ping.t_wall, t2)
+
+
+## @brief 与二进制STATE/START含义相同的JSON报文编码（回退模式）
+def encode_json(kind, vehicle, seq, pos=None, att=None, dt=None):
+    msg = {"vid": vehicle, "seq": seq, "mono": time.monotonic(), "ts": time.time()}
+    if kind == KIND_START:
+        msg["type"] = "start"
+        msg["dt"] = dt
+    else:
+        msg["pos"] = list(pos)
+        msg["att_deg"] = list(att)
+    return json.dumps(msg).encode("utf-8")
+
+
+def _decode_json(data, default_vehicle):
+    try:
+        msg = json.loads(data.decode("utf-8"))
+    except ValueError:
+        return None
+    if not isinstance(msg, dict):
+        return None
+    kind = _KIND_NAMES.get(msg.get("type", "state"))
+    if kind is None:
+        return None
+    try:
+        vehicle = int(msg.get("vid", default_vehicle))
+    except (TypeError, ValueError):
+        return None
+    return Packet(
+        kind, vehicle, msg.get("seq"), msg.get("mono"), msg.get("ts"),
+        pos=msg.get("pos"), att=msg.get("att_deg"), dt=msg.get("dt"), version=msg.get("version"), binary=False,
+    )
+
+
+## @brief 解码一个数据报，二进制和JSON均可
+# @param data 数据报内容
+# @param default_vehicle JSON报文未携带vid时使用的车辆ID
+# @return Packet，无法识别时返回None
+def decode(data, default_vehicle=1):
+    if data[:2] != MAGIC:
+        return _decode_json(data, default_vehicle) if data[:1] == b"{" else None
+    if len(data) < HEADER.size or data[2] > VERSION:
+        return None
+    kind = data[3]
+    if kind == KIND_STATE and len(data) >= STATE.size:
+        _, _, _, vid, _, seq, t_mono, t_wall, x, y, z, r, p, yaw = STATE.unpack_from(data)
+        return Packet(kind, vid, seq, t_mono, t_wall, pos=(x, y, z), att=(r, p, yaw))
+    if kind == KIND_START and len(data) >= START.size:
+        _, _, _, vid, _, seq, t_mono, t_wall, dt = START.unpack_from(data)
+        return Packet(kind, vid, seq, t_mono, t_wall, dt=dt)
+    if kind in (KIND_HELLO, KIND_HELLO_ACK) and len(data) >= HELLO.size:
+        _, _, _, vid, _, seq, t_mono, t_wall, version = HELLO.unpack_from(data)
+        return Packet(kind, vid, seq, t_mono, t_wall, version=version)
+    if kind == KIND_PING:
+        _, _, _, vid, _, seq, t_mono, t_wall = HEADER.unpack_from(data)
+        return Packet(kind, vid, seq, t_mono, t_wall)
+    if kind == KIND_PONG and len(data) >= PONG.size:
+        _, _, _, vid, _, seq, t_mono, t_wall, t1, t2 = PONG.unpack_from(data)
+        return Packet(kind, vid, seq, t_mono, t_wall, echo=(t1, t2))
+    return None
+
+
+## @brief 接收端处理HELLO：回复HELLO_ACK
+# @param pkt 已解码的报文
+# @param sock 接收套接字
+# @param addr 发送端地址
+# @return 是否为HELLO报文（已处理）
+def answer_hello(pkt, sock, addr):
+    if pkt.kind != KIND_HELLO:
+        return False
+    sock.sendto(encode_hello(KIND_HELLO_ACK, pkt.vehicle, min(pkt.version or 1, VERSION)), addr)
+    return True
+
+
+## @brief 序号比已收到的最大序号小这么多时，认为发送端重启后从头计数，而不是迟到的报文
+SEQ_RESTART_GAP = 256
+
+
+## @brief 按车辆统计序号，检测丢包、乱序和重复
+class SeqTracker:
+    def __init__(self):
+        ## @var SeqTracker.restarts
+        # 检测到的发送端重启次数（序号大幅回退或由接收端调用reset）
+        self.restarts = 0
+        ## @var SeqTracker.received
+        # 收到的报文数
+        self.received = 0
+        ## @var SeqTracker.lost
+        # 序号跳过的报文数（之后迟到的报文会从中扣除）
+        self.lost = 0
+        ## @var SeqTracker.reordered
+        # 迟于更大序号到达的报文数（含重复）
+        self.reordered = 0
+        self._next = None
+
+    ## @brief 记录一个序号
+    # @param seq 报文序号，None时忽略
+    # @return True表示该报文比此前收到的都新，False表示迟到或重复
+    def update(self, seq):
+        self.received += 1
+        if seq is None:
+            return True
+        if self._next is not None and self._next - seq > SEQ_RESTART_GAP:
+            self.reset()
+        if self._next is None or seq >= self._next:
+            if self._next is not None:
+                self.lost += seq - self._next
+            self._next = seq + 1
+            return True
+        self.reordered += 1
+        if self.lost > 0:
+            self.lost -= 1
+        return False
+
+    ## @brief 发送端重启：忘掉已收到的最大序号，下一个报文无论序号大小都视为最新；累计统计保留
+    def reset(self):
+        if self._next is not None:
+            self.restarts += 1
+        self._next = None
+
+
+## @brief 发送端：按协商结果选择二进制或JSON编码
+class TwinSender:
+    ## @brief 构造函数
+    # @param sock UDP套接字（需能收到接收端的HELLO_ACK回复）
+    # @param addr 接收端地址(ip, port)
+    # @param vehicle 车辆ID
+    # @param mode "auto"协商后决定，"binary"固定二进制，"json"固定JSON
+    def __init__(self, sock, addr, vehicle=1, mode="auto"):
+        if mode not in ("auto", "binary", "json"):
+            raise ValueError(f"unknown twin mode: {mode}")
+        self.sock = sock
+        self.addr = addr
+        self.vehicle = vehicle
+        self.mode = mode
+        ## @var TwinSender.binary
+        # 当前是否使用二进制编码
+        self.binary = mode == "binary"
+        self.seq = 0
+        ## @var TwinSender.pings
+        # 已回复的PING数
+        self.pings = 0
+        self._last_hello = -1e9
+
+    ## @brief 发出HELLO并等待HELLO_ACK，收到则切换为二进制
+    # @param timeout 等待时间（秒）
+    # @return 是否使用二进制编码
+    def negotiate(self, timeout=1.0):
+        if self.mode != "auto":
+            return self.binary
+        self._hello()
+        deadline = time.monotonic() + timeout
+        while not self.binary and time.monotonic() < deadline:
+            self._poll(deadline - time.monotonic())
+        return self.binary
+
+    def _hello(self):
+        self._last_hello = time.monotonic()
+        self.sock.sendto(encode_hello(KIND_HELLO, self.vehicle), self.addr)
+
+    def _poll(self, timeout=0.0):
+        # 读完套接字中所有待处理的回复：HELLO_ACK切换为二进制，PING立即回复PONG
+        old = self.sock.gettimeout()
+        self.sock.settimeout(timeout if timeout > 0 else 0.0)
+        try:
+            while True:
+                try:
+                    data, addr = self.sock.recvfrom(256)
+                except OSError:
+                    # 无数据、超时，或接收端未启动时的ICMP端口不可达
+                    return
+                t_recv = time.time()
+                pkt = decode(data)
+                if pkt is None:
+                    continue
+                if pkt.kind == KIND_HELLO_ACK:
+                    self.binary = True
+                    return
+                if pkt.kind == KIND_PING:
+                    self.sock.sendto(encode_pong(self.vehicle, pkt, t_recv), addr)
+                    self.pings += 1
+                self.sock.settimeout(0.0)
+        finally:
+            self.sock.settimeout(old)
+
+    def _next_seq(self):
+        self.seq += 1
+        if self.mode == "auto" and not self.binary and time.monotonic() - self._last_hello > 1.0:
+            # 回退模式下每秒重试一次协商，接收端晚启动时也能切换到二进制
+            self._poll()
+            if not self.binary:
+                self._hello()
+        elif self.binary:
+            self._poll()
+        return self.seq
+
+    ## @brief 发送状态报文
+    # @param pos 位置(x, y, z)
+    # @param att 姿态(roll, pitch, yaw)
+    def send_state(self, pos, att):
+        seq = self._next_seq()
+        if self.binary:
+            data = encode_state(self.vehicle, seq, pos, att)
+        else:
+            data = encode_json(KIND_STATE, self.vehicle, seq, pos, att)
+        self.sock.sendto(data, self.addr)
+
+    ## @brief 发送开始报文
+    # @param dt 发送周期（秒）
+    def send_start(self, dt):
+        seq = self._next_seq()
+        if self.binary:
+            data = encode_start(self.vehicle, seq, dt)
+        else:
+            data = encode_json(KIND_START, self.vehicle, seq, dt=dt)
+        self.sock.sendto(data, self.addr)
+
+
+if __name__ == "__main__":
+    n = 100000
+    pos = (1.234567, -2.345678, -1.5)
+    att = (0.01, -0.02, 1.57)
+    legacy = lambda: json.dumps({"pos": list(pos), "att_deg": list(att), "ts": time.time()}).encode("utf-8")
+    cases = [
+        ("json (legacy)", legacy, lambda d: json.loads(d.decode("utf-8"))),
+        ("json (fallback)", lambda: encode_json(KIND_STATE, 1, 1, pos, att), decode),
+        ("binary", lambda: encode_state(1, 1, pos, att), decode),
+    ]
+    for name, enc, dec in cases:
+        data = enc()
+        t0 = time.perf_counter()
+        for _ in range(n):
+            enc()
+        t1 = time.perf_counter()
+        for _ in range(n):
+            dec(data)
+        t2 = time.perf_counter()
+        print(f"{name:<16} {len(data):4d} bytes  encode {(t1 - t0) / n * 1e6:6.2f} us  decode {(t2 - t1) / n * 1e6:6.2f} us")
@@ -0,0 +1,189 @@
+import math
+import time
+import numpy as np
+
+## @file
+#  @brief 与通信后端无关的飞机状态类型：不可变状态快照、Offboard设定点发布统计、设定点和姿态换算，以及两种后端共用的默认参数
+#  @anchor VehicleState接口库文件
+#
+#  PX4MavCtrlV4ROS（经mavros）和PX4MavDirect（直连MAVLink）都用这里的类型发布状态，
+#  上层的mavros_plot8、FleetCtrl、StateBus不必关心数据来自哪个后端。
+
+
+## @brief 各话题环形缓冲区保留的记录条数（50Hz下约5分钟）
+STATE_RING_LEN = 16384
+
+## @brief Offboard设定点的保活频率：没有新设定点时至少按此频率重发最近一次设定点
+OFFBOARD_HZ = 30.0
+## @brief Offboard设定点的最高发布频率：新设定点到达后立即发布，但相邻两次发布至少间隔1/OFFBOARD_MAX_HZ
+OFFBOARD_MAX_HZ = 200.0
+
+
+## @brief 不可变的状态快照基类
+#
+#  接收线程（ROS回调或直连后端的接收线程）每收到一条消息就新建一个快照，再通过一次属性赋值（引用替换，CPython下是原子的）发布；
+#  读取方拿到的引用此后不会再被改写，无需加锁就能读到同一条消息的一致数据。
+class StateSnapshot(object):
+    __slots__ = ("seq", "stamp", "recvTime")
+
+    ## @brief 构造函数
+    #  @param seq 该话题的消息序号，从1开始，0表示尚未收到消息
+    #  @param stamp 消息头中的时间戳（秒）
+    #  @param recvTime 回调收到消息时的time.monotonic()
+    def __init__(self, seq, stamp, recvTime):
+        object.__setattr__(self, "seq", seq)
+        object.__setattr__(self, "stamp", stamp)
+        object.__setattr__(self, "recvTime", recvTime)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(type(self).__name__ + " is read-only")
+
+    ## @brief 快照的数据年龄
+    #  @param now time.monotonic()时刻，默认取当前时刻
+    #  @return 距收到消息的秒数，尚未收到消息时为inf
+    def age(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        return now - self.recvTime
+
+
+## @brief 位置姿态快照，对应一条local_position/pose消息
+class PoseState(StateSnapshot):
+    __slots__ = ("posNED", "angEular", "angQuatern")
+
+    ## @brief 构造函数
+    #  @param posNED NED位置元组
+    #  @param angEular 欧拉角元组（弧度）
+    #  @param angQuatern 四元数元组(w,x,y,z)
+    def __init__(self, seq, stamp, recvTime, posNED, angEular, angQuatern):
+        StateSnapshot.__init__(self, seq, stamp, recvTime)
+        object.__setattr__(self, "posNED", posNED)
+        object.__setattr__(self, "angEular", angEular)
+        object.__setattr__(self, "angQuatern", angQuatern)
+
+
+## @brief 速度快照，对应一条local_position/velocity_local消息
+class VelState(StateSnapshot):
+    __slots__ = ("velNED", "angRate")
+
+    ## @brief 构造函数
+    #  @param velNED NED速度元组
+    #  @param angRate 角速率元组
+    def __init__(self, seq, stamp, recvTime, velNED, angRate):
+        StateSnapshot.__init__(self, seq, stamp, recvTime)
+        object.__setattr__(self, "velNED", velNED)
+        object.__setattr__(self, "angRate", angRate)
+
+
+## @brief Offboard设定点发布统计的报告接口
+#
+#  使用方需提供offStats（计数字典）、offPubInterval（发布间隔直方图）和offPubLatency（设定点到发布时延直方图）。
+class OffboardReport(object):
+    ## @brief 设定点发布统计
+    #  @return 字典：发布计数、发布频率（Hz，按发布间隔均值计算）、发布间隔和设定点到发布时延的摘要（毫秒）
+    def offboardReport(self):
+        interval = self.offPubInterval.summary()
+        return dict(
+            self.offStats,
+            rateHz=1000.0 / interval["mean_ms"] if interval["mean_ms"] > 0 else 0.0,
+            interval=interval,
+            latency=self.offPubLatency.summary(),
+        )
+
+    ## @brief 单行文本形式的设定点发布统计
+    def formatOffboardReport(self):
+        r = self.offboardReport()
+        lat = r["latency"]
+        itv = r["interval"]
+        return (
+            f"offboard rate={r['rateHz']:.1f} Hz published={r['published']} (change={r['onChange']} "
+            f"keepalive={r['keepalive']}) cmds={r['cmds']} coalesced={r['coalesced']} | "
+            f"interval p50={itv['p50_ms']:.2f} p99={itv['p99_ms']:.2f} max={itv['max_ms']:.2f} ms | "
+            f"latency p50={lat['p50_ms']:.3f} p99={lat['p99_ms']:.3f} max={lat['max_ms']:.3f} ms"
+        )
+
+
+## @brief 两种后端共用的设定点和姿态换算函数
+class CtrlHelpers(object):
+    ## @brief 将输入数据填充或截断到指定的长度。
+    # @param data 需要填充或截断的数据，可以是列表或NumPy数组。
+    # @param inLen 目标长度，即填充或截断后的长度。
+    # @param fill 填充值，当数据长度小于目标长度时，会用这个值来填充数据。默认值为0。
+    # @return 返回填充或截断后的数据
+    def fillList(self, data, inLen, fill=0):
+        if isinstance(data, np.ndarray):
+            data = data.tolist()
+
+        if isinstance(data, list) and len(data) == inLen:
+            return data
+        else:
+            if isinstance(data, list):
+                datLen = len(data)
+                if datLen < inLen:
+                    data = data + [fill] * (inLen - datLen)
+
+                if datLen > inLen:
+                    data = data[0:inLen]
+            else:
+                data = [data] + [fill] * (inLen - 1)
+        return data
+
+    ## @brief 根据提供的布尔列表 EnList 计算一个类型掩码（type mask）。
+    #  @param EnList 布尔列表
+    #  @return 返回计算后的类型掩码
+    def calcTypeMask(self, EnList):
+        enPos = EnList[0]
+        enVel = EnList[1]
+        enAcc = EnList[2]
+        enForce = EnList[3]
+        enYaw = EnList[4]
+        EnYawrate = EnList[5]
+        y = int(0)
+        if not enPos:
+            y = y | 7
+
+        if not enVel:
+            y = y | (7 << 3)
+
+        if not enAcc:
+            y = y | (7 << 6)
+
+        # 该位置1表示加速度字段按力解释（FORCE_SET），只有显式启用力控制时才置位，
+        # 否则启用加速度前馈时PX4会把加速度当作力而忽略
+        if enForce:
+            y = y | (1 << 9)
+
+        if not enYaw:
+            y = y | (1 << 10)
+
+        if not EnYawrate:
+            y = y | (1 << 11)
+        return y
+
+    ## @brief 从输入的四元数（q）来计算偏航角
+    #  @param q 四元数
+    #  @return 偏航角（弧度）
+    def q2yaw(self, q):
+        q0, q1, q2, q3 = q.w, q.x, q.y, q.z
+        return math.atan2(2 * (q0 * q3 + q1 * q2), 1 - 2 * (q2 * q2 + q3 * q3))
+
+    ## @brief 从输入的四元数（q）来计算欧拉角
+    #  @param q 四元数
+    #  @return 返回计算后的姿态角。
+    def q2Euler(self, q):
+        w, x, y, z = q.w, q.x, q.y, q.z
+        roll = math.atan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))
+        pitch = math.asin(2 * (w * y - z * x))
+        yaw = math.atan2(2 * (w * z + x * y), 1 - 2 * (z * z + y * y))
+        return [roll, pitch, yaw]
+
+    ## @brief 对偏航角进行饱和处理，此函数接收一个偏航角值，并确保其在 -π/2 到 π/2 弧度（或等效的 -90 到 90 度）的范围内。如果输入的偏航角超出这个范围，函数会相应地调整它，使其不超过阈值。
+    # @param yaw 输入的偏航角，以弧度为单位
+    # @return 返回饱和后的偏航角值
+    def yawSat(self, yaw):
+        yawOut = yaw
+        if yaw > math.pi / 2:
+            yawOut = yaw - math.pi / 2
+        if yaw < -math.pi / 2:
+            yawOut = yaw + math.pi / 2
+        return yawOut
@@ -1,5 +1,10 @@
-import json
-import math
+import os
+import re
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import FlyLog
+import ResultCache
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
@@ -9,6 +14,11 @@ sitl1_JSON = rf"D:\code\NIMTE\rflysim\flylog\FC_20260129_sitl{group_idx}.json"
 hitl1_JSON = rf"D:\code\NIMTE\rflysim\flylog\FC_20260129_hitl{group_idx}.json"
 real1_JSON = rf"D:\code\NIMTE\rflysim\flylog\FC_20260129_lidar{group_idx}.json"
 
+EXCEL_FILE = "result.xlsx"
+# 日志命名：FC_<日期等前缀>_<sitl|hitl|lidar><组号>.<fcb|jsonl|json>
+GROUP_RE = re.compile(r"^FC_(.*)_(sitl|hitl|lidar)(\d+)\.(fcb|jsonl|json)$")
+EXT_PRIORITY = {"fcb": 0, "jsonl": 1, "json": 2}
+
 def save_to_excel(data_dict, filename, group_idx):
     """
     data_dict: {"SITL pos x": [...], "SITL pos y": [...], ...}
@@ -24,196 +34,306 @@ def save_to_excel(data_dict, filename, group_idx):
         df[col_name] = pd.Series(vals)
     df.to_excel(filename)
 
-def load(path):
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    if data and "k" in data[0]:
-        data.sort(key=lambda x: x.get("k", 0))
-    else:
-        data.sort(key=lambda x: x.get("t", 0.0))
-    return data
-
-def norm3(v):
-    flat = []
-    for x in v:
-        if isinstance(x, list):
-            flat.extend(x)
-        else:
-            flat.append(x)
-    return math.sqrt(sum(float(x)**2 for x in flat if isinstance(x, (int, float, str))))
+def load_arrays(path):
+    """
+    读取日志为按 k 升序、k 去重（同一 k 保留最后一条）的数组
+    return: (k, pos(N,3), att_deg(N,3))，缺失的 pos/att 分量按 0 处理
+    """
+    a = FlyLog.load_arrays(path)
+    k = a["k"]
+    valid = k != FlyLog.FCB_INT_NAN
+    k = k[valid]
+    pos = np.nan_to_num(a["pos"][valid], nan=0.0)
+    att = np.nan_to_num(a["att_deg"][valid], nan=0.0)
+    order = np.argsort(k, kind="stable")
+    k, pos, att = k[order], pos[order], att[order]
+    last = np.ones(len(k), dtype=bool)
+    last[:-1] = k[1:] != k[:-1]
+    return k[last], pos[last], att[last]
+
+def join_on_k(*logs):
+    """
+    按 k 对齐多组日志（取交集）
+    logs: load_arrays 的返回值
+    return: (ks, [(pos, att), ...])
+    """
+    ks = logs[0][0]
+    for k, _, _ in logs[1:]:
+        ks = np.intersect1d(ks, k, assume_unique=True)
+    out = []
+    for k, pos, att in logs:
+        idx = np.searchsorted(k, ks)
+        out.append((pos[idx], att[idx]))
+    return ks, out
 
 def rms(errors):
-    if not errors:
-        return 0.0
-    return math.sqrt(sum(e**2 for e in errors) / len(errors))
+    """
+    按列计算 RMS，errors 为 (N,) 或 (N, m) 数组
+    """
+    errors = np.asarray(errors, dtype=float)
+    if len(errors) == 0:
+        return np.zeros(errors.shape[1:]) if errors.ndim > 1 else 0.0
+    return np.sqrt(np.mean(errors ** 2, axis=0))
 
 def comp_percent(errors, rms, par=2):
-    return sum(abs(e) < par * rms for e in errors) / len(errors) * 100 if errors else 0.0
-
-def get_first_number(x):
-    if isinstance(x, list):
-        return get_first_number(x[0])
-    return x
-
-def pad3(lst, fill=0):
-    lst = lst if isinstance(lst, list) else [lst]
-    flat = []
-    for x in lst:
-        if isinstance(x, list):
-            flat.extend(x)
+    """
+    按列计算 |e| < par*RMS 的百分比
+    """
+    errors = np.asarray(errors, dtype=float)
+    if len(errors) == 0:
+        return np.zeros(errors.shape[1:]) if errors.ndim > 1 else 0.0
+    return np.mean(np.abs(errors) < par * rms, axis=0) * 100
+
+def compute_diffs(sitl_path, hitl_path, real_path):
+    """
+    计算 SITL/HITL 相对真机的逐轴误差与模长误差
+    return: (ks, diffs, norm_diffs)，diffs 中每项为 (N,3)，norm_diffs 中每项为 (N,)
+    """
+    ks, ((s_pos, s_att), (h_pos, h_att), (r_pos, r_att)) = join_on_k(
+        load_arrays(sitl_path), load_arrays(hitl_path), load_arrays(real_path)
+    )
+    norm = lambda v: np.sqrt(np.sum(v * v, axis=1))
+    diffs = {
+        "SITL pos": s_pos - r_pos,
+        "SITL att": s_att - r_att,
+        "HITL pos": h_pos - r_pos,
+        "HITL att": h_att - r_att,
+    }
+    norm_diffs = {
+        "SITL pos norm": norm(s_pos) - norm(r_pos),
+        "SITL att norm": norm(s_att) - norm(r_att),
+        "HITL pos norm": norm(h_pos) - norm(r_pos),
+        "HITL att norm": norm(h_att) - norm(r_att),
+    }
+    return ks, diffs, norm_diffs
+
+STAT_AXES = {"pos": ["x", "y", "z"], "att": ["roll", "pitch", "yaw"]}
+
+def group_summary(diffs, norm_diffs, par=2):
+    """
+    把所有逐轴误差和模长误差拼成一个 (N, 16) 矩阵，一次算出全部统计量
+    return: {统计项: {"rms", "percent", "mean", "max", "min"}}，逐轴项在前、模长项在后
+    """
+    names, cols = [], []
+    for name, d in diffs.items():
+        for i, axis in enumerate(STAT_AXES[name.split()[1]]):
+            names.append(f"{name} {axis}")
+            cols.append(d[:, i])
+    for name, d in norm_diffs.items():
+        names.append(name)
+        cols.append(d)
+    errors = np.column_stack(cols)
+    stats = {"rms": rms(errors)}
+    stats["percent"] = comp_percent(errors, stats["rms"], par)
+    if len(errors):
+        stats["mean"] = np.mean(errors, axis=0)
+        stats["max"] = np.max(errors, axis=0)
+        stats["min"] = np.min(errors, axis=0)
+    else:
+        stats["mean"] = stats["max"] = stats["min"] = np.full(len(names), np.nan)
+    return {
+        name: {key: float(vals[i]) for key, vals in stats.items()}
+        for i, name in enumerate(names)
+    }
+
+def group_stats(summary):
+    """
+    由 group_summary 的结果生成报表的一列
+    return: (stat_names, stat_values)，顺序为全部 RMS 项在前、全部 percent 项在后
+    """
+    stat_names = [f"{n} RMS" for n in summary] + [f"{n} percent" for n in summary]
+    stat_values = [st["rms"] for st in summary.values()] + [st["percent"] for st in summary.values()]
+    return stat_names, stat_values
+
+def print_stats(summary, par=2):
+    """
+    打印逐轴误差的 RMS/mean/max/min/percent 和模长误差的 RMS/percent
+    """
+    for name, st in summary.items():
+        unit = "m" if ' pos' in name else "deg"
+        if name.endswith(" norm"):
+            print(f"{name}: RMS={st['rms']:.4f}({unit}), percent |error| < {par}*RMS: {st['percent']:.2f}%")
         else:
-            flat.append(x)
-    return (flat + [fill, fill, fill])[:3]
-
-def main():
-    sitl1 = load(sitl1_JSON)
-    hitl1 = load(hitl1_JSON)
-    real1 = load(real1_JSON)
-
-    sitl_by_k = {r['k']: r for r in sitl1 if 'k' in r}
-    hitl_by_k = {r['k']: r for r in hitl1 if 'k' in r}
-    real_by_k = {r['k']: r for r in real1 if 'k' in r}
-
-    ks = sorted(set(sitl_by_k.keys()) & set(hitl_by_k.keys()) & set(real_by_k.keys()))
-
-    par = 2
-
-    sitl_pos_diffs = [[], [], []]
-    sitl_att_diffs = [[], [], []]
-    hitl_pos_diffs = [[], [], []]
-    hitl_att_diffs = [[], [], []]
-
-    sitl_pos_norm_diffs = []
-    sitl_att_norm_diffs = []
-    hitl_pos_norm_diffs = []
-    hitl_att_norm_diffs = []
-
-    for k in ks:
-        s = sitl_by_k[k]
-        h = hitl_by_k[k]
-        r = real_by_k[k]
-        s_pos = pad3(s.get("pos", [0,0,0]))
-        h_pos = pad3(h.get("pos", [0,0,0]))
-        r_pos = pad3(r.get("pos", [0,0,0]))
-        s_att = pad3(s.get("att_deg", [0,0,0]))
-        h_att = pad3(h.get("att_deg", [0,0,0]))
-        r_att = pad3(r.get("att_deg", [0,0,0]))
-        for i in range(3):
-            s_val = get_first_number(s_pos[i])
-            r_val = get_first_number(r_pos[i])
-            h_val = get_first_number(h_pos[i])
-            sitl_pos_diffs[i].append(s_val - r_val)
-            hitl_pos_diffs[i].append(h_val - r_val)
-            s_att_val = get_first_number(s_att[i])
-            r_att_val = get_first_number(r_att[i])
-            h_att_val = get_first_number(h_att[i])
-            sitl_att_diffs[i].append(s_att_val - r_att_val)
-            hitl_att_diffs[i].append(h_att_val - r_att_val)
-        sitl_pos_norm_diffs.append(norm3(s_pos) - norm3(r_pos))
-        sitl_att_norm_diffs.append(norm3(s_att) - norm3(r_att))
-        hitl_pos_norm_diffs.append(norm3(h_pos) - norm3(r_pos))
-        hitl_att_norm_diffs.append(norm3(h_att) - norm3(r_att))
-
-    for name, diffs in [
-        ("SITL pos", sitl_pos_diffs),
-        ("SITL att", sitl_att_diffs),
-        ("HITL pos", hitl_pos_diffs),
-        ("HITL att", hitl_att_diffs)
-    ]:
-        axes_name = ['x', 'y', 'z'] if 'pos' in name else ['roll', 'pitch', 'yaw']
+            print(f"{name}: RMS={st['rms']:.4f}({unit}), mean={st['mean']:.4f}, max={st['max']:.4f}, min={st['min']:.4f}, percent |error| < {par}*RMS: {st['percent']:.2f}%")
+
+def plot_diffs(diffs, par=2, save_dir=None, tag=""):
+    """
+    绘制逐轴误差随 k 的变化
+    save_dir: 为 None 时 plt.show() 交互显示；否则保存为 png 后关闭（无界面批量运行）
+    tag: 保存文件名前缀
+    """
+    for name, d in diffs.items():
+        axes_name = STAT_AXES[name.split()[1]]
         fig, axes = plt.subplots(3, 1, figsize=(10, 10), sharex=True)
+        rms_all = rms(d)
         for i, axis in enumerate(axes_name):
-            vals = diffs[i]
-            rms_val = rms(vals)
-            percent = comp_percent(vals, rms_val, par)
-            unit = "m" if 'pos' in name else "deg"
-            mean_val = np.mean(vals)
-            max_val = np.max(vals)
-            min_val = np.min(vals)
-            print(f"{name} {axis}: RMS={rms_val:.4f}({unit}), mean={mean_val:.4f}, max={max_val:.4f}, min={min_val:.4f}, percent |error| < {par}*RMS: {percent:.2f}%")
-
+            vals = d[:, i]
+            rms_val = rms_all[i]
             k_idx = np.arange(len(vals))
             axes[i].plot(k_idx, vals, 'o', label="Error")
             axes[i].axhline(par*rms_val, color='r', linestyle='--', label=f"+{par}×RMS" if i==0 else None)
             axes[i].axhline(-par*rms_val, color='r', linestyle='--')
             axes[i].axhline(0, color='k', linestyle='-', linewidth=0.8)
             axes[i].set_ylabel(f"{axis} Error")
-            axes[i].set_title(f"{name} {axis} error vs k")
+            axes[i].set_title(f"{tag} {name} {axis} error vs k".strip())
             axes[i].grid(True, linestyle="--", alpha=0.5)
             if i == 0:
                 axes[i].legend()
         axes[-1].set_xlabel("k (step index)")
         plt.tight_layout()
-        plt.show()
-
-    for name, diffs, unit in [
-        ("SITL pos norm", sitl_pos_norm_diffs, "m"),
-        ("SITL att norm", sitl_att_norm_diffs, "deg"),
-        ("HITL pos norm", hitl_pos_norm_diffs, "m"),
-        ("HITL att norm", hitl_att_norm_diffs, "deg"),
-    ]:
-        rms_val = rms(diffs)
-        percent = comp_percent(diffs, rms_val, par)
-        print(f"{name}: RMS={rms_val:.4f}({unit}), percent |error| < {par}*RMS: {percent:.2f}%")
-
-    rms_names, rms_values = [], []
-    percent_names, percent_values = [], []
-
-    stat_items = [
-        ("SITL pos x", sitl_pos_diffs[0]),
-        ("SITL pos y", sitl_pos_diffs[1]),
-        ("SITL pos z", sitl_pos_diffs[2]),
-        ("SITL att roll", sitl_att_diffs[0]),
-        ("SITL att pitch", sitl_att_diffs[1]),
-        ("SITL att yaw", sitl_att_diffs[2]),
-        ("HITL pos x", hitl_pos_diffs[0]),
-        ("HITL pos y", hitl_pos_diffs[1]),
-        ("HITL pos z", hitl_pos_diffs[2]),
-        ("HITL att roll", hitl_att_diffs[0]),
-        ("HITL att pitch", hitl_att_diffs[1]),
-        ("HITL att yaw", hitl_att_diffs[2]),
-    ]
-    for name, diffs in stat_items:
-        rms_val = rms(diffs)
-        percent = comp_percent(diffs, rms_val, par)
-        rms_names.append(f"{name} RMS")
-        percent_names.append(f"{name} percent")
-        rms_values.append(rms_val)
-        percent_values.append(percent)
-
-    norm_items = [
-        ("SITL pos norm", sitl_pos_norm_diffs),
-        ("SITL att norm", sitl_att_norm_diffs),
-        ("HITL pos norm", hitl_pos_norm_diffs),
-        ("HITL att norm", hitl_att_norm_diffs),
-    ]
-    for name, diffs in norm_items:
-        rms_val = rms(diffs)
-        percent = comp_percent(diffs, rms_val, par)
-        rms_names.append(f"{name} RMS")
-        percent_names.append(f"{name} percent")
-        rms_values.append(rms_val)
-        percent_values.append(percent)
-
-    stat_names = rms_names + percent_names
-    stat_values = rms_values + percent_values
+        if save_dir is None:
+            plt.show()
+        else:
+            fig.savefig(os.path.join(save_dir, f"{tag}_{name.replace(' ', '_')}.png".lstrip("_")))
+            plt.close(fig)
 
-    # 保存到Excel
-    import os
-    excel_file = "result.xlsx"
-    
-    col_idx = group_idx + 1  # C列为第一组，D列为第二组...
+def _column_key(col):
+    """
+    报表列按前缀、组号自然排序（group2 在 group10 之前）
+    """
+    m = re.match(r"^(.*?)(\d+)$", str(col))
+    return (m.group(1), int(m.group(2))) if m else (str(col), -1)
 
+def write_report(columns, excel_file=EXCEL_FILE):
+    """
+    把多组统计结果合并进 Excel 报表，只读写一次文件
+    columns: {列名: (stat_names, stat_values)}，同名列覆盖，其余列保留
+    """
+    if not columns:
+        return
+    stat_names = next(iter(columns.values()))[0]
     if os.path.exists(excel_file):
         df = pd.read_excel(excel_file, index_col=0)
     else:
         df = pd.DataFrame(index=stat_names)
-        df.index.name = "统计项"
     df = df.reindex(stat_names)
-    while df.shape[1] < col_idx:
-        df.insert(df.shape[1], f"group{df.shape[1]}", "")
-    df.iloc[:, col_idx-1] = stat_values
+    df.index.name = "统计项"
+    for col, (names, values) in columns.items():
+        df[col] = pd.Series(values, index=names, dtype=float)
+    df = df[sorted(df.columns, key=_column_key)]
     df.to_excel(excel_file)
 
+def discover_groups(log_dir):
+    """
+    在日志目录中查找所有完整的 sitl/hitl/lidar 三元组
+    同一组有多种格式时优先 .fcb，其次 .jsonl、.json
+    return: {列名: (sitl_path, hitl_path, real_path)}，按前缀和组号排序
+    """
+    found = {}
+    for fname in os.listdir(log_dir):
+        m = GROUP_RE.match(fname)
+        if not m:
+            continue
+        prefix, kind, n, ext = m.group(1), m.group(2), int(m.group(3)), m.group(4)
+        slot = found.setdefault((prefix, n), {})
+        old = slot.get(kind)
+        if old is None or EXT_PRIORITY[ext] < EXT_PRIORITY[old[1]]:
+            slot[kind] = (os.path.join(log_dir, fname), ext)
+    prefixes = {prefix for prefix, _ in found}
+    groups = {}
+    for (prefix, n), slot in sorted(found.items()):
+        if len(slot) < 3:
+            continue
+        col = f"group{n}" if len(prefixes) == 1 else f"{prefix}_group{n}"
+        groups[col] = (slot["sitl"][0], slot["hitl"][0], slot["lidar"][0])
+    return groups
+
+def evaluate_group(col, paths, par=2, plot_dir=None):
+    """
+    评估一组数据（可在子进程中运行）
+    return: (col, summary, 对齐后的样本数)
+    """
+    ks, diffs, norm_diffs = compute_diffs(*paths)
+    summary = group_summary(diffs, norm_diffs, par)
+    if plot_dir is not None:
+        plot_diffs(diffs, par, save_dir=plot_dir, tag=col)
+    return col, summary, len(ks)
+
+def _init_worker():
+    plt.switch_backend("Agg")
+
+def run_batch(log_dir, excel_file=EXCEL_FILE, par=2, workers=None, plot_dir=None, cache=None):
+    """
+    批量评估日志目录中的所有组：各组在进程池中并行计算，最后一次性写入报表
+    plot_dir: 不为 None 时在子进程中无界面渲染误差图并保存到该目录
+    cache: ResultCache，命中的组直接使用缓存结果（不再重新画图），只计算新增或改动的组
+    某组日志缺失或损坏时打印异常并跳过该组，其余组照常写入报表
+    return: 失败的组 {列名: 异常信息}
+    """
+    groups = discover_groups(log_dir)
+    print(f"found {len(groups)} groups in {log_dir}")
+    if plot_dir is not None:
+        os.makedirs(plot_dir, exist_ok=True)
+    columns = {}
+    keys = {}
+    todo = {}
+    for col, paths in groups.items():
+        if cache is not None:
+            keys[col] = cache.make_key(paths, kind="consistency", par=par)
+            hit = cache.get(keys[col])
+            if hit is not None:
+                columns[col] = group_stats(hit["summary"])
+                continue
+        todo[col] = paths
+    print(f"cached {len(columns)}, computing {len(todo)}")
+    failed = {}
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = {col: pool.submit(evaluate_group, col, paths, par, plot_dir) for col, paths in todo.items()}
+            for col, fut in futures.items():
+                try:
+                    _, summary, n = fut.result()
+                except Exception as e:
+                    failed[col] = repr(e)
+                    print(f"[error] {col}: {todo[col]}")
+                    traceback.print_exc()
+                    continue
+                columns[col] = group_stats(summary)
+                if cache is not None:
+                    cache.put(keys[col], {"summary": summary, "n": n})
+                print(f"{col}: {n} samples")
+    write_report(columns, excel_file)
+    print(f"[saved] {len(columns)} groups -> {excel_file}")
+    if failed:
+        print(f"[failed] {len(failed)} groups:")
+        for col, err in sorted(failed.items(), key=lambda item: _column_key(item[0])):
+            print(f"  {col}: {err}")
+    return failed
+
+def main(excel_file=EXCEL_FILE, par=2, show_plot=True, cache=None):
+    paths = (sitl1_JSON, hitl1_JSON, real1_JSON)
+    summary = None
+    # 需要画图时必须读取原始日志，只有不画图时才直接用缓存
+    if cache is not None:
+        key = cache.make_key(paths, kind="consistency", par=par)
+        if not show_plot:
+            hit = cache.get(key)
+            summary = hit["summary"] if hit is not None else None
+    if summary is None:
+        ks, diffs, norm_diffs = compute_diffs(*paths)
+        summary = group_summary(diffs, norm_diffs, par)
+        if cache is not None:
+            cache.put(key, {"summary": summary, "n": len(ks)})
+    print_stats(summary, par)
+    if show_plot:
+        plot_diffs(diffs, par)
+
+    # 保存到Excel
+    write_report({f"group{group_idx}": group_stats(summary)}, excel_file)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="SITL/HITL 与真机一致性评估")
+    parser.add_argument("--batch", metavar="LOG_DIR", help="批量评估目录中的全部 FC_*_sitl{n}/hitl{n}/lidar{n} 组")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认 CPU 核数")
+    parser.add_argument("--plot-dir", default=None, help="批量模式下把误差图保存到该目录（不指定则不画图）")
+    parser.add_argument("--no-plot", action="store_true", help="单组模式下不显示误差图")
+    parser.add_argument("--excel", default=EXCEL_FILE, help="报表文件")
+    parser.add_argument("--par", type=float, default=2, help="percent 统计阈值 |e| < par*RMS")
+    parser.add_argument("--cache-dir", default=ResultCache.DEFAULT_DIR, help="结果缓存目录")
+    parser.add_argument("--no-cache", action="store_true", help="不使用结果缓存")
+    args = parser.parse_args()
+    cache = None if args.no_cache else ResultCache.ResultCache(args.cache_dir)
+    if args.batch:
+        run_batch(args.batch, args.excel, args.par, args.workers, args.plot_dir, cache)
+    else:
+        main(args.excel, args.par, not args.no_plot, cache)
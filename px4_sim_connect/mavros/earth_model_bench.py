@@ -0,0 +1,76 @@
+import time
+import argparse
+import numpy as np
+import EarthModel
+
+TOL_MM = 1.0 # 精度要求：往返位置误差 < 1 mm
+HEIGHTS = [-500.0, 0.0, 50.0, 1000.0, 10000.0, 100000.0] # 测试高度（米）
+
+geo = EarthModel.EarthModel()
+
+def global_grid(step_deg):
+    """
+    生成全球网格点 (lat, lon, h)，纬度避开极点奇异处
+    """
+    lats = np.arange(-89.5, 89.5 + 1e-9, step_deg)
+    lons = np.arange(-180.0, 180.0, step_deg)
+    lat, lon, h = np.meshgrid(lats, lons, HEIGHTS, indexing="ij")
+    return np.column_stack((lat.ravel(), lon.ravel(), h.ravel()))
+
+def scalar_method(fn):
+    """
+    把标量接口包装成 (N,3) -> (N,3)
+    """
+    return lambda ecef: np.array([fn(x, y, z) for x, y, z in ecef.tolist()])
+
+def roundtrip_error_mm(lla_est, ecef):
+    """
+    把反算的 LLA 再转回 ECEF，与原 ECEF 的距离即为该方法的位置误差
+    """
+    return np.linalg.norm(geo.lla2ecef_batch(lla_est) - ecef, axis=1) * 1000.0
+
+def run(step_deg, scalar_n, repeat):
+    lla = global_grid(step_deg)
+    ecef = geo.lla2ecef_batch(lla)
+    methods = [
+        ("ferrari scalar", scalar_method(geo.ecef2lla), True),
+        ("bowring1 scalar", scalar_method(lambda x, y, z: geo.ecef2lla_bowring(x, y, z, 1)), True),
+        ("bowring2 scalar", scalar_method(lambda x, y, z: geo.ecef2lla_bowring(x, y, z, 2)), True),
+        ("ferrari batch", lambda e: geo.ecef2lla_batch(e, "ferrari"), False),
+        ("bowring1 batch", lambda e: geo.ecef2lla_batch(e, "bowring", 1), False),
+        ("bowring2 batch", lambda e: geo.ecef2lla_batch(e, "bowring", 2), False),
+    ]
+    print(f"grid: {len(lla)} points (step {step_deg} deg, heights {HEIGHTS}), tolerance {TOL_MM} mm")
+    print(f"{'method':<16} {'max(mm)':>10} {'p99(mm)':>10} {'max |dh|(mm)':>13} {'Mpts/s':>8}  result")
+    results = []
+    for name, fn, is_scalar in methods:
+        # 精度在全网格上评估；标量接口只取前 scalar_n 个点计时
+        out = fn(ecef)
+        err = roundtrip_error_mm(out, ecef)
+        dh = np.abs(out[:, 2] - lla[:, 2]) * 1000.0
+        sample = ecef[:scalar_n] if is_scalar else ecef
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn(sample)
+            best = min(best, time.perf_counter() - t0)
+        rate = len(sample) / best / 1e6
+        ok = err.max() < TOL_MM
+        results.append((name, rate, ok))
+        print(f"{name:<16} {err.max():>10.4g} {np.percentile(err, 99):>10.4g} {dh.max():>13.4g} {rate:>8.3f}  {'PASS' if ok else 'FAIL'}")
+    passed = [r for r in results if r[2]]
+    if passed:
+        best_name, best_rate, _ = max(passed, key=lambda r: r[1])
+        print(f"fastest within {TOL_MM} mm: {best_name} ({best_rate:.3f} Mpts/s)")
+    else:
+        print(f"no method meets {TOL_MM} mm")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ecef2lla 各方法的精度与吞吐对比")
+    parser.add_argument("--step", type=float, default=1.0, help="网格步长（度）")
+    parser.add_argument("--scalar-n", type=int, default=20000, help="标量接口计时的点数")
+    parser.add_argument("--repeat", type=int, default=3, help="计时重复次数，取最快一次")
+    parser.add_argument("--tol-mm", type=float, default=TOL_MM, help="精度要求（毫米）")
+    args = parser.parse_args()
+    TOL_MM = args.tol_mm
+    run(args.step, args.scalar_n, args.repeat)
@@ -1,68 +1,403 @@
 import time
 import math
-import json
 import socket
-import select
-import UE4CtrlAPI as UE4CtrlAPI
+import asyncio
+import argparse
+import TwinLatency
+import TwinProtocol
 
 UE_REQ_TYPE = 1
-UE_TARGET_ID = 1
+UE_TARGET_IDS = [1] # 启动时预先请求的车辆；之后出现的新车辆自动请求
+UE_VEHICLE_TYPE = 3
 
 LISTEN_IP = "0.0.0.0"
-LISTEN_PORT = 16520
-
-ue = UE4CtrlAPI.UE4CtrlAPI()
-ue.reqCamCoptObj(UE_REQ_TYPE, [UE_TARGET_ID])
-time.sleep(1.0)
-ue.initUE4MsgRec()
-time.sleep(1.0)
-
-sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-sock.bind((LISTEN_IP, LISTEN_PORT))
-sock.setblocking(False)
-
-print(f"[UDP] listening on {LISTEN_IP}:{LISTEN_PORT} ...")
-
-running = True
-started = False
-
-delays = []
-
-try:
-    while running:
-        r, _, _ = select.select([sock], [], [], 0.2)
-        if not r:
-            continue
-
-        data, _addr = sock.recvfrom(8192)
-        msg = json.loads(data.decode("utf-8"))
-        ts = msg.get("ts", None)
-        if ts is not None:
-            delay = time.time() - ts
-            delays.append(delay)
-            print(f"Delay: {delay*1000:.1f} ms,msg:{msg},time:{time.time()}")
-        
-        target = msg.get("pos", [0.0, 0.0, 0.0])
-        posE = target[:3]
-        angEuler = msg.get("att_deg", [0.0, 0.0, 0.0])
-        yaw_conv = math.radians(angEuler[2])
-        yaw_origin = -(yaw_conv - math.pi / 2)
-        angEuler[2] = math.degrees(yaw_origin)
-
-        ue.sendUE4PosNew(
-            copterID=UE_TARGET_ID,
-            vehicleType=3,
-            PosE=posE,
-            AngEuler=angEuler,
-            PWMs=[1000]*8,
-            windowID=-1
+LISTEN_PORTS = [16520] # 可监听多个端口，不同端口的数据按车辆 ID 汇总
+RENDER_HZ = 50.0 # 每秒向 UE4 推送的帧数
+STATS_S = 5.0 # 统计打印间隔
+RX_QUEUE = 8192 # 接收队列容量，满时丢弃最旧的数据报
+OUT_QUEUE = 2 # 输出队列容量（帧），UE4 发送跟不上时跳过该帧，已更新的车辆留到下一帧
+DRAIN_MAX = 4096 # 转换阶段每次最多连续处理的数据报数，处理完让出事件循环
+RCVBUF_BYTES = 4 * 1024 * 1024 # 套接字接收缓冲区大小
+PING_S = 1.0 # 向各发送端发PING估计时钟偏差的间隔
+LATENCY_LOG = None # 时延统计导出文件（JSON Lines），None表示不导出
+LATENCY_EVERY = 10.0 # 导出间隔（秒）
+
+
+class TwinVehicle:
+    """
+    单个车辆的最新状态：两帧之间收到的多个包只保留最新一个
+    """
+    __slots__ = ("vid", "seq", "stamp", "posE", "angEuler", "t_wall", "t_recv", "dirty", "pushed",
+                 "addr", "transport", "clock")
+
+    def __init__(self, vid):
+        self.vid = vid
+        self.seq = TwinProtocol.SeqTracker()
+        self.stamp = None # 最新样本的发送时刻，用于没有序号的JSON报文
+        self.posE = None # 已转换为 UE4 输入的位置和姿态
+        self.angEuler = None
+        self.t_wall = None
+        self.t_recv = None # 最新样本的接收时刻（time.monotonic()）
+        self.dirty = False
+        self.pushed = 0
+        self.addr = None # 发送端地址及收到报文的套接字，用于发PING
+        self.transport = None
+        self.clock = TwinLatency.ClockOffset() # 发送端时钟相对本机的偏差
+
+    def restart(self):
+        """
+        发送端重启（新的 HELLO 或源地址变化）：序号和时间戳从头比较，时钟偏差重新估计
+        """
+        self.seq.reset()
+        self.stamp = None
+        self.clock = TwinLatency.ClockOffset()
+
+
+class StubUE4:
+    """
+    无 UE4 时（--headless）代替 UE4CtrlAPI 的本地替身，只统计调用次数，用于在 Linux 上测试转发吞吐和时延
+    """
+    def __init__(self):
+        self.sent = 0
+        self.requested = set()
+
+    def reqCamCoptObj(self, reqType, copterIDs):
+        self.requested.update(copterIDs)
+
+    def initUE4MsgRec(self):
+        pass
+
+    def sendUE4PosNew(self, copterID, vehicleType, PosE, AngEuler, PWMs, windowID=-1):
+        self.sent += 1
+
+
+def to_ue(pos, att):
+    """
+    飞控侧的位置、姿态转换为 UE4 输入：偏航角由 ENU 航向转回 NED；报文缺少位置或姿态时按零处理
+    """
+    posE = list((pos or [0.0, 0.0, 0.0])[:3])
+    angEuler = list(att or [0.0, 0.0, 0.0])
+    yaw_conv = math.radians(angEuler[2])
+    yaw_origin = -(yaw_conv - math.pi / 2)
+    angEuler[2] = math.degrees(yaw_origin)
+    return posE, angEuler
+
+
+class RelayProtocol(asyncio.DatagramProtocol):
+    """
+    接收阶段：数据报连同接收时刻和来源放入接收队列，不做解析
+    """
+    def __init__(self, relay):
+        self.relay = relay
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.relay.receive(data, addr, self.transport)
+
+    def error_received(self, exc):
+        # Windows 上对端端口不可达（回复HELLO_ACK失败）会在这里报告，忽略即可
+        self.relay.stats["errors"] += 1
+
+
+class Relay:
+    """
+    三级转发：接收（RelayProtocol）→ 转换（解析、按车辆取最新、坐标转换）→ 输出（按帧推送 UE4）
+    各级之间用有界队列连接，任何一级跟不上时丢弃旧数据而不是积压
+    """
+    def __init__(self, ue, ip=LISTEN_IP, ports=LISTEN_PORTS, render_hz=RENDER_HZ, stats_s=STATS_S,
+                 latency_log=LATENCY_LOG, latency_every=LATENCY_EVERY):
+        self.ue = ue
+        self.ip = ip
+        self.ports = list(ports)
+        self.render_hz = render_hz
+        self.stats_s = stats_s
+        self.vehicles = {vid: TwinVehicle(vid) for vid in UE_TARGET_IDS}
+        self.new_vids = []
+        self.stats = {
+            "packets": 0, "coalesced": 0, "stale": 0, "rx_overflow": 0, "bad": 0, "errors": 0,
+            "frames": 0, "frames_skipped": 0, "pushed": 0, "max_batch": 0, "max_rx_depth": 0,
+            "pings": 0, "pongs": 0,
+        }
+        # raw：收到时刻 - 发送端时间戳（含两端时钟偏差）；oneway：按PING/PONG估计的偏差校正后的单向时延；
+        # relay：收到到推送给 UE4 的转发时延
+        self.latency = {name: TwinLatency.LatencyHistogram() for name in ("raw", "oneway", "relay")}
+        self.exporter = TwinLatency.LatencyExporter(latency_log, latency_every)
+        self.rx = None
+        self.out = None
+        self.transports = []
+        self._stop = None
+        self._t_start = time.monotonic()
+
+    def receive(self, data, addr, transport):
+        item = (time.monotonic(), time.time(), data, addr, transport)
+        try:
+            self.rx.put_nowait(item)
+        except asyncio.QueueFull:
+            self.rx.get_nowait()
+            self.rx.put_nowait(item)
+            self.stats["rx_overflow"] += 1
+        depth = self.rx.qsize()
+        if depth > self.stats["max_rx_depth"]:
+            self.stats["max_rx_depth"] = depth
+
+    def handle(self, t_recv, t_recv_wall, data, addr, transport):
+        """
+        解码一个数据报并更新对应车辆的最新状态
+        """
+        stats = self.stats
+        pkt = TwinProtocol.decode(data, UE_TARGET_IDS[0])
+        if pkt is None:
+            stats["bad"] += 1
+            return
+        if TwinProtocol.answer_hello(pkt, transport, addr):
+            v = self.vehicles.get(pkt.vehicle)
+            if v is not None and v.addr is not None:
+                v.restart()
+            return
+        if pkt.kind == TwinProtocol.KIND_PONG:
+            v = self.vehicles.get(pkt.vehicle)
+            if v is not None:
+                v.clock.add(pkt.echo[0], pkt.echo[1], pkt.t_wall, t_recv_wall)
+                stats["pongs"] += 1
+            return
+        v = self.vehicles.get(pkt.vehicle)
+        if v is None:
+            v = self.vehicles[pkt.vehicle] = TwinVehicle(pkt.vehicle)
+            self.new_vids.append(pkt.vehicle)
+        elif v.addr is not None and addr != v.addr and pkt.kind in (TwinProtocol.KIND_STATE, TwinProtocol.KIND_START):
+            v.restart() # 发送端换了套接字，多半是重新启动，序号会从头开始
+            v.addr = addr
+        newest = v.seq.update(pkt.seq)
+        if pkt.kind != TwinProtocol.KIND_STATE:
+            return
+        stamp = pkt.t_mono if pkt.t_mono is not None else pkt.t_wall
+        if pkt.seq is None and stamp is not None and v.stamp is not None and stamp <= v.stamp:
+            newest = False
+        if not newest:
+            stats["stale"] += 1 # 比已收到的样本旧，直接丢弃
+            return
+        stats["packets"] += 1
+        v.addr = addr
+        v.transport = transport
+        if pkt.t_wall is not None:
+            self.latency["raw"].record(t_recv_wall - pkt.t_wall)
+            if v.clock.offset is not None:
+                self.latency["oneway"].record(t_recv_wall - v.clock.to_local(pkt.t_wall))
+        if v.dirty:
+            stats["coalesced"] += 1 # 上一个包还没推送就被覆盖
+        v.posE, v.angEuler = to_ue(pkt.pos, pkt.att)
+        v.t_wall = pkt.t_wall
+        v.t_recv = t_recv
+        v.stamp = stamp
+        v.dirty = True
+
+    async def transform(self):
+        """
+        转换阶段：每次取出接收队列中积压的全部数据报（最多DRAIN_MAX个）
+        """
+        rx = self.rx
+        while True:
+            batch = [await rx.get()]
+            while len(batch) < DRAIN_MAX and not rx.empty():
+                batch.append(rx.get_nowait())
+            if len(batch) > self.stats["max_batch"]:
+                self.stats["max_batch"] = len(batch)
+            for item in batch:
+                try:
+                    self.handle(*item)
+                except Exception:
+                    self.stats["bad"] += 1 # 单个畸形报文不能让转换阶段退出
+
+    async def frames(self):
+        """
+        按render_hz的截止时刻生成帧：收集有更新的车辆放入输出队列
+        """
+        loop = asyncio.get_running_loop()
+        frame_dt = 1.0 / self.render_hz
+        next_frame = loop.time() + frame_dt
+        while True:
+            await asyncio.sleep(max(0.0, next_frame - loop.time()))
+            now = loop.time()
+            # 截止时刻按帧周期累加；落后超过一帧时直接对齐到当前时刻
+            next_frame += frame_dt
+            if next_frame < now:
+                next_frame = now + frame_dt
+            if self.out.full():
+                self.stats["frames_skipped"] += 1
+                continue
+            frame = []
+            for v in self.vehicles.values():
+                if v.dirty:
+                    frame.append((v.vid, v.posE, v.angEuler, v.t_recv))
+                    v.dirty = False
+                    v.pushed += 1
+            new_vids, self.new_vids = self.new_vids, []
+            self.out.put_nowait((new_vids, frame))
+
+    async def output(self):
+        """
+        输出阶段：一帧内依次推送所有有更新的车辆
+        """
+        ue = self.ue
+        stats = self.stats
+        relay = self.latency["relay"]
+        while True:
+            new_vids, frame = await self.out.get()
+            if new_vids:
+                ue.reqCamCoptObj(UE_REQ_TYPE, new_vids)
+            for vid, posE, angEuler, _ in frame:
+                ue.sendUE4PosNew(
+                    copterID=vid,
+                    vehicleType=UE_VEHICLE_TYPE,
+                    PosE=posE,
+                    AngEuler=angEuler,
+                    PWMs=[1000]*8,
+                    windowID=-1
+                )
+            now = time.monotonic()
+            for _, _, _, t_recv in frame:
+                relay.record(now - t_recv)
+            stats["pushed"] += len(frame)
+            stats["frames"] += 1
+            self.out.task_done()
+
+    async def pinger(self):
+        """
+        每PING_S秒向每个发送端发一次PING，回复的PONG在转换阶段处理
+        """
+        seq = 0
+        while True:
+            await asyncio.sleep(PING_S)
+            for v in self.vehicles.values():
+                if v.addr is None or v.transport.is_closing():
+                    continue
+                seq += 1
+                v.transport.sendto(TwinProtocol.encode_ping(v.vid, seq), v.addr)
+                self.stats["pings"] += 1
+
+    def snapshot(self):
+        """
+        导出用的统计快照：各直方图的完整内容和摘要、各车辆的时钟偏差、计数
+        """
+        return {
+            "histograms": {name: h.to_dict() for name, h in self.latency.items()},
+            "summary": {name: h.summary() for name, h in self.latency.items()},
+            "clock": {
+                str(v.vid): {"offset_ms": v.clock.offset * 1e3, "rtt_ms": v.clock.rtt * 1e3}
+                for v in self.vehicles.values() if v.clock.offset is not None
+            },
+            "stats": dict(self.stats),
+        }
+
+    def format_stats(self):
+        s = self.stats
+        elapsed = max(time.monotonic() - self._t_start, 1e-9)
+        seq = [v.seq for v in self.vehicles.values()]
+        synced = [v.clock for v in self.vehicles.values() if v.clock.offset is not None]
+        clock = (
+            f"clock offset {min(c.offset for c in synced) * 1e3:+.2f}..{max(c.offset for c in synced) * 1e3:+.2f} ms "
+            f"(rtt max {max(c.rtt for c in synced) * 1e3:.2f} ms, {len(synced)} synced)"
+            if synced else "clock offset unknown"
+        )
+        return (
+            f"[relay] vehicles={len(self.vehicles)} packets={s['packets']} ({s['packets'] / elapsed:.0f}/s) "
+            f"frames={s['frames']} ({s['frames'] / elapsed:.1f}/s) skipped={s['frames_skipped']} "
+            f"dropped: coalesced={s['coalesced']} stale={s['stale']} overflow={s['rx_overflow']} "
+            f"lost={sum(t.lost for t in seq)} reordered={sum(t.reordered for t in seq)} bad={s['bad']} "
+            f"restarts={sum(t.restarts for t in seq)} "
+            f"max batch={s['max_batch']} max rx depth={s['max_rx_depth']}\n"
+            f"        one-way {self.latency['oneway'].format()} | raw {self.latency['raw'].format()}\n"
+            f"        relay {self.latency['relay'].format()} | {clock}"
         )
 
-except KeyboardInterrupt:
-    print("中断接收，退出程序。")
+    async def report(self):
+        while True:
+            await asyncio.sleep(self.stats_s)
+            print(self.format_stats())
+            self.exporter.maybe_export(self.snapshot)
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+
+    async def run(self, duration=None):
+        """
+        运行转发，直到stop()被调用、收到SIGINT/SIGTERM或经过duration秒
+        """
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self.rx = asyncio.Queue(RX_QUEUE)
+        self.out = asyncio.Queue(OUT_QUEUE)
+        for port in self.ports:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF_BYTES)
+            sock.bind((self.ip, port))
+            transport, _ = await loop.create_datagram_endpoint(lambda: RelayProtocol(self), sock=sock)
+            self.transports.append(transport)
+        print(f"[UDP] listening on {self.ip}:{self.ports} ...")
+        try:
+            import signal
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, self.stop)
+        except (ImportError, NotImplementedError):
+            pass # Windows 事件循环不支持，由 KeyboardInterrupt 结束
+
+        self._t_start = time.monotonic()
+        workers = [asyncio.ensure_future(c) for c in (self.transform(), self.frames(), self.report(), self.pinger())]
+        sink = asyncio.ensure_future(self.output())
+        try:
+            await asyncio.wait_for(self._stop.wait(), duration)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # 先停止接收，再停止转换和生成帧，等已生成的帧推送完后停止输出
+            for transport in self.transports:
+                transport.close()
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            try:
+                await asyncio.wait_for(self.out.join(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+            sink.cancel()
+            await asyncio.gather(sink, return_exceptions=True)
+            print(self.format_stats())
+            self.exporter.maybe_export(self.snapshot, force=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数字孪生转发：飞控 UDP 遥测 → UE4")
+    parser.add_argument("--headless", action="store_true", help="不连接 UE4，使用本地替身（测试吞吐/时延）")
+    parser.add_argument("--ports", type=int, nargs="+", default=LISTEN_PORTS, help="监听端口")
+    parser.add_argument("--render-hz", type=float, default=RENDER_HZ, help="每秒推送帧数")
+    parser.add_argument("--stats", type=float, default=STATS_S, help="统计打印间隔（秒）")
+    parser.add_argument("--latency-log", default=LATENCY_LOG, help="时延统计导出文件（JSON Lines）")
+    parser.add_argument("--latency-every", type=float, default=LATENCY_EVERY, help="导出间隔（秒）")
+    parser.add_argument("--duration", type=float, default=None, help="运行时长（秒），默认一直运行")
+    args = parser.parse_args()
+
+    if args.headless:
+        ue = StubUE4()
+    else:
+        import UE4CtrlAPI as UE4CtrlAPI
+        ue = UE4CtrlAPI.UE4CtrlAPI()
+        ue.reqCamCoptObj(UE_REQ_TYPE, UE_TARGET_IDS)
+        time.sleep(1.0)
+        ue.initUE4MsgRec()
+        time.sleep(1.0)
+
+    relay = Relay(ue, LISTEN_IP, args.ports, args.render_hz, args.stats, args.latency_log, args.latency_every)
+    try:
+        asyncio.run(relay.run(args.duration))
+    except KeyboardInterrupt:
+        print("中断接收，退出程序。")
+    if args.headless:
+        print(f"[headless] sendUE4PosNew calls: {ue.sent}, vehicles requested: {len(ue.requested)}")
+
 
-if delays:
-    avg_delay = sum(delays) / len(delays)
-    print(f"平均时延: {avg_delay*1000:.1f} ms")
-else:
-    print("没有统计到时延数据")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
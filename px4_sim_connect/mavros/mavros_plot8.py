@@ -1,20 +1,30 @@
-import PX4MavCtrlV4ROS as PX4MavCtrl
+import FlyLog
+import TickScheduler
+import MissionEngine
+import Trajectory
+import TwinProtocol
+import StateBus
 import time
-import math
 import socket
-import json
 import os
 from datetime import datetime
 
 TARGET_UDP_IP = "127.0.0.1" # WSL
 # TARGET_UDP_IP = "192.168.3.20" # UBUNTU
 TARGET_UDP_PORT = 16520
+TWIN_MODE = "auto" # 孪生链路编码："auto" 协商（失败回退 JSON），"binary"，"json"
 LOG_DIR = r"/mnt/d/code/NIMTE/rflysim/flylog" # WSL
 # LOG_DIR = os.path.expanduser("~/rsim_ws/log") # UBUNTU
-SAVE_EVERY_S = 5.0
+SAVE_EVERY_S = 5.0 # fsync 间隔
+LOG_EXT = ".fcb" # 日志格式：".fcb" 列式二进制，".jsonl" JSON Lines
+STALE_S = 0.1 # 位姿快照超过该时间未更新视为过期
+STATE_BUS = StateBus.BUS_NAME # 共享内存状态总线名，本机其他进程用 StateBus.StateBusReader 读取；None 表示不发布
+BACKEND = "mavros" # 通信后端："mavros" 经 mavros 的 ROS 话题；"direct" 直连 MAVLink（PX4MavDirect，不需要 ROS 和 mavros）
 
 DT = 0.02 # 发送间隔 1/HZ
-k = 0
+OVERRUN = "skip" # 单拍超时策略："skip" 丢弃错过的拍，"compress" 连续补发
+SPIN_S = 0.0005 # 截止前最后 SPIN_S 秒忙等
+FEEDFORWARD = True # True: 位置+速度+加速度前馈；False: 仅位置
 parameter_a = 3.0 # 北向半径
 parameter_b = 2.0 # 东向半径
 circle_times = 30.0 # 单圈时间
@@ -23,38 +33,39 @@ height_z = -1.5 # 高度
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
-mav = PX4MavCtrl.PX4MavCtrler() 
+bus = StateBus.StateBusWriter(STATE_BUS) if STATE_BUS else None
+if BACKEND == "direct":
+    import PX4MavDirect
+    mav = PX4MavDirect.PX4MavDirect(stateStore=bus)
+else:
+    import PX4MavCtrlV4ROS as PX4MavCtrl
+    mav = PX4MavCtrl.PX4MavCtrler(stateStore=bus)
+twin = TwinProtocol.TwinSender(sock, (TARGET_UDP_IP, TARGET_UDP_PORT), vehicle=mav.CopterID, mode=TWIN_MODE)
+sched = TickScheduler.TickScheduler(DT, overrun=OVERRUN, spin_s=SPIN_S) # 所有飞行阶段共用
 time.sleep(1)
 
 os.makedirs(LOG_DIR, exist_ok=True)
 tag = datetime.now().strftime("%Y%m%d_%H%M%S") # 最后手动命名格式为 %Y%m%d_sitl{group_idx}
-fc_path = os.path.join(LOG_DIR, f"FC_{tag}.json")
-fc_log = []
-_last_save = time.time()
+total_time = circle_times * laps
+# 整条八字轨迹一次算好，飞行中按拍号取行；参数写入日志头，分析端据此重新生成 target
+figure8 = Trajectory.figure8(parameter_a, parameter_b, circle_times, height_z, DT, total_time + DT)
+fc_path = os.path.join(LOG_DIR, f"FC_{tag}{LOG_EXT}")
+fc_log = FlyLog.StreamLogWriter(
+    fc_path, fsync_every_s=SAVE_EVERY_S,
+    meta={"tag": tag, "dt": DT, "trajectory": figure8.spec, "feedforward": FEEDFORWARD},
+    columns=("k", "dt", "t", "pos", "att_deg", "ts"),
+)
 
 def _flush_fc():
     """
-    保存日志
-    """
-    with open(fc_path, "w", encoding="utf-8") as f:
-        json.dump(fc_log, f, ensure_ascii=False, indent=2)
-    print(f"[saved] FC:{len(fc_log)} -> {fc_path}")
-
-def generate8(center_n, center_e, radius_a, radius_b, t, period):
-    """
-    生成八字轨迹点
-    :param center_n: 八字中心N坐标
-    :param center_e: 八字中心E坐标
-    :param radius_a: 八字N方向半径
-    :param radius_b: 八字E方向半径
-    :param t: 当前时刻（秒）
-    :param period: 单圈时间（秒）
-    :return: (n, e)
+    关闭流式日志（写完队列中剩余记录并 fsync）
     """
-    phase = (t % period) / period * 2 * math.pi
-    n = center_n + radius_a * math.sin(phase)
-    e = center_e + radius_b * math.cos(phase) * math.sin(phase)
-    return n, e
+    complete = fc_log.close()
+    print(f"[saved] FC:{fc_log.written} (dropped {fc_log.dropped}) -> {fc_path}")
+    if not complete:
+        print("[warn] FC log is incomplete")
+    if fc_log.error is not None:
+        print(f"[error] FC log write failed: {fc_log.error!r}")
 
 def SendRealPosNED(n, e, d, yaw):
     """
@@ -67,113 +78,101 @@ def SendRealPosNED(n, e, d, yaw):
     """
     mav.SendPosNED(e, -n, d, yaw)
 
-print("进入offboard并解锁")
-
-mav.initOffboard()
-time.sleep(5)
-spos= mav.uavPosNED[:]
-local_n = spos[0]
-local_e = spos[1]
-
-print("初始位置:", spos)
-print("发送起飞命令")
-SendRealPosNED(local_n, local_e, height_z + spos[2], 0)
-
-t_takeoff = 10.0
-for _ in range(int(t_takeoff / DT)):
-    ue_pos = mav.uavPosNED
-    ue_z = ue_pos[2] - spos[2]
-    msg = {
-        "pos": [ue_pos[0] - local_n, ue_pos[1] - local_e, ue_z],
-        "att_deg": mav.uavAngEular[:],
-        "ts": time.time(),
-    }
-    sock.sendto(json.dumps(msg).encode("utf-8"), (TARGET_UDP_IP, TARGET_UDP_PORT))
-    time.sleep(DT)
-
-sock.sendto(
-    json.dumps({"type": "start", "dt": DT, "ts": time.time()}).encode("utf-8"),
-    (TARGET_UDP_IP, TARGET_UDP_PORT)
-)
-
-print("PosE", mav.uavPosNED)
-print("VelE", mav.uavVelNED)
-print("Euler", mav.uavAngEular)
-print("Quaternion", mav.uavAngQuatern)
-print("Rate", mav.uavAngRate)
-
-print("Start control.")
-
-
-total_time = circle_times * laps
-center_n = local_n 
-center_e = local_e
-
-t0 = time.perf_counter()
-
-while (time.perf_counter() - t0) < total_time + DT:
-    t_cmd = k * DT
-
-    target_n, target_e = generate8(center_n, center_e, parameter_a, parameter_b, t_cmd, circle_times)
-    target_yaw = 0.0
-
-    SendRealPosNED(target_n, target_e, height_z + spos[2], target_yaw)
+def SendRealPosVelAccNED(n, e, d, yaw, vn=0.0, ve=0.0, vd=0.0, an=0.0, ae=0.0, ad=0.0):
+    """
+    发送真实位置+速度/加速度前馈指令，坐标换算与 SendRealPosNED 相同
+    :param n, e, d: 北东地位置
+    :param yaw: 偏航角
+    :param vn, ve, vd: 北东地速度前馈，定点表没有前馈列时为 0
+    :param an, ae, ad: 北东地加速度前馈
+    :return: None
+    """
+    mav.SendPosVelAccNED([e, -n, d], [ve, -vn, vd], [ae, -an, ad], yaw)
 
-    ue_pos = mav.uavPosNED
-    msg = {
-        "pos": [ue_pos[0] - local_n, ue_pos[1] - local_e, ue_pos[2] - spos[2]],
-        "att_deg": mav.uavAngEular[:],
-        "ts": time.time(),
-    }
-    sock.sendto(json.dumps(msg).encode("utf-8"), (TARGET_UDP_IP, TARGET_UDP_PORT))
+def send_ue(phase, k, target, st):
+    """
+    遥测钩子：每拍把相对起飞点的位姿发给孪生端
+    """
+    ue_pos = st.posNED
+    twin.send_state((ue_pos[0] - local_n, ue_pos[1] - local_e, ue_pos[2] - spos[2]), st.angEular)
 
+def log_fc(phase, k, target, st):
+    """
+    日志钩子：只记录 log=True 的阶段
+    """
+    global stale_ticks
+    if not phase.log:
+        return
+    if st.age() > STALE_S:
+        stale_ticks += 1
+    ue_pos = st.posNED
     fc_log.append({
         "k": k,
         "dt": DT,
-        "t": t_cmd,
-        "target": [target_n - local_n, target_e - local_e, height_z, target_yaw],
-        "pos": [(mav.uavPosNED[0] - local_n, mav.uavPosNED[1] - local_e, mav.uavPosNED[2] - spos[2])],
-        "att_deg": mav.uavAngEular[:],
+        "t": k * DT,
+        "pos": [(ue_pos[0] - local_n, ue_pos[1] - local_e, ue_pos[2] - spos[2])],
+        "att_deg": list(st.angEular),
         "ts": time.time(),
     })
 
-    now = time.time()
-    if now - _last_save >= SAVE_EVERY_S:
-        _flush_fc()
-        _last_save = now
-
-    k += 1
+def start_figure8(phase):
+    """
+    八字开始前：通知孪生端并打印当前状态
+    """
+    global t_fig8
+    twin.send_start(DT)
+    print("PosE", mav.uavPosNED)
+    print("VelE", mav.uavVelNED)
+    print("Euler", mav.uavAngEular)
+    print("Quaternion", mav.uavAngQuatern)
+    print("Rate", mav.uavAngRate)
+    print("Start control.")
+    t_fig8 = time.monotonic() # 与状态环形缓冲区同一时间轴
+
+def end_figure8(phase):
+    """
+    八字结束后：关闭日志，保存全速率位姿/速度记录
+    """
+    print("[tick] figure8", sched.format_report())
+    print("[offboard]", mav.formatOffboardReport())
+    _flush_fc()
+    for topic, ring in (("pose", mav.poseRing), ("vel", mav.velRing)):
+        raw_path = os.path.join(LOG_DIR, f"RAW_{tag}_{topic}.npz")
+        n_raw = ring.save(raw_path, t_fig8, time.monotonic())
+        print(f"[saved] {topic}:{n_raw} -> {raw_path}")
+    if stale_ticks:
+        print(f"[warn] {stale_ticks} ticks used pose older than {STALE_S}s")
+
+def start_land(phase):
+    print("Landing")
+    mav.land()
+
+print("孪生链路编码:", "binary" if twin.negotiate() else "json")
+print("进入offboard并解锁")
 
-    next_t = t0 + k * DT
-    sleep_s = next_t - time.perf_counter()
-    if sleep_s > 0:
-        time.sleep(sleep_s)
+mav.initOffboard()
+time.sleep(5)
+spos= list(mav.poseState.posNED)
+local_n = spos[0]
+local_e = spos[1]
+stale_ticks = 0
+t_fig8 = 0.0
 
-_flush_fc()
+print("初始位置:", spos)
 
-SendRealPosNED(local_n, local_e, height_z + spos[2], 0)
-t_land = 3.0
-for _ in range(int(t_land / DT)):
-    ue_pos = mav.uavPosNED
-    ue_z = ue_pos[2] - spos[2]
-    msg = {
-        "pos": [ue_pos[0] - local_n, ue_pos[1] - local_e, ue_z],
-        "att_deg": mav.uavAngEular[:],
-        "ts": time.time(),
-    }
-    sock.sendto(json.dumps(msg).encode("utf-8"), (TARGET_UDP_IP, TARGET_UDP_PORT))
-    time.sleep(DT)
-
-print("Landing")
-mav.land()
-
-for _ in range(int(10 / DT)):
-    ue_pos = mav.uavPosNED
-    ue_z = ue_pos[2] - spos[2]
-    msg = {
-        "pos": [ue_pos[0] - local_n, ue_pos[1] - local_e, ue_z],
-        "att_deg": mav.uavAngEular[:],
-        "ts": time.time(),
-    }
-    sock.sendto(json.dumps(msg).encode("utf-8"), (TARGET_UDP_IP, TARGET_UDP_PORT))
-    time.sleep(DT)
\ No newline at end of file
+send = SendRealPosVelAccNED if FEEDFORWARD else SendRealPosNED
+mission = MissionEngine.Mission(sched, send, lambda: mav.poseState, origin=spos)
+mission.hook(send_ue)
+mission.hook(log_fc)
+mission.add(MissionEngine.Phase("takeoff", 10.0, MissionEngine.SetpointTable.hold(0.0, 0.0, height_z),
+                                on_enter=lambda phase: print("发送起飞命令")))
+mission.add(MissionEngine.Phase("figure8", total_time + DT, MissionEngine.SetpointTable.from_trajectory(figure8, FEEDFORWARD),
+                                on_enter=start_figure8, on_exit=end_figure8, log=True))
+mission.add(MissionEngine.Phase("hold", 3.0, MissionEngine.SetpointTable.hold(0.0, 0.0, height_z)))
+mission.add(MissionEngine.Phase("land", 10.0, on_enter=start_land))
+mission.run()
+
+print("[tick] all phases", sched.format_report())
+print(mission.format_report())
+if bus is not None:
+    bus.close()
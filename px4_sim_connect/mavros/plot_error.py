@@ -1,5 +1,8 @@
-import json
+import argparse
+import FlyLog
+import ResultCache
 import math
+import numpy as np
 import matplotlib.pyplot as plt
 
 group_idx = 1
@@ -10,8 +13,7 @@ real1_JSON = rf"D:\code\NIMTE\rflysim\flylog\FC_20260129_lidar{group_idx}.json"
 ROUND_N = 5
 
 def load(path):
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    data = FlyLog.load_log(path)
     if data and "k" in data[0]:
         data.sort(key=lambda x: x.get("k", 0))
     else:
@@ -59,10 +61,16 @@ def get_xyz(pos):
         return pos[0]
     return pos
 
-def main():
-    sitl1 = load(sitl1_JSON)
-    hitl1 = load(hitl1_JSON)
-    real1 = load(real1_JSON)
+def compute_tracking(sitl_path, hitl_path, real_path):
+    """
+    按 k 匹配三组日志，计算各自相对 target 的位置/姿态误差
+    return: (series, stats)
+        series: 绘图用的轨迹和误差序列
+        stats: 可 JSON 序列化的统计结果，含匹配计数和各项 [mean, rms]
+    """
+    sitl1 = load(sitl_path)
+    hitl1 = load(hitl_path)
+    real1 = load(real_path)
 
     hitl1_by_k = {r['k']: r for r in hitl1 if 'k' in r}
     real1_by_k = {r['k']: r for r in real1 if 'k' in r}
@@ -88,13 +96,15 @@ def main():
             continue
         matched.append((r_sitl, r_hitl, r_real))
 
-    print(f"sitl1 entries: {len(sitl1)}")
-    print(f"hitl1 entries: {len(hitl1)}")
-    print(f"real1 entries: {len(real1)}")
-    print(f"matched (by k): {len(matched)}")
-    print(f"missing in hitl1 (wrt sitl k): {miss_hitl}")
-    print(f"missing in real1 (wrt sitl k): {miss_real}")
-    print(f"missing in any (skipped): {miss_any}")
+    counts = {
+        "sitl1 entries": len(sitl1),
+        "hitl1 entries": len(hitl1),
+        "real1 entries": len(real1),
+        "matched (by k)": len(matched),
+        "missing in hitl1 (wrt sitl k)": miss_hitl,
+        "missing in real1 (wrt sitl k)": miss_real,
+        "missing in any (skipped)": miss_any,
+    }
 
     # 轨迹数据
     tx, ty, tz = [], [], []
@@ -206,16 +216,123 @@ def main():
     rdy_mean, rdy_rms = mean_and_rms(r_dy)
     rdz_mean, rdz_rms = mean_and_rms(r_dz)
 
-    print(f"sitl pos  {fmt_stat(pos_s_mean, pos_s_rms, nd=4)}")
-    print(f"hitl pos  {fmt_stat(pos_h_mean, pos_h_rms, nd=4)}")
-    print(f"real pos  {fmt_stat(pos_r_mean, pos_r_rms, nd=4)}")
-    if att_s_valid and att_h_valid and att_r_valid:
-        print(f"sitl att  {fmt_stat(att_s_mean, att_s_rms, nd=4)}")
-        print(f"hitl att  {fmt_stat(att_h_mean, att_h_rms, nd=4)}")
-        print(f"real att  {fmt_stat(att_r_mean, att_r_rms, nd=4)}")
+    stats = {
+        "counts": counts,
+        "pos": {"sitl": [pos_s_mean, pos_s_rms], "hitl": [pos_h_mean, pos_h_rms], "real": [pos_r_mean, pos_r_rms]},
+        "att": {"sitl": [att_s_mean, att_s_rms], "hitl": [att_h_mean, att_h_rms], "real": [att_r_mean, att_r_rms]},
+        "att_complete": bool(att_s_valid and att_h_valid and att_r_valid),
+        "dx": {"sitl": [sdx_mean, sdx_rms], "hitl": [hdx_mean, hdx_rms], "real": [rdx_mean, rdx_rms]},
+        "dy": {"sitl": [sdy_mean, sdy_rms], "hitl": [hdy_mean, hdy_rms], "real": [rdy_mean, rdy_rms]},
+        "dz": {"sitl": [sdz_mean, sdz_rms], "hitl": [hdz_mean, hdz_rms], "real": [rdz_mean, rdz_rms]},
+    }
+    series = {
+        "ks": ks,
+        "target": (tx, ty, tz), "sitl": (sx, sy, sz), "hitl": (hx, hy, hz), "real": (rx, ry, rz),
+        "pos_e": (pos_e_s, pos_e_h, pos_e_r),
+        "att_e": (att_e_s, att_e_h, att_e_r),
+        "dx": (s_dx, h_dx, r_dx), "dy": (s_dy, h_dy, r_dy), "dz": (s_dz, h_dz, r_dz),
+    }
+    return series, stats
+
+def print_tracking(stats):
+    """
+    打印匹配计数与误差统计
+    """
+    for name, n in stats["counts"].items():
+        print(f"{name}: {n}")
+    for src in ("sitl", "hitl", "real"):
+        print(f"{src} pos  {fmt_stat(*stats['pos'][src], nd=4)}")
+    if stats["att_complete"]:
+        for src in ("sitl", "hitl", "real"):
+            print(f"{src} att  {fmt_stat(*stats['att'][src], nd=4)}")
     else:
         print("attitude: some entries missing (att_deg is None)")
 
+def tracking_summary(path, max_lag_s=1.0):
+    """
+    单个日志相对 target 的位置跟踪误差，用于比较前馈/非前馈等不同控制方式
+    return: dict，含位置误差 mean/rms、各轴 rms，以及使误差 rms 最小的时间滞后 lag_s
+    """
+    cols = FlyLog.load_arrays(path)
+    meta = FlyLog.read_meta(path)
+    order = np.argsort(cols["k"], kind="stable")
+    pos = cols["pos"][order]
+    tgt = cols["target"][order, :3]
+    ok = np.isfinite(pos).all(axis=1) & np.isfinite(tgt).all(axis=1)
+    pos, tgt = pos[ok], tgt[ok]
+    if len(pos) == 0:
+        # 空日志或八字段之前就中止的日志：没有可比较的数据，指标记为 NaN，不影响其他日志的对比
+        print(f"[warn] {path}: no finite pos/target rows")
+        nan = float("nan")
+        return {
+            "path": path,
+            "feedforward": meta.get("feedforward"),
+            "n": 0,
+            "pos": [nan, nan],
+            "axis_rms": [nan, nan, nan],
+            "lag_s": nan,
+            "lag_rms": nan,
+        }
+    dt = meta.get("dt") or float(np.nanmedian(cols["dt"]))
+    err = pos - tgt
+    norm = np.linalg.norm(err, axis=1)
+    # 实际位置相对 target 平移 s 拍后的误差，取最小处作为跟踪滞后
+    lags = range(min(int(round(max_lag_s / dt)), len(pos) - 1) + 1)
+    lag_rms = [np.sqrt(np.mean(np.sum((pos[s:] - tgt[:len(tgt) - s]) ** 2, axis=1))) for s in lags]
+    best = int(np.argmin(lag_rms))
+    return {
+        "path": path,
+        "feedforward": meta.get("feedforward"),
+        "n": int(len(pos)),
+        "pos": [float(norm.mean()), float(np.sqrt(np.mean(norm ** 2)))],
+        "axis_rms": np.sqrt(np.mean(err ** 2, axis=0)).tolist(),
+        "lag_s": best * dt,
+        "lag_rms": float(lag_rms[best]),
+    }
+
+def print_compare(summaries):
+    """
+    打印多个日志的跟踪误差对比，rms 变化百分比相对第一个日志
+    """
+    base = summaries[0]["pos"][1]
+    for s in summaries:
+        ff = {True: "pos+vel+acc", False: "pos", None: "unknown"}[s["feedforward"]]
+        change = (s["pos"][1] / base - 1) * 100 if base else 0.0
+        print(s["path"])
+        print(f"  setpoint {ff}  n={s['n']}  pos {fmt_stat(*s['pos'], nd=4)}  (rms {change:+.1f}% vs first)")
+        print(f"  axis rms x={s['axis_rms'][0]:.4f} y={s['axis_rms'][1]:.4f} z={s['axis_rms'][2]:.4f}"
+              f"  lag={s['lag_s']:.2f}s (rms at lag {s['lag_rms']:.4f})")
+
+def plot_tracking(series, stats):
+    """
+    图1：3D 轨迹 + 位置误差模长 + 姿态误差；图2：位置 xyz 分量误差
+    """
+    ks = series["ks"]
+    tx, ty, tz = series["target"]
+    sx, sy, sz = series["sitl"]
+    hx, hy, hz = series["hitl"]
+    rx, ry, rz = series["real"]
+    pos_e_s, pos_e_h, pos_e_r = series["pos_e"]
+    att_e_s, att_e_h, att_e_r = series["att_e"]
+    s_dx, h_dx, r_dx = series["dx"]
+    s_dy, h_dy, r_dy = series["dy"]
+    s_dz, h_dz, r_dz = series["dz"]
+    pos_s_mean, pos_s_rms = stats["pos"]["sitl"]
+    pos_h_mean, pos_h_rms = stats["pos"]["hitl"]
+    pos_r_mean, pos_r_rms = stats["pos"]["real"]
+    att_s_mean, att_s_rms = stats["att"]["sitl"]
+    att_h_mean, att_h_rms = stats["att"]["hitl"]
+    att_r_mean, att_r_rms = stats["att"]["real"]
+    sdx_mean, sdx_rms = stats["dx"]["sitl"]
+    hdx_mean, hdx_rms = stats["dx"]["hitl"]
+    rdx_mean, rdx_rms = stats["dx"]["real"]
+    sdy_mean, sdy_rms = stats["dy"]["sitl"]
+    hdy_mean, hdy_rms = stats["dy"]["hitl"]
+    rdy_mean, rdy_rms = stats["dy"]["real"]
+    sdz_mean, sdz_rms = stats["dz"]["sitl"]
+    hdz_mean, hdz_rms = stats["dz"]["hitl"]
+    rdz_mean, rdz_rms = stats["dz"]["real"]
+
     # 图1：3D + 模长误差 + 姿态误差
     fig = plt.figure(figsize=(12, 10))
     gs = fig.add_gridspec(2, 2, height_ratios=[3, 2])
@@ -269,7 +386,7 @@ def main():
     ax_att.set_ylabel("error (deg)")
     ax_att.grid(True, linestyle="--", alpha=0.6)
     ax_att.legend(loc="upper right")
-    if att_s_valid and att_h_valid and att_r_valid:
+    if stats["att_complete"]:
         ax_att.text(
             0.02, 0.98,
             "sitl1 " + fmt_stat(att_s_mean, att_s_rms, nd=3) + "\n"
@@ -332,5 +449,30 @@ def main():
 
     plt.show()
 
+def main(show_plot=True, cache=None):
+    paths = (sitl1_JSON, hitl1_JSON, real1_JSON)
+    stats = None
+    # 需要画图时必须读取原始日志，只有不画图时才直接用缓存
+    if cache is not None:
+        key = cache.make_key(paths, kind="tracking", ROUND_N=ROUND_N)
+        if not show_plot:
+            stats = cache.get(key)
+    if stats is None:
+        series, stats = compute_tracking(*paths)
+        if cache is not None:
+            cache.put(key, stats)
+    print_tracking(stats)
+    if show_plot:
+        plot_tracking(series, stats)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="轨迹跟踪误差可视化")
+    parser.add_argument("--no-plot", action="store_true", help="只打印统计结果，不画图")
+    parser.add_argument("--cache-dir", default=ResultCache.DEFAULT_DIR, help="结果缓存目录")
+    parser.add_argument("--no-cache", action="store_true", help="不使用结果缓存")
+    parser.add_argument("--compare", nargs="+", metavar="LOG", help="比较多个日志的跟踪误差（例如前馈与非前馈）")
+    args = parser.parse_args()
+    if args.compare:
+        print_compare([tracking_summary(p) for p in args.compare])
+    else:
+        main(not args.no_plot, None if args.no_cache else ResultCache.ResultCache(args.cache_dir))
\ No newline at end of file
@@ -0,0 +1,231 @@
+"""
+数字孪生 UDP 流的录制与回放，不需要真实飞行即可测试 mav_tranfer 的吞吐和时延：
+  python3 twin_replay.py play FC_xxx.jsonl --speed 1 --vehicles 50   # 飞行日志按原始时间间隔回放，复制为 50 架
+  python3 twin_replay.py play CAP_xxx.jsonl --speed 0                # 抓包文件以最快速度回放
+  python3 twin_replay.py capture --port 16520 --out CAP_xxx.jsonl    # 录制收到的数据报
+飞行日志（FC_*.json / .jsonl / .fcb）经 FlyLog.load_log 读取，按 ts（墙钟）或 t（拍时刻）确定发送时刻；
+抓包文件为 JSON Lines，首行为 {"_meta": {"capture": ...}}，之后每行是一条数据报的接收时刻和 base64 内容。
+回放时 STATE/START 报文默认换上当前时间戳（序号不变，重复回放时顺延），接收端测得的时延即回放链路本身的时延；--raw 原样发送。
+"""
+import json
+import time
+import base64
+import socket
+import argparse
+import numpy as np
+import FlyLog
+import TwinLatency
+import TwinProtocol
+
+TARGET_UDP_IP = "127.0.0.1"
+TARGET_UDP_PORT = 16520
+LISTEN_IP = "0.0.0.0"
+SPACING = 2.0 # --vehicles 复制多架时，相邻两架在 E 方向的间隔（米）
+
+
+def _pos(rec):
+    """
+    取记录中的位置，兼容 pos 的 [(x, y, z)] 嵌套写法
+    """
+    return np.ravel(rec["pos"])[:3].tolist()
+
+
+def load_fc(path, timing="ts"):
+    """
+    读取飞行日志
+    :param timing: "ts" 按记录的墙钟时刻回放（保留原始抖动），"t" 按拍时刻回放
+    :return: (发送时刻数组（相对第一条，秒）, [(pos, att), ...])
+    """
+    recs = [rec for rec in FlyLog.load_log(path) if "pos" in rec and "att_deg" in rec]
+    if not recs:
+        raise ValueError(f"no pos/att_deg records in {path}")
+    key = timing if all(timing in rec for rec in recs) else "t"
+    t = np.array([rec.get(key, i * recs[0].get("dt", 0.02)) for i, rec in enumerate(recs)], dtype=float)
+    return t - t[0], [(_pos(rec), list(rec["att_deg"])) for rec in recs]
+
+
+def load_capture(path):
+    """
+    读取抓包文件
+    :return: (接收时刻数组（相对第一条，秒）, [bytes, ...])
+    """
+    recs = FlyLog.load_jsonl(path)
+    if not recs:
+        raise ValueError(f"no datagrams in {path}")
+    t = np.array([rec["t"] for rec in recs], dtype=float)
+    return t - t[0], [base64.b64decode(rec["data"]) for rec in recs]
+
+
+def is_capture(path):
+    return path.endswith(".jsonl") and bool(FlyLog.read_meta(path).get("capture"))
+
+
+def restamp(data, seq_offset=0):
+    """
+    STATE/START 报文换上当前时间戳，车辆和内容不变；其他报文以及缺少位置/姿态或序号不是数字的报文原样返回
+    :param seq_offset: 加到序号上的偏移，重复回放时使后一轮的序号接在前一轮之后
+    """
+    pkt = TwinProtocol.decode(data)
+    if pkt is None or pkt.kind not in (TwinProtocol.KIND_STATE, TwinProtocol.KIND_START):
+        return data
+    if pkt.kind == TwinProtocol.KIND_STATE and (pkt.pos is None or pkt.att is None):
+        return data
+    if pkt.seq is not None and not isinstance(pkt.seq, (int, float)):
+        return data
+    seq = pkt.seq + seq_offset if pkt.seq is not None else None
+    if pkt.kind == TwinProtocol.KIND_START:
+        if pkt.binary:
+            return TwinProtocol.encode_start(pkt.vehicle, seq, pkt.dt)
+        return TwinProtocol.encode_json(TwinProtocol.KIND_START, pkt.vehicle, seq, dt=pkt.dt)
+    if pkt.binary:
+        return TwinProtocol.encode_state(pkt.vehicle, seq, pkt.pos, pkt.att)
+    return TwinProtocol.encode_json(TwinProtocol.KIND_STATE, pkt.vehicle, seq, pkt.pos, pkt.att)
+
+
+def answer_pings(sock):
+    """
+    非阻塞地回复接收端发来的 PING，使回放时接收端也能估计时钟偏差
+    """
+    while True:
+        try:
+            data, addr = sock.recvfrom(256)
+        except OSError:
+            return
+        pkt = TwinProtocol.decode(data)
+        if pkt is not None and pkt.kind == TwinProtocol.KIND_PING:
+            sock.sendto(TwinProtocol.encode_pong(pkt.vehicle, pkt, time.time()), addr)
+
+
+def schedule(t, speed):
+    """
+    按原始时间间隔产生发送序号：第 i 条在 start + t[i]/speed 发出，speed<=0 表示不等待
+    :return: 生成器，产生 (i, 落后于计划的秒数)
+    """
+    start = time.perf_counter()
+    for i, ti in enumerate(t.tolist()):
+        if speed > 0:
+            due = start + ti / speed
+            remain = due - time.perf_counter()
+            if remain > 0:
+                time.sleep(remain)
+            yield i, time.perf_counter() - due
+        else:
+            yield i, 0.0
+
+
+def play(args):
+    addr = (args.ip, args.port)
+    lateness = TwinLatency.LatencyHistogram()
+    sent = 0
+    if is_capture(args.log):
+        t, datagrams = load_capture(args.log)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        print(f"[replay] capture {args.log}: {len(datagrams)} datagrams over {t[-1]:.2f} s")
+        seqs = [pkt.seq for pkt in map(TwinProtocol.decode, datagrams)
+                if pkt is not None and pkt.kind in (TwinProtocol.KIND_STATE, TwinProtocol.KIND_START)
+                and pkt.seq is not None]
+        span = max(seqs) - min(seqs) + 1 if seqs else 0
+        t_start = time.perf_counter()
+        for loop in range(args.loops):
+            for i, late in schedule(t, args.speed):
+                data = datagrams[i]
+                sock.sendto(data if args.raw else restamp(data, loop * span), addr)
+                answer_pings(sock)
+                lateness.record(late)
+                sent += 1
+    else:
+        t, states = load_fc(args.log, args.timing)
+        senders = []
+        for v in range(args.vehicles):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sender = TwinProtocol.TwinSender(sock, addr, vehicle=args.vehicle + v, mode=args.mode)
+            senders.append((sender, v * SPACING))
+        binary = [sender.negotiate() for sender, _ in senders]
+        print(f"[replay] FC log {args.log}: {len(states)} samples over {t[-1]:.2f} s, "
+              f"{len(senders)} vehicles, {'binary' if all(binary) else 'json'}")
+        t_start = time.perf_counter()
+        for loop in range(args.loops):
+            for sender, _ in senders:
+                sender.send_start(float(np.median(np.diff(t))) if len(t) > 1 else 0.0)
+            for i, late in schedule(t, args.speed):
+                pos, att = states[i]
+                for sender, de in senders:
+                    sender.send_state((pos[0], pos[1] + de, pos[2]), att)
+                lateness.record(late)
+                sent += len(senders)
+    elapsed = time.perf_counter() - t_start
+    print(f"[replay] sent {sent} datagrams in {elapsed:.2f} s ({sent / max(elapsed, 1e-9):.0f}/s), "
+          f"speed {'max' if args.speed <= 0 else f'{args.speed:g}x'}")
+    print(f"[replay] lateness vs schedule: {lateness.format()}")
+
+
+def capture(args):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.bind((LISTEN_IP, args.port))
+    sock.settimeout(0.2)
+    meta = {"capture": True, "port": args.port, "start": time.time()}
+    n = 0
+    t0 = None
+    print(f"[capture] listening on {LISTEN_IP}:{args.port} -> {args.out}")
+    deadline = None if args.duration is None else time.monotonic() + args.duration
+    with open(args.out, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"_meta": meta}) + "\n")
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                try:
+                    data, src = sock.recvfrom(8192)
+                except socket.timeout:
+                    continue
+                except ConnectionResetError:
+                    continue
+                now = time.monotonic()
+                if t0 is None:
+                    t0 = now
+                if args.answer_hello:
+                    pkt = TwinProtocol.decode(data)
+                    if pkt is not None:
+                        TwinProtocol.answer_hello(pkt, sock, src)
+                f.write(json.dumps({
+                    "t": now - t0,
+                    "src": f"{src[0]}:{src[1]}",
+                    "data": base64.b64encode(data).decode("ascii"),
+                }) + "\n")
+                n += 1
+        except KeyboardInterrupt:
+            print("中断录制。")
+    print(f"[capture] {n} datagrams -> {args.out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数字孪生 UDP 流的录制与回放")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("play", help="回放飞行日志或抓包文件")
+    p.add_argument("log", help="FC_* 飞行日志（.json/.jsonl/.fcb）或抓包文件")
+    p.add_argument("--ip", default=TARGET_UDP_IP, help="接收端地址")
+    p.add_argument("--port", type=int, default=TARGET_UDP_PORT, help="接收端端口")
+    p.add_argument("--speed", type=float, default=1.0, help="回放倍速，0 表示最快速度")
+    p.add_argument("--loops", type=int, default=1, help="重复次数")
+    p.add_argument("--timing", choices=("ts", "t"), default="ts", help="飞行日志按墙钟 ts 或拍时刻 t 回放")
+    p.add_argument("--vehicle", type=int, default=1, help="飞行日志回放使用的车辆 ID（多架时为起始 ID）")
+    p.add_argument("--vehicles", type=int, default=1, help="把飞行日志复制为多架车辆同时回放")
+    p.add_argument("--mode", choices=("auto", "binary", "json"), default="auto", help="飞行日志回放的编码")
+    p.add_argument("--raw", action="store_true", help="抓包文件原样发送，不更新时间戳")
+    p.set_defaults(fn=play)
+
+    c = sub.add_parser("capture", help="录制收到的数据报")
+    c.add_argument("--port", type=int, default=TARGET_UDP_PORT, help="监听端口")
+    c.add_argument("--out", default=f"CAP_{time.strftime('%Y%m%d_%H%M%S')}.jsonl", help="抓包文件")
+    c.add_argument("--duration", type=float, default=None, help="录制时长（秒），默认直到 Ctrl+C")
+    c.add_argument("--no-answer-hello", dest="answer_hello", action="store_false",
+                   help="不回复 HELLO（发送端将退回 JSON）")
+    c.set_defaults(fn=capture)
+
+    args = parser.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()